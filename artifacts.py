@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""Compact, versioned store of fitted models for forecast-only processes
+
+Saves what forecasting needs from every series, and nothing else: the SARIMA
+state-space matrices with the filtered state at the end of the training data
+(plus the parameters and orders they came from), the GB ensembles compiled
+into node arrays, the stacker coefficients, the last months of history
+the GB recursion starts from and the GB test residuals that simulated
+prediction intervals resample. Arrays are written as uncompressed .npy files
+next to a JSON manifest in a directory named after a hash of their content,
+and are loaded memory-mapped on first use. Forecasting from a loaded store
+needs numpy only: neither statsmodels nor sklearn is imported.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from features import FeatureSpec
+from forecasting import CompiledEnsemble, recursive_gb_forecast
+from simulation import stacked_intervals
+
+# Default location of the store; LATEST names the most recently saved version
+ARTIFACT_DIR = 'artifacts'
+LATEST = 'LATEST'
+FORMAT_VERSION = 2
+
+
+# Time-invariant state-space matrices of a SARIMA results object, with the predicted state
+# and covariance for the month after its last observation
+def state_space(model_fit):
+    filtered = model_fit.filter_results
+    selection = filtered.selection[:, :, 0]
+    return {
+        'design': filtered.design[0, :, 0],
+        'transition': filtered.transition[:, :, 0],
+        'state_cov': selection @ filtered.state_cov[:, :, 0] @ selection.T,
+        'obs_cov': filtered.obs_cov[0, 0, 0],
+        'state': filtered.predicted_state[:, -1],
+        'state_cov_end': filtered.predicted_state_cov[:, :, -1],
+    }
+
+
+# State-space arrays of several SARIMA results stacked along a leading series axis,
+# zero-padding every series to the largest state dimension; padded states start at zero
+# and stay there, so they never reach a forecast
+def state_space_arrays(model_fits):
+    spaces = [state_space(model_fit) for model_fit in model_fits]
+    k = max(len(space['state']) for space in spaces)
+    n = len(spaces)
+    arrays = {
+        'design': np.zeros((n, k)),
+        'transition': np.zeros((n, k, k)),
+        'state_cov': np.zeros((n, k, k)),
+        'obs_cov': np.zeros(n),
+        'state': np.zeros((n, k)),
+        'state_cov_end': np.zeros((n, k, k)),
+    }
+    for i, space in enumerate(spaces):
+        m = len(space['state'])
+        arrays['design'][i, :m] = space['design']
+        arrays['transition'][i, :m, :m] = space['transition']
+        arrays['state_cov'][i, :m, :m] = space['state_cov']
+        arrays['obs_cov'][i] = space['obs_cov']
+        arrays['state'][i, :m] = space['state']
+        arrays['state_cov_end'][i, :m, :m] = space['state_cov_end']
+    return arrays
+
+
+def _write_json(file, content):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(file), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(content, f, indent=1)
+    os.replace(tmp, file)
+
+
+# Save the models of every (file, column) in keys. history is the (n_months, n_series) array
+# the models were fitted on and last_month the date of its last row. Returns the version
+# gb_residuals are the GB out-of-sample residuals of each series, in the order of keys
+def save_artifacts(keys, sarima_models, gb_models, stackers, history, last_month, feature_spec, gb_residuals, path=ARTIFACT_DIR):
+    keys = [tuple(key) for key in keys]
+    sarima = [sarima_models[file][column] for file, column in keys]
+    arrays = state_space_arrays(sarima)
+
+    n_features = len(feature_spec.names)
+    ensemble = CompiledEnsemble.from_models([gb_models[file][column] for file, column in keys], n_features)
+    for name in CompiledEnsemble.ARRAYS:
+        arrays[name] = getattr(ensemble, name)
+
+    arrays['stacker_coef'] = np.array([stackers[file][column].coef_ for file, column in keys], dtype=np.float64)
+    arrays['stacker_intercept'] = np.array([stackers[file][column].intercept_ for file, column in keys], dtype=np.float64)
+    arrays['history'] = np.asarray(history, dtype=np.float64)[-feature_spec.history:]
+    # Padded with NaN to one (n_series, n_residuals) array; the simulation drops missing values
+    residuals = [np.asarray(r, dtype=np.float64) for r in gb_residuals]
+    arrays['gb_residuals'] = np.full((len(keys), max(len(r) for r in residuals)), np.nan)
+    for j, r in enumerate(residuals):
+        arrays['gb_residuals'][j, :len(r)] = r
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'keys': [list(key) for key in keys],
+        'last_month': str(np.datetime64(last_month, 'M')),
+        'feature_spec': {'lags': list(feature_spec.lags), 'windows': list(feature_spec.windows),
+                         'calendar': feature_spec.calendar},
+        'gb_depth': ensemble.depth,
+        'sarima': [{
+            'order': list(model_fit.model.order),
+            'seasonal_order': list(model_fit.model.seasonal_order),
+            'param_names': list(model_fit.model.param_names),
+            'params': np.asarray(model_fit.params, dtype=np.float64).tolist(),
+        } for model_fit in sarima],
+        'arrays': {name: {'dtype': str(array.dtype), 'shape': list(array.shape)} for name, array in arrays.items()},
+    }
+
+    # The version is a hash of the content, so saving unchanged models is a no-op
+    h = hashlib.sha256(json.dumps(manifest, sort_keys=True).encode('utf-8'))
+    for name in sorted(arrays):
+        h.update(arrays[name].tobytes())
+    version = h.hexdigest()[:16]
+
+    os.makedirs(path, exist_ok=True)
+    target = os.path.join(path, version)
+    if not os.path.isdir(target):
+        # Write into a temporary directory and rename it, so readers never see a partial version
+        staging = tempfile.mkdtemp(dir=path, prefix='.tmp-')
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(staging, f'{name}.npy'), array)
+            _write_json(os.path.join(staging, 'manifest.json'), dict(manifest, version=version, created=time.time()))
+            os.replace(staging, target)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+            if not os.path.isdir(target):
+                raise
+    with open(os.path.join(path, f'.{LATEST}.tmp'), 'w') as f:
+        f.write(version)
+    os.replace(os.path.join(path, f'.{LATEST}.tmp'), os.path.join(path, LATEST))
+    return version
+
+
+class ModelArtifacts:
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        if self.manifest['format_version'] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported artifact format {self.manifest['format_version']} in {directory}")
+        self.version = self.manifest['version']
+        self.keys = [tuple(key) for key in self.manifest['keys']]
+        spec = self.manifest['feature_spec']
+        self.feature_spec = FeatureSpec(spec['lags'], spec['windows'], spec['calendar'])
+        self._arrays = {}
+        self._ensemble = None
+
+    # Arrays are memory-mapped the first time they are used
+    def array(self, name):
+        if name not in self._arrays:
+            self._arrays[name] = np.load(os.path.join(self.directory, f'{name}.npy'), mmap_mode='r')
+        return self._arrays[name]
+
+    @property
+    def ensemble(self):
+        if self._ensemble is None:
+            arrays = [self.array(name) for name in CompiledEnsemble.ARRAYS]
+            self._ensemble = CompiledEnsemble(*arrays, depth=self.manifest['gb_depth'])
+        return self._ensemble
+
+    # First day of each of the steps months after the end of the training data
+    def forecast_dates(self, steps):
+        return (np.datetime64(self.manifest['last_month'], 'M') + np.arange(1, steps + 1)).astype('datetime64[D]')
+
+    def forecast_months(self, steps):
+        return (np.datetime64(self.manifest['last_month'], 'M').astype(int) + 1 + np.arange(steps)) % 12 + 1
+
+    # SARIMA forecast mean and variance of every series, (steps, n_series) each, by running
+    # the Kalman prediction step of all series at once
+    def sarima_forecast(self, steps):
+        Z, T, RQR, H = (self.array(name) for name in ('design', 'transition', 'state_cov', 'obs_cov'))
+        a = np.array(self.array('state'))
+        P = np.array(self.array('state_cov_end'))
+        mean = np.empty((steps, len(self.keys)))
+        variance = np.empty((steps, len(self.keys)))
+        for step in range(steps):
+            mean[step] = np.einsum('nk,nk->n', Z, a)
+            variance[step] = np.einsum('nk,nkl,nl->n', Z, P, Z) + H
+            a = np.einsum('nkl,nl->nk', T, a)
+            P = T @ P @ T.transpose(0, 2, 1) + RQR
+        return mean, variance
+
+    def gb_forecast(self, steps):
+        return recursive_gb_forecast(self.ensemble, self.array('history'), self.feature_spec, self.forecast_months(steps), steps)
+
+    # Stacked forecasts of every series, (steps, n_series)
+    def forecast(self, steps):
+        sarima_mean, _ = self.sarima_forecast(steps)
+        gb = self.gb_forecast(steps)
+        coef = self.array('stacker_coef')
+        return sarima_mean * coef[:, 0] + gb * coef[:, 1] + self.array('stacker_intercept')
+
+    # Simulated prediction intervals around the stacked forecasts (see simulation.stacked_intervals)
+    def stacked_intervals(self, steps, levels, n_paths, seed=None, forecast=None):
+        arrays = {name: self.array(name) for name in ('design', 'transition', 'state_cov', 'obs_cov', 'state', 'state_cov_end')}
+        return stacked_intervals(arrays, self.ensemble.predict_rows, self.array('history'), self.feature_spec,
+                                 self.forecast_months(steps), list(self.array('gb_residuals')), self.array('stacker_coef'),
+                                 self.array('stacker_intercept'), steps, levels=levels, n_paths=n_paths, seed=seed,
+                                 forecast=forecast)
+
+
+# Open a saved version, by default the latest one
+def load_artifacts(path=ARTIFACT_DIR, version=None):
+    if version is None:
+        with open(os.path.join(path, LATEST)) as f:
+            version = f.read().strip()
+    return ModelArtifacts(os.path.join(path, version))
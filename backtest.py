@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""Walk-forward (rolling-origin) backtesting
+
+Evaluates SARIMA, GB and stacked forecasts from several forecast origins.
+Each series' SARIMA model is fitted once, at the first origin, and its
+state-space filter is then extended to each later origin instead of being
+refitted. The GB models of every fold are fitted in parallel, and the
+stacking meta-model of a fold is trained only on out-of-fold predictions
+from earlier folds whose test windows have closed by its origin. A time
+budget bounds the SARIMA fits and drops the oldest GB folds.
+"""
+
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from sklearn.ensemble import GradientBoostingRegressor
+
+from features import complete_rows
+from forecasting import recursive_gb_forecast
+from metrics import metrics_table
+from sarima_search import FitTimeout, fit_sarima_model
+
+# Default SARIMA specification when no searched orders are given
+DEFAULT_ORDER = {'order': (2, 1, 2), 'seasonal_order': (1, 1, 1, 12)}
+
+
+# Forecast origins (row positions), oldest first, with the last test window ending at the last month
+def forecast_origins(n_months, n_origins, horizon, step):
+    last = n_months - horizon
+    origins = [last - k * step for k in reversed(range(n_origins))]
+    return [origin for origin in origins if origin > 0]
+
+
+# SARIMA forecasts of one series at every origin: fit once at the first origin, then
+# extend the filter with the months between consecutive origins. This is deliberate: the
+# parameters are estimated on the months before the oldest origin only, so no fold sees its
+# test window, and each later fold conditions on its newer months through the filter at the
+# cost of one fit per series instead of one per fold. Later folds therefore score slightly
+# staler parameters than a model refitted at their origin would have. The fit stops at
+# deadline (time.time() seconds); the series then has no SARIMA forecasts (None)
+def _sarima_folds(series, origins, horizon, order, cache, name, deadline=None):
+    forecasts = np.full((len(origins), horizon), np.nan)
+    time_limit = None if deadline is None else deadline - time.time()
+    if time_limit is not None and time_limit <= 0:
+        return None
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        try:
+            model_fit = fit_sarima_model(series[:origins[0]], order['order'], order['seasonal_order'], cache, name, warm_start=True,
+                                         time_limit=time_limit)
+        except FitTimeout:
+            return None
+        # Extending only runs the filter over the new months, so it is not held to the deadline
+        for k, origin in enumerate(origins):
+            if k > 0:
+                model_fit = model_fit.extend(series[origins[k - 1]:origin])
+            forecasts[k] = np.asarray(model_fit.forecast(steps=horizon))
+    return forecasts
+
+
+def _sarima_job(job):
+    j, series, origins, horizon, order, cache, name, deadline = job
+    return j, _sarima_folds(series, origins, horizon, order, cache, name, deadline)
+
+
+# GB models for every series fitted on the months before origin, then one batched recursive forecast
+def _gb_fold(values, months, origin, horizon, feature_spec):
+    X, y = feature_spec.build(values[:origin], months[:origin])
+    complete = complete_rows(X, y)
+    models = []
+    for j in range(values.shape[1]):
+        gb = GradientBoostingRegressor(random_state=42)
+        gb.fit(X[complete[:, j], j], y[complete[:, j], j])
+        models.append(gb)
+    return recursive_gb_forecast(models, values[:origin], feature_spec, months[origin:origin + horizon], horizon)
+
+
+def _gb_job(job):
+    k, values, months, origin, horizon, feature_spec = job
+    return k, _gb_fold(values, months, origin, horizon, feature_spec)
+
+
+# Stacked forecasts per fold, with each fold's per-series meta-model fitted on the
+# (SARIMA, GB, actual) rows of earlier folds only; before there are enough of those
+# the stack falls back to the mean of the two base forecasts
+def stack_out_of_fold(sarima, gb, actuals, origins, horizon, min_rows=3):
+    stacked = (sarima + gb) / 2
+    for k, origin in enumerate(origins):
+        closed = [i for i in range(k) if origins[i] + horizon <= origin]
+        if not closed:
+            continue
+        for j in range(sarima.shape[2]):
+            s, g, a = (array[closed, :, j].ravel() for array in (sarima, gb, actuals))
+            rows = np.isfinite(s) & np.isfinite(g) & np.isfinite(a)
+            if rows.sum() < min_rows:
+                continue
+            A = np.column_stack([np.ones(rows.sum()), s[rows], g[rows]])
+            coef = np.linalg.lstsq(A, a[rows], rcond=None)[0]
+            stacked[k, :, j] = coef[0] + coef[1] * sarima[k, :, j] + coef[2] * gb[k, :, j]
+    return stacked
+
+
+def _init_worker():
+    # One BLAS thread per worker so the pool, not numpy, owns the cores
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(1)
+    except ImportError:
+        pass
+
+
+def _pool(n_jobs):
+    if n_jobs is None or n_jobs <= 0:
+        n_jobs = os.cpu_count() or 1
+    return ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker)
+
+
+# Rolling-origin backtest of the SARIMA, GB and stacked models over a Panel.
+# Folds run most recent first, so when time_budget (seconds) runs out the folds
+# that are dropped are the oldest ones. The budget also bounds each SARIMA fit;
+# a series whose fit does not finish in time keeps NaN SARIMA and stacked
+# forecasts and is listed under 'sarima_skipped'. GB folds already running when
+# the budget runs out still finish. Raises RuntimeError when no fold finishes
+def walk_forward_backtest(panel, feature_spec, n_origins=8, horizon=12, step=12, orders=None, cache=None,
+                          n_jobs=None, time_budget=None):
+    started = time.monotonic()
+    # Wall-clock deadline, as the SARIMA fits check it in the worker processes
+    deadline = None if time_budget is None else time.time() + time_budget
+    values = panel.values
+    months = np.asarray(panel.index.month)
+    keys = panel.keys()
+    origins = forecast_origins(len(panel), n_origins, horizon, step)
+    if not origins:
+        raise ValueError(f'{len(panel)} months are too few for a backtest with a {horizon}-month horizon')
+
+    actuals = np.stack([values[origin:origin + horizon] for origin in origins])
+    sarima = np.full(actuals.shape, np.nan)
+    gb = np.full(actuals.shape, np.nan)
+    done = set()
+    sarima_skipped = []
+
+    with _pool(n_jobs) as executor:
+        jobs = {}
+        for j, (file, column) in enumerate(keys):
+            order = (orders or {}).get(file, {}).get(column, DEFAULT_ORDER)
+            job = (j, values[:, j], origins, horizon, order, cache, f'{file}|{column}', deadline)
+            jobs[executor.submit(_sarima_job, job)] = ('SARIMA', j)
+        for k in reversed(range(len(origins))):
+            jobs[executor.submit(_gb_job, (k, values, months, origins[k], horizon, feature_spec))] = ('GB', k)
+
+        for future in as_completed(jobs):
+            if future.cancelled():
+                continue
+            position, forecasts = future.result()
+            if jobs[future][0] == 'GB':
+                gb[position] = forecasts
+                done.add(position)
+            elif forecasts is None:
+                sarima_skipped.append(keys[position])
+            else:
+                sarima[:, :, position] = forecasts
+            # Out of time: drop the jobs that have not started; running SARIMA fits stop at the deadline
+            if deadline is not None and time.time() > deadline:
+                for pending, (kind, position) in jobs.items():
+                    if not pending.cancelled() and pending.cancel() and kind == 'SARIMA':
+                        sarima_skipped.append(keys[position])
+
+    if not done:
+        raise RuntimeError(f'No backtest fold finished within the time budget of {time_budget}s')
+    if sarima_skipped:
+        warnings.warn(f'SARIMA of {len(sarima_skipped)} series not fitted within the backtest time budget of {time_budget}s',
+                      RuntimeWarning)
+
+    # Keep the folds whose GB forecasts finished within the budget
+    folds = sorted(done)
+    origins = [origins[k] for k in folds]
+    actuals, sarima, gb = actuals[folds], sarima[folds], gb[folds]
+    stacked = stack_out_of_fold(sarima, gb, actuals, origins, horizon)
+
+    # Metrics for every fold, series and model in one pass over (model x fold x series x time)
+    predictions = {'SARIMA': sarima, 'GB': gb, 'Stacked': stacked}
+    metrics = metrics_table(actuals.transpose(0, 2, 1), {model: forecast.transpose(0, 2, 1) for model, forecast in predictions.items()}, keys)
+    metrics.insert(2, 'origin', [panel.index[origins[k]] for k in metrics['fold']])
+
+    return {
+        'origins': [panel.index[origin] for origin in origins],
+        'actuals': actuals,
+        'predictions': predictions,
+        'metrics': metrics,
+        'sarima_skipped': [key for key in keys if key in sarima_skipped],
+        'elapsed': time.monotonic() - started
+    }
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""Timed benchmarks of the pipeline stages on synthetic EIA-like data
+
+Generates `Table_*.xlsx` workbooks with synthetic_data for any number of
+series and years, then times the stages of the pipeline on them: ingest
+(Excel parse and cached load), the SARIMA order search, SARIMA fitting,
+per-series and global GB training, the stacked forecast and evaluation,
+and the startup of the command line: importing it, and a forecast from
+saved artifacts in a fresh process. With --high-frequency it instead times
+fitting and forecasting the high-frequency mode on synthetic hourly load
+series of 10^5 to 10^7 points.
+Each benchmark runs `repeat` times and keeps every run with its median.
+Results are saved as JSON with the configuration and environment, and a run
+can be compared against a saved baseline, reporting every stage that got
+slower than the tolerance allows.
+
+    python benchmarks.py --series 12 --years 50 --save-baseline
+    python benchmarks.py --series 12 --years 50 --compare
+    python benchmarks.py --high-frequency --sizes 100000 1000000 10000000
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+
+BENCHMARK_DIR = 'benchmark_results'
+BASELINE = 'baseline.json'
+HIGH_FREQUENCY_BASELINE = 'baseline_high_frequency.json'
+
+# A stage is a regression when its median is this much slower than the baseline's, and by more
+# than MIN_DELTA seconds, so millisecond stages don't trip on timer noise
+TOLERANCE = 0.2
+MIN_DELTA = 0.01
+
+FORECAST_LENGTH = 108
+SEARCH_MAX_FITS = 10
+
+# Series lengths of the high-frequency benchmarks and the hours forecast from each
+HIGH_FREQUENCY_SIZES = (10 ** 5, 10 ** 6, 10 ** 7)
+HIGH_FREQUENCY_HORIZON = 168
+
+
+def _environment():
+    import pandas as pd
+    import sklearn
+    import statsmodels
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'statsmodels': statsmodels.__version__,
+        'sklearn': sklearn.__version__,
+    }
+
+
+# Run function repeat times, calling setup (untimed) before each run. Returns the last result and the run times
+def _time(function, repeat, setup=None):
+    runs = []
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        result = function()
+        runs.append(time.perf_counter() - started)
+    return result, runs
+
+
+def _nested(keys, models):
+    nested = {}
+    for (file, column), model in zip(keys, models):
+        nested.setdefault(file, {})[column] = model
+    return nested
+
+
+def _summary(runs, items):
+    return {'median_s': statistics.median(runs), 'min_s': min(runs), 'runs': runs, 'items': items}
+
+
+# Time every stage on n_series synthetic series of years years, working in directory (a temporary
+# directory when None). Returns the results, ready for save_results
+def run_benchmarks(n_series=12, years=50, repeat=3, directory=None, max_fits=SEARCH_MAX_FITS,
+                   forecast_length=FORECAST_LENGTH, seed=0, verbose=True):
+    from sklearn.ensemble import GradientBoostingRegressor
+    from sklearn.linear_model import LinearRegression
+
+    from artifacts import save_artifacts
+    from backtest import DEFAULT_ORDER
+    from features import FeatureSpec, complete_rows, future_months
+    from forecasting import generate_forecasts
+    from global_model import GlobalGBModel
+    from ingest import load_table, parse_table
+    from metrics import metrics_table
+    from panel import Panel
+    from sarima_search import best_sarima_params, fit_sarima_model
+    from synthetic_data import write_tables
+
+    temporary = tempfile.TemporaryDirectory() if directory is None else None
+    directory = temporary.name if temporary is not None else directory
+    data_dir = os.path.join(directory, 'data')
+    cache_dir = os.path.join(directory, 'ingest_cache')
+    results = {}
+
+    def record(name, runs, items):
+        results[name] = _summary(runs, items)
+        if verbose:
+            print(f"{name:20s} median {results[name]['median_s']:8.3f}s  min {results[name]['min_s']:8.3f}s  ({items} items)")
+
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            layout = write_tables(data_dir, n_series, years, seed=seed)
+            files = {os.path.join(data_dir, file): columns for file, columns in layout.items()}
+
+            # Ingest: parsing every workbook, then loading them again from the columnar cache
+            _, runs = _time(lambda: {file: parse_table(file, columns) for file, columns in files.items()}, repeat)
+            record('ingest_parse', runs, len(files))
+            clear_cache = lambda: shutil.rmtree(cache_dir, ignore_errors=True)
+            _time(lambda: [load_table(file, columns, cache_dir) for file, columns in files.items()], 1, clear_cache)
+            datasets, runs = _time(lambda: {os.path.basename(file): load_table(file, columns, cache_dir)
+                                            for file, columns in files.items()}, repeat)
+            record('ingest_cached', runs, len(files))
+
+            panel = Panel.from_datasets(datasets, layout)
+            train_panel, test_panel = panel.split(test_size=0.2)
+            keys = panel.keys()
+            n_test = len(test_panel)
+
+            # SARIMA order search on the first series (stepwise, no fit cache)
+            first = train_panel.values[:, 0]
+            first = first[np.isfinite(first)]
+            _, runs = _time(lambda: best_sarima_params(first, method='stepwise', max_fits=max_fits), repeat)
+            record('best_sarima_params', runs, 1)
+
+            # SARIMA fits of every series at the default orders, each predicting the test months
+            def fit_all():
+                models, predictions = [], []
+                for j in range(len(keys)):
+                    model_fit = fit_sarima_model(train_panel.values[:, j], DEFAULT_ORDER['order'], DEFAULT_ORDER['seasonal_order'])
+                    models.append(model_fit)
+                    predictions.append(model_fit.forecast(steps=n_test))
+                return models, np.array(predictions)
+            (sarima_models, sarima_predictions), runs = _time(fit_all, repeat)
+            record('fit_sarima', runs, len(keys))
+
+            # GB training: one model per series, then the global model on the pooled features
+            feature_spec = FeatureSpec(lags=range(1, 13), windows=(3, 12), calendar=True)
+            X_all, y_all = feature_spec.build(panel.values, panel.index.month)
+            complete = complete_rows(X_all, y_all)
+            n_train_rows = len(train_panel) - feature_spec.history
+
+            def train_gb():
+                models = []
+                for j in range(len(keys)):
+                    rows = complete[:n_train_rows, j]
+                    models.append(GradientBoostingRegressor(random_state=42).fit(X_all[:n_train_rows, j][rows], y_all[:n_train_rows, j][rows]))
+                return models
+            gb_models, runs = _time(train_gb, repeat)
+            record('gb_train', runs, len(keys))
+            gb_predictions = np.array([model.predict(X_all[n_train_rows:, j]) for j, model in enumerate(gb_models)])
+
+            _, runs = _time(lambda: GlobalGBModel(panel.metadata, feature_spec).fit(
+                X_all[:n_train_rows], y_all[:n_train_rows], complete[:n_train_rows]), repeat)
+            record('global_gb_train', runs, len(keys))
+
+            # Stacked forecast of every series, SARIMA recursions included
+            stackers = [LinearRegression().fit(np.column_stack([sarima_predictions[j], gb_predictions[j]]), test_panel.values[:, j])
+                        for j in range(len(keys))]
+            months = future_months(train_panel.index[-1].month, forecast_length)
+            _, runs = _time(lambda: generate_forecasts(sarima_models, train_panel.values, gb_models, stackers,
+                                                       forecast_length, feature_spec, months), repeat)
+            record('generate_forecast', runs, len(keys))
+
+            # Startup of the command line in a fresh interpreter: the bare import, then a forecast from saved artifacts
+            artifact_dir = os.path.join(directory, 'artifacts')
+            save_artifacts(keys, _nested(keys, sarima_models), _nested(keys, gb_models), _nested(keys, stackers),
+                           train_panel.values, train_panel.index[-1], feature_spec,
+                           test_panel.values.T - gb_predictions, artifact_dir)
+            package_dir = os.path.dirname(os.path.abspath(__file__))
+            _, runs = _time(lambda: subprocess.run([sys.executable, '-c', 'import cli'], cwd=package_dir, check=True), repeat)
+            record('startup_import', runs, 1)
+            _, runs = _time(lambda: subprocess.run([sys.executable, os.path.join(package_dir, 'cli.py'), 'forecast', '--path', artifact_dir,
+                                                    '--horizon', '12', '--output', os.devnull], check=True), repeat)
+            record('startup_forecast', runs, len(keys))
+
+            # Evaluation of the SARIMA, GB and stacked test predictions
+            stacked_predictions = np.array([stacker.predict(np.column_stack([sarima_predictions[j], gb_predictions[j]]))
+                                            for j, stacker in enumerate(stackers)])
+            predictions = {'SARIMA': sarima_predictions, 'GB': gb_predictions, 'Stacked': stacked_predictions}
+            _, runs = _time(lambda: metrics_table(test_panel.values.T, predictions, keys), repeat)
+            record('evaluation', runs, len(keys))
+    finally:
+        if temporary is not None:
+            temporary.cleanup()
+
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'series': n_series, 'years': years, 'repeat': repeat, 'max_fits': max_fits,
+                   'forecast_length': forecast_length, 'seed': seed},
+        'environment': _environment(),
+        'benchmarks': results,
+    }
+
+
+# Time fitting the high-frequency forecaster (with daily aggregation) on synthetic hourly load
+# series of every size in sizes, and forecasting horizon hours and a week of daily means from it
+def run_high_frequency_benchmarks(sizes=HIGH_FREQUENCY_SIZES, repeat=1, horizon=HIGH_FREQUENCY_HORIZON, seed=0, verbose=True):
+    from high_frequency import HighFrequencyForecaster
+    from synthetic_data import synthetic_load
+
+    results = {}
+    for size in sizes:
+        y = synthetic_load(size, missing_rate=0.001, seed=seed)
+        model, runs = _time(lambda: HighFrequencyForecaster(aggregate=24).fit(y), repeat)
+        results[f'hf_fit_{size}'] = _summary(runs, size)
+        _, runs = _time(lambda: (model.forecast(horizon), model.forecast_aggregated(7)), repeat)
+        results[f'hf_forecast_{size}'] = _summary(runs, size)
+        if verbose:
+            print(f"{size:>10d} points: fit median {results[f'hf_fit_{size}']['median_s']:8.3f}s, "
+                  f"forecast median {results[f'hf_forecast_{size}']['median_s']:8.3f}s")
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'mode': 'high_frequency', 'sizes': list(sizes), 'repeat': repeat, 'horizon': horizon, 'seed': seed},
+        'environment': _environment(),
+        'benchmarks': results,
+    }
+
+
+# Write results as JSON under directory (timestamped, or as name) and return the path
+def save_results(results, directory=BENCHMARK_DIR, name=None):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name or f"{results['created'].replace(':', '')}.json")
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    return path
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+# Median time of every stage against the baseline: {stage: {'baseline_s', 'median_s', 'ratio', 'regression'}}
+def compare_results(results, baseline, tolerance=TOLERANCE, min_delta=MIN_DELTA):
+    comparison = {}
+    for name, result in results['benchmarks'].items():
+        reference = baseline['benchmarks'].get(name)
+        if reference is None:
+            continue
+        ratio = result['median_s'] / reference['median_s'] if reference['median_s'] > 0 else float('inf')
+        comparison[name] = {'baseline_s': reference['median_s'], 'median_s': result['median_s'], 'ratio': ratio,
+                            'regression': ratio > 1 + tolerance and result['median_s'] - reference['median_s'] > min_delta}
+    return comparison
+
+
+def _print_comparison(results, baseline, comparison):
+    # The number of repeats changes how steady the medians are, not what is measured
+    if {k: v for k, v in results['config'].items() if k != 'repeat'} != {k: v for k, v in baseline['config'].items() if k != 'repeat'}:
+        print(f"Warning: configuration differs from the baseline ({baseline['config']})")
+    if results['environment'] != baseline['environment']:
+        print('Warning: environment differs from the baseline')
+    for name, row in comparison.items():
+        flag = '  REGRESSION' if row['regression'] else ''
+        print(f"{name:20s} {row['baseline_s']:8.3f}s -> {row['median_s']:8.3f}s  x{row['ratio']:.2f}{flag}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages on synthetic EIA-like tables')
+    parser.add_argument('--series', type=int, default=12)
+    parser.add_argument('--years', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-fits', type=int, default=SEARCH_MAX_FITS, help='fits allowed in the stepwise order search')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--high-frequency', action='store_true', help='benchmark the high-frequency mode instead')
+    parser.add_argument('--sizes', type=int, nargs='*', default=list(HIGH_FREQUENCY_SIZES), help='high-frequency series lengths')
+    parser.add_argument('--output', default=BENCHMARK_DIR, help='directory for the result files')
+    parser.add_argument('--save-baseline', action='store_true', help='also save this run as the baseline')
+    parser.add_argument('--compare', action='store_true', help='compare this run against the baseline')
+    parser.add_argument('--baseline', default=None, help=f'baseline file (default: OUTPUT/{BASELINE} or OUTPUT/{HIGH_FREQUENCY_BASELINE})')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    if args.high_frequency:
+        results = run_high_frequency_benchmarks(args.sizes, args.repeat, seed=args.seed)
+    else:
+        results = run_benchmarks(args.series, args.years, args.repeat, max_fits=args.max_fits, seed=args.seed)
+    print(f'Saved {save_results(results, args.output)}')
+    baseline_path = args.baseline or os.path.join(args.output, HIGH_FREQUENCY_BASELINE if args.high_frequency else BASELINE)
+    if args.save_baseline:
+        print(f'Saved baseline {save_results(results, os.path.dirname(baseline_path) or ".", os.path.basename(baseline_path))}')
+    elif args.compare:
+        baseline = load_results(baseline_path)
+        comparison = compare_results(results, baseline, args.tolerance)
+        _print_comparison(results, baseline, comparison)
+        if any(row['regression'] for row in comparison.values()):
+            sys.exit(1)
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""Headless chart rendering for unattended reports
+
+A chart is a plain dict of the data and styling behind one figure (lines,
+an optional shaded band or box plots), so it can be shown interactively,
+pickled to a worker process or hashed. render_report() draws every chart
+with the non-interactive Agg backend in a process pool, writes PNG and/or
+SVG files and an HTML index, and skips charts whose content hash matches
+the one recorded by the previous run and whose files are still on disk.
+"""
+
+import hashlib
+import html
+import json
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+REPORT_DIR = 'report'
+FORMATS = ('png', 'svg')
+MANIFEST = 'charts.json'
+DPI = 100
+
+# Bump when the drawing code changes, so every chart is rendered again
+RENDER_VERSION = 1
+
+
+def _array(values):
+    values = np.asarray(values)
+    if values.dtype.kind == 'M':
+        return values.astype('datetime64[ns]')
+    if values.dtype.kind == 'O':
+        try:
+            return values.astype('datetime64[ns]')
+        except (TypeError, ValueError):
+            pass
+    return values.astype(np.float64)
+
+
+def line(x, y, label, **style):
+    return {'x': _array(x), 'y': _array(y), 'label': label, 'style': style}
+
+
+# Line chart; band is an optional (x, lower, upper, label, style) shaded interval
+def line_chart(name, section, title, xlabel, ylabel, lines, band=None, figsize=(14, 6), grid=False, tight=False):
+    if band is not None:
+        x, lower, upper, label, style = band
+        band = {'x': _array(x), 'lower': _array(lower), 'upper': _array(upper), 'label': label, 'style': style}
+    return {'kind': 'lines', 'name': name, 'section': section, 'title': title, 'xlabel': xlabel, 'ylabel': ylabel,
+            'lines': lines, 'band': band, 'figsize': figsize, 'grid': grid, 'tight': tight}
+
+
+# One box per column of a DataFrame, ignoring missing months
+def box_chart(name, section, title, ylabel, frame, figsize=(14, 6)):
+    boxes = [(str(column), _array(frame[column].dropna())) for column in frame.columns]
+    return {'kind': 'box', 'name': name, 'section': section, 'title': title, 'xlabel': None, 'ylabel': ylabel,
+            'boxes': boxes, 'figsize': figsize, 'grid': True, 'tight': True}
+
+
+# Hash of everything that affects the rendered image
+def chart_key(chart, formats=FORMATS):
+    h = hashlib.sha256(f'{RENDER_VERSION}|{sorted(formats)}|{DPI}'.encode('utf-8'))
+
+    def feed(value):
+        if isinstance(value, np.ndarray):
+            h.update(f'{value.dtype}{value.shape}'.encode('utf-8'))
+            h.update(np.ascontiguousarray(value).tobytes())
+        elif isinstance(value, dict):
+            for name in sorted(value):
+                h.update(name.encode('utf-8'))
+                feed(value[name])
+        elif isinstance(value, (list, tuple)):
+            h.update(b'[')
+            for item in value:
+                feed(item)
+            h.update(b']')
+        else:
+            h.update(repr(value).encode('utf-8'))
+
+    feed(chart)
+    return h.hexdigest()
+
+
+# File name stem of a chart: its name with anything unsafe in a path replaced
+def chart_stem(chart):
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', chart['name']).strip('_')
+
+
+# Draw a chart onto a matplotlib Figure
+def draw_chart(chart, figure):
+    ax = figure.add_subplot()
+    if chart['kind'] == 'box':
+        labels = [label for label, _ in chart['boxes']]
+        ax.boxplot([values for _, values in chart['boxes']])
+        ax.set_xticks(range(1, len(labels) + 1), labels, rotation=45, ha='right')
+    else:
+        for series in chart['lines']:
+            ax.plot(series['x'], series['y'], label=series['label'], **series['style'])
+        band = chart['band']
+        if band is not None:
+            ax.fill_between(band['x'], band['lower'], band['upper'], label=band['label'], **band['style'])
+        ax.legend()
+    ax.set_title(chart['title'])
+    if chart['xlabel']:
+        ax.set_xlabel(chart['xlabel'])
+    ax.set_ylabel(chart['ylabel'])
+    if chart['grid']:
+        ax.grid(True)
+    if chart['tight']:
+        figure.tight_layout()
+    return figure
+
+
+# Interactive display through pyplot, as the notebook did
+def show_chart(chart):
+    import matplotlib.pyplot as plt
+    draw_chart(chart, plt.figure(figsize=chart['figsize']))
+    plt.show()
+
+
+# Render one chart to every format with the Agg canvas; no pyplot state is touched
+def render_chart(chart, directory, formats=FORMATS):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=chart['figsize'], dpi=DPI)
+    FigureCanvasAgg(figure)
+    draw_chart(chart, figure)
+    files = []
+    for fmt in formats:
+        file = f'{chart_stem(chart)}.{fmt}'
+        figure.savefig(os.path.join(directory, file), format=fmt)
+        files.append(file)
+    return files
+
+
+def _render_job(job):
+    chart, directory, formats = job
+    return render_chart(chart, directory, formats)
+
+
+def _write_index(directory, charts, files, title):
+    parts = [f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{html.escape(title)}</title>',
+             '<style>body{font-family:sans-serif;margin:2em}img{max-width:100%}figure{margin:0 0 2em}</style>',
+             f'</head><body>\n<h1>{html.escape(title)}</h1>']
+    sections = list(dict.fromkeys(chart['section'] for chart in charts))
+    parts.append('<ul>' + ''.join(f'<li><a href="#section-{i}">{html.escape(section)}</a></li>'
+                                  for i, section in enumerate(sections)) + '</ul>')
+    for i, section in enumerate(sections):
+        parts.append(f'<h2 id="section-{i}">{html.escape(section)}</h2>')
+        for chart in charts:
+            if chart['section'] != section:
+                continue
+            chart_files = files[chart['name']]
+            links = ' '.join(f'<a href="{html.escape(file)}">{file.rsplit(".", 1)[1]}</a>' for file in chart_files)
+            parts.append(f'<figure><img src="{html.escape(chart_files[0])}" alt="{html.escape(chart["title"])}" loading="lazy">'
+                         f'<figcaption>{html.escape(chart["title"])} ({links})</figcaption></figure>')
+    parts.append('</body></html>\n')
+    with open(os.path.join(directory, 'index.html'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(parts))
+
+
+# Render every chart that changed since the last report into directory, in parallel, and
+# write index.html. Returns the index path and how many charts were rendered and skipped
+def render_report(charts, directory=REPORT_DIR, formats=FORMATS, n_jobs=None, title='Energy Consumption by Sectors'):
+    os.makedirs(directory, exist_ok=True)
+    names = [chart['name'] for chart in charts]
+    if len(set(names)) != len(names):
+        raise ValueError('Chart names must be unique within a report')
+
+    manifest_file = os.path.join(directory, MANIFEST)
+    try:
+        with open(manifest_file) as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        previous = {}
+
+    keys = {chart['name']: chart_key(chart, formats) for chart in charts}
+    files = {chart['name']: [f'{chart_stem(chart)}.{fmt}' for fmt in formats] for chart in charts}
+    stale = [chart for chart in charts
+             if previous.get(chart['name']) != keys[chart['name']]
+             or not all(os.path.exists(os.path.join(directory, file)) for file in files[chart['name']])]
+
+    jobs = [(chart, directory, formats) for chart in stale]
+    if n_jobs is None or n_jobs <= 0:
+        n_jobs = os.cpu_count() or 1
+    if n_jobs == 1 or len(jobs) <= 1:
+        list(map(_render_job, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(jobs))) as executor:
+            list(executor.map(_render_job, jobs, chunksize=max(1, len(jobs) // (4 * n_jobs))))
+
+    _write_index(directory, charts, files, title)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(keys, f, indent=1)
+    os.replace(tmp, manifest_file)
+    return {'index': os.path.join(directory, 'index.html'), 'rendered': len(stale), 'skipped': len(charts) - len(stale)}
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Command-line entry points: train, forecast and report
+
+    energy-forecast train [--data-dir DIR] [--n-jobs N] [--force STAGE ...]
+    energy-forecast forecast [--horizon 12] [--file FILE --column COLUMN] [--output forecast.csv]
+    energy-forecast report [--data-dir DIR] [--report-dir DIR]
+
+Importing this module only defines the parser. Each subcommand imports what
+it needs when it runs: train and report bring in the pipeline (pandas,
+statsmodels, scikit-learn, matplotlib), while forecast reads the saved model
+artifacts with numpy alone, so it starts in a fraction of a second.
+"""
+
+import argparse
+import sys
+
+
+def _pipeline(args, **params):
+    from pipeline import Pipeline, ResultStore
+    from telemetry import Telemetry
+    params = {name: value for name, value in params.items() if value is not None}
+    for name in ('data_dir', 'max_fits'):
+        if getattr(args, name) is not None:
+            params[name] = getattr(args, name)
+    store = ResultStore(args.cache_dir) if args.cache_dir is not None else None
+    return Pipeline(params=params, store=store, n_jobs=args.n_jobs, telemetry=Telemetry())
+
+
+# Fit every model (reusing whatever is unchanged since the last run), evaluate them and save
+# the artifacts the forecast command reads
+def train(args):
+    from pipeline import print_summary
+    pipeline = _pipeline(args, artifact_dir=args.artifact_dir)
+    print_summary(pipeline.run(['evaluate', 'artifacts'], args.force), 'computed')
+    print(pipeline.value('evaluate').groupby('model')[['RMSE', 'MAPE', 'MAE', 'R2']].mean())
+    print(f"Saved model artifacts version {pipeline.value('artifacts')} to {pipeline.params['artifact_dir']}")
+
+
+# Stacked forecasts from the saved artifacts as CSV: file, column, month, forecast
+def forecast(args):
+    import csv
+    from artifacts import ARTIFACT_DIR, load_artifacts
+    if args.horizon < 1:
+        raise SystemExit('--horizon must be at least 1')
+    artifacts = load_artifacts(args.path or ARTIFACT_DIR, args.version)
+    series = [j for j, (file, column) in enumerate(artifacts.keys)
+              if (args.file is None or file == args.file) and (args.column is None or column == args.column)]
+    if not series:
+        raise SystemExit('No saved series matches --file / --column')
+
+    values = artifacts.forecast(args.horizon)
+    dates = artifacts.forecast_dates(args.horizon)
+    output = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        writer = csv.writer(output)
+        writer.writerow(['file', 'column', 'month', 'forecast'])
+        for j in series:
+            file, column = artifacts.keys[j]
+            writer.writerows((file, column, str(date), repr(float(value))) for date, value in zip(dates, values[:, j]))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+# Render the HTML report (charts that have not changed are skipped)
+def report(args):
+    from pipeline import print_summary
+    pipeline = _pipeline(args, report_dir=args.report_dir)
+    print_summary(pipeline.run(['report'], args.force), 'computed')
+    result = pipeline.value('report')
+    print(f"Report written to {result['index']}: {result['rendered']} charts rendered, {result['skipped']} unchanged")
+
+
+def _add_pipeline_arguments(parser):
+    parser.add_argument('--data-dir', default=None, help='directory of the EIA workbooks (default: the current directory)')
+    parser.add_argument('--cache-dir', default=None, help='stored stage results (default: .pipeline_cache)')
+    parser.add_argument('--n-jobs', type=int, default=None, help='worker processes for per-series stages (default: every core)')
+    parser.add_argument('--max-fits', type=int, default=None, help='fits per series in the stepwise order search (default: 40)')
+    parser.add_argument('--force', nargs='*', default=[], metavar='STAGE', help='recompute these stages even when up to date')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='energy-forecast', description='Energy consumption by sector: train, forecast and report')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('train', help='fit, evaluate and save the models')
+    _add_pipeline_arguments(command)
+    command.add_argument('--artifact-dir', default=None, help='where to save the models (default: artifacts)')
+    command.set_defaults(handler=train)
+
+    command = commands.add_parser('forecast', help='forecast from the saved models')
+    command.add_argument('--path', default=None, help='artifact directory (default: artifacts)')
+    command.add_argument('--version', default=None, help='artifact version (default: the latest)')
+    command.add_argument('--horizon', type=int, default=12, help='months to forecast')
+    command.add_argument('--file', default=None, help='only the series of this workbook')
+    command.add_argument('--column', default=None, help='only the series of this column')
+    command.add_argument('--output', default=None, help='CSV file to write (default: standard output)')
+    command.set_defaults(handler=forecast)
+
+    command = commands.add_parser('report', help='render the HTML report')
+    _add_pipeline_arguments(command)
+    command.add_argument('--report-dir', default=None, help='where to write the report (default: report)')
+    command.set_defaults(handler=report)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.handler(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,55 +10,57 @@ Original file is located at
 """
 
 # Import necessary libraries
+import pickle
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from statsmodels.tsa.statespace.sarimax import SARIMAX
-from sklearn.metrics import mean_squared_error
-from math import sqrt
-from sklearn.ensemble import GradientBoostingRegressor
-from sklearn.linear_model import LinearRegression
-from joblib import dump
+import matplotlib
+
+# Report mode renders every chart headlessly to files under report_dir (see charts.py) instead of
+# showing them one at a time; set to False for interactive plt.show() windows
+report_mode = True
+report_dir = 'report'
+if report_mode:
+    matplotlib.use('Agg')
+
+from fit_cache import FitCache
+from ingest import load_table
+from panel import Panel, FILES_AND_COLUMNS
+from features import FeatureSpec
+from pipeline import Pipeline, print_summary, sarima_model, series_orders
+from updating import ModelUpdater
+from metrics import rmse, mape
+from charts import line, line_chart, box_chart, show_chart, render_report
+from telemetry import Telemetry
 
 """# Load Datasets"""
 
-# Load your data
-dfp_RC = pd.read_excel('Table_3.7a_Petroleum_Consumption___Residential_and_Commercial_Sectors.xlsx')
-dfp_I = pd.read_excel('Table_3.7b_Petroleum_Consumption___Industrial_Sector.xlsx')
-dfp_TE = pd.read_excel('Table_3.7c_Petroleum_Consumption___Transportation_and_Electric_Power_Sectors.xlsx')
-dfp_NG = pd.read_excel('Table_4.3_Natural_Gas_Consumption_by_Sector.xlsx')
-dfp_elec = pd.read_excel('Table_7.6_Electricity_End_Use.xlsx')
+# The models are trained by the stages of pipeline.py, the same functions, settings and stored results
+# as `python pipeline.py run`, so a rerun only recomputes the stages and series a change reaches. This
+# notebook runs top to bottom; the energy-forecast command (cli.py) trains, forecasts and reports without importing it
 
-dfp_RC.head(5)
+# Wall time, CPU time, peak memory, outcome counts and warnings of every stage (and series) of the run,
+# appended as JSON lines to telemetry.jsonl; stages named in profile_stages also run under cProfile
+profile_stages = ()  # e.g. ('sarima_search', 'report')
+telemetry = Telemetry(profile=profile_stages)
 
-# Remove the first line
-dfp_RC = dfp_RC.drop(dfp_RC.index[0])
+# Define the paths to the files
+files_and_columns = FILES_AND_COLUMNS
 
-dfp_RC.info()
+# Load the data and preprocess. Each workbook is parsed once into the columnar
+# ingest cache; later loads memory-map the cached table instead of reading the Excel
+def load_and_preprocess_data(file, columns):
+    return load_table(file, columns)
 
-dfp_RC.head()
+# Load your data
+dfp_RC = load_and_preprocess_data('Table_3.7a_Petroleum_Consumption___Residential_and_Commercial_Sectors.xlsx', files_and_columns['Table_3.7a_Petroleum_Consumption___Residential_and_Commercial_Sectors.xlsx'])
+dfp_I = load_and_preprocess_data('Table_3.7b_Petroleum_Consumption___Industrial_Sector.xlsx', files_and_columns['Table_3.7b_Petroleum_Consumption___Industrial_Sector.xlsx'])
+dfp_TE = load_and_preprocess_data('Table_3.7c_Petroleum_Consumption___Transportation_and_Electric_Power_Sectors.xlsx', files_and_columns['Table_3.7c_Petroleum_Consumption___Transportation_and_Electric_Power_Sectors.xlsx'])
+dfp_NG = load_and_preprocess_data('Table_4.3_Natural_Gas_Consumption_by_Sector.xlsx', files_and_columns['Table_4.3_Natural_Gas_Consumption_by_Sector.xlsx'])
+dfp_elec = load_and_preprocess_data('Table_7.6_Electricity_End_Use.xlsx', files_and_columns['Table_7.6_Electricity_End_Use.xlsx'])
 
-# Define the paths to the files
-files_and_columns = {
-    'Table_3.7a_Petroleum_Consumption___Residential_and_Commercial_Sectors.xlsx':['Total Petroleum Consumed by the Residential Sector', 'Total Petroleum Consumed by the Commercial Sector'],
-    'Table_3.7b_Petroleum_Consumption___Industrial_Sector.xlsx':['Total Petroleum Consumed by the Industrial Sector'],
-    'Table_4.3_Natural_Gas_Consumption_by_Sector.xlsx':['Natural Gas Consumed by the Residential Sector','Natural Gas Consumed by the Commercial Sector', 'Natural Gas Consumed by the Industrial Sector, Total', 'Natural Gas Consumed by the Transportation Sector, Total'],
-    'Table_7.6_Electricity_End_Use.xlsx':['Electricity Sales to Ultimate Customers, Residential', 'Electricity Sales to Ultimate Customers, Commercial', 'Electricity Sales to Ultimate Customers, Industrial', 'Electricity Sales to Ultimate Customers, Transportation'],
-    'Table_3.7c_Petroleum_Consumption___Transportation_and_Electric_Power_Sectors.xlsx':['Total Petroleum Consumed by the Transportation Sector']
-    }
+dfp_RC.head(5)
 
-# Load the data and preprocess
-def load_and_preprocess_data(file, columns):
-    df = pd.read_excel(file)
-    # Removing rows in 0 th index
-    df = df.drop(df.index[0])
-    for column in columns:
-        df[column].replace("Not Available", np.nan, inplace=True)
-        df[column] = df[column].astype(float)
-        df[column].interpolate(method='linear', inplace=True)
-    df = df[['Month'] + columns]
-    df.set_index('Month', inplace=True)
-    return df
+dfp_RC.info()
 
 """# EDA"""
 
@@ -69,6 +71,15 @@ for file_name, cols in files_and_columns.items():
     file_path = f'{file_name}'
     dataframes[file_name] = load_and_preprocess_data(file_path, cols)
 
+# Charts collected for the report in report mode, shown right away otherwise
+report_charts = []
+
+def output_chart(chart):
+    if report_mode:
+        report_charts.append(chart)
+    else:
+        show_chart(chart)
+
 # Displaying the first few rows of each dataset
 sample_data = {key: df.head() for key, df in dataframes.items()}
 sample_data
@@ -79,25 +90,13 @@ def eda_and_graphs(df, title_prefix, unit):
     stats = df.describe()
 
     # Time series plot
-    plt.figure(figsize=(14, 8))
-    for column in df.columns:
-        plt.plot(df.index, df[column], label=column)
-    plt.title(f"Time Series: {title_prefix}")
-    plt.xlabel("Year")
-    plt.ylabel(f"Consumption ({unit})")
-    plt.legend()
-    plt.grid(True)
-    plt.tight_layout()
-    plt.show()
+    output_chart(line_chart(f"eda/{title_prefix}/time_series", "EDA", f"Time Series: {title_prefix}", "Year",
+                            f"Consumption ({unit})", [line(df.index, df[column], column) for column in df.columns],
+                            figsize=(14, 8), grid=True, tight=True))
 
     # Box plots for each column
-    plt.figure(figsize=(14, 6))
-    df.boxplot()
-    plt.title(f"Box Plot: {title_prefix}")
-    plt.ylabel(f"Consumption ({unit})")
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.show()
+    output_chart(box_chart(f"eda/{title_prefix}/box_plot", "EDA", f"Box Plot: {title_prefix}",
+                           f"Consumption ({unit})", df, figsize=(14, 6)))
 
     return stats
 
@@ -126,164 +125,144 @@ title_prefix = "Electricity End Use by Sector"
 stats_electricity = eda_and_graphs(dataframes['Table_7.6_Electricity_End_Use.xlsx'], title_prefix, 'Million Kilowatthours')
 stats_electricity
 
-"""# Model Methods"""
-
-def train_test_split(data, test_size=0.2):
-    train_size = int(len(data) * (1 - test_size))
-    train, test = data[:train_size], data[train_size:]
-    return train, test
-
-def fit_sarima(data, order, seasonal_order, test):
-    model = SARIMAX(data, order=order, seasonal_order=seasonal_order, enforce_stationarity=False, enforce_invertibility=False)
-    model_fit = model.fit(disp=False)
-    forecast = model_fit.predict(start=len(data), end=len(data)+len(test)-1)
-    return model_fit, forecast
-
-def create_lagged_features(data, lag=1):
-    if isinstance(data, pd.Series):
-        data = data.to_frame()
-    lagged_data = data.copy()
-    lagged_columns = [f"{column}_lag{lag}" for column in lagged_data.columns]
-    lagged_data[lagged_columns] = lagged_data[lagged_data.columns].shift(lag)
-    lagged_data.dropna(inplace=True)
-    return lagged_data
-
 """# Training Model"""
 
 # Load the data and preprocess
-datasets = {file: load_and_preprocess_data(file, columns) for file, columns in files_and_columns.items()}
+with telemetry.stage('load') as stage:
+    datasets = {file: load_and_preprocess_data(file, columns) for file, columns in files_and_columns.items()}
+    stage.count('ok', len(datasets))
 
-import warnings
-warnings.filterwarnings('ignore')
+# Align every sector series into one months x series panel backed by a single float array; tables that
+# end (or start) on different months are cut to the months all of them cover, so every series splits alike.
+# The training stages below align and split the tables the same way (ragged='trim')
+panel = Panel.from_datasets(datasets, files_and_columns)
 
-# Split the data into training and testing sets
-train_datasets = {file: train_test_split(data)[0] for file, data in datasets.items()}
-test_datasets = {file: train_test_split(data)[1] for file, data in datasets.items()}
+# Split the data into training and testing sets; both halves (and the per-file frames below) are views into the panel
+test_size = 0.2
+train_panel, test_panel = panel.split(test_size=test_size)
+train_datasets = train_panel.to_datasets()
+test_datasets = test_panel.to_datasets()
 
 """To find the best parameters to FIT SARIMA using AIC"""
 
-import itertools
-from statsmodels.tsa.statespace.sarimax import SARIMAX
-
-# Continue with the SARIMA grid search for the specified data
-data = train_datasets['Table_3.7a_Petroleum_Consumption___Residential_and_Commercial_Sectors.xlsx']['Total Petroleum Consumed by the Residential Sector']
-
-## To find the best paramters to fit SARIMA
-# Define the p, d, q and P, D, Q ranges
-p = d = q = range(0, 3)  # for non-seasonal orders
-P = D = Q = range(0, 2)  # for seasonal orders
-s = 12  # for monthly data with yearly seasonality
-
-# Create a list of all possible combinations of p, d, q, P, D, Q, and s
-pdq_combinations = [(x[0], x[1], x[2], x[3], x[4], x[5], s) for x in list(itertools.product(p, d, q, P, D, Q))]
+from sarima_search import best_sarima_params
 
+# Number of worker processes for the per-series stages and the example search (None uses every core)
+n_jobs = None
 
-best_aic = float("inf")
-best_order = None
-best_seasonal_order = None
+# 'stepwise' walks neighbouring orders with d and D from unit-root tests, spending at most
+# max_fits fits per series; 'exhaustive' fits the full pdq_combinations grid for comparison
+search_method = 'stepwise'
+max_fits = 40
 
-# Grid search for the best SARIMA parameters
-for order in pdq_combinations:
-    try:
-        model = SARIMAX(data, order=(order[0], order[1], order[2]), seasonal_order=(order[3], order[4], order[5], order[6]), enforce_stationarity=False, enforce_invertibility=False)
-        results = model.fit()
-        if results.aic < best_aic:
-            best_aic = results.aic
-            best_order = order[0], order[1], order[2]
-            best_seasonal_order = order[3], order[4], order[5], order[6]
-    except:
-        continue
-
-best_order, best_seasonal_order, best_aic
+# Fits running past fit_time_limit seconds are stopped and recorded as timed out
+fit_time_limit = 60
+fit_max_iter = 50
 
-import itertools
-from statsmodels.tsa.statespace.sarimax import SARIMAX
+# On-disk cache of SARIMA fits, so reruns on unchanged tables skip the optimizer
+fit_cache = FitCache()
 
+# Start each fit from the closest order already fitted, or from the previous run's fit of the same
+# series and order; compare the iterations and fit times reported below with warm_start = False
+warm_start = True
 
-## To find the best paramters to fit SARIMA
-# Define the p, d, q and P, D, Q ranges
-p = d = q = range(0, 3)  # for non-seasonal orders
-P = D = Q = range(0, 2)  # for seasonal orders
-s = 12  # for monthly data with yearly seasonality
+# Set to a queue file on a disk every host can reach to run the order search and the SARIMA fits
+# through fit_queue workers (`python fit_queue.py worker --queue <file>` on each host), plus
+# fit_queue_workers started here; None fits in this process's pool
+fit_queue_path = None
+fit_queue_workers = 1
 
-# Create a list of all possible combinations of p, d, q, P, D, Q, and s
-pdq_combinations = [(x[0], x[1], x[2], x[3], x[4], x[5], s) for x in list(itertools.product(p, d, q, P, D, Q))]
+# Fixed orders for every series, e.g. {'order': (2, 1, 2), 'seasonal_order': (1, 1, 1, 12)}, or None to
+# fit each series (and run its backtest and incremental updates) with its searched order
+sarima_order = None
 
-# Function to determine the best SARIMA parameters based on AIC
-def best_sarima_params(data):
-    best_aic = float("inf")
-    best_order = None
-    best_seasonal_order = None
+# Continue with the SARIMA grid search for the specified data
+data = train_datasets['Table_3.7a_Petroleum_Consumption___Residential_and_Commercial_Sectors.xlsx']['Total Petroleum Consumed by the Residential Sector']
 
-    for order in pdq_combinations:
-        try:
-            model = SARIMAX(data, order=(order[0], order[1], order[2]), seasonal_order=(order[3], order[4], order[5], order[6]), enforce_stationarity=False, enforce_invertibility=False)
-            results = model.fit()
-            if results.aic < best_aic:
-                best_aic = results.aic
-                best_order = order[0], order[1], order[2]
-                best_seasonal_order = order[3], order[4], order[5], order[6]
-        except:
-            continue
+# Grid search for the best SARIMA parameters
+with telemetry.stage('sarima_search_example'):
+    best_order, best_seasonal_order, best_aic = best_sarima_params(data, n_jobs=n_jobs, cache=fit_cache, method=search_method, max_fits=max_fits,
+                                                                   time_limit=fit_time_limit, max_iter=fit_max_iter, warm_start=warm_start)
 
-    return best_order, best_seasonal_order, best_aic
+best_order, best_seasonal_order, best_aic
 
-# Determine the best SARIMA parameters for multiple datasets
+# Train everything through the pipeline stages: the order search and SARIMA fits of every series (through
+# the fit cache, warm-started), the per-series and global GB models, the stackers, the evaluation, the
+# walk-forward backtest, the forecasts with their intervals and the saved artifacts. Each series is
+# fitted in a worker process, every stage is recorded in the telemetry, and results whose inputs,
+# settings and code have not changed since the last run are reused
+training = Pipeline(params={'ragged': 'trim', 'test_size': test_size, 'search_method': search_method, 'max_fits': max_fits,
+                            'time_limit': fit_time_limit, 'max_iter': fit_max_iter, 'sarima_order': sarima_order,
+                            'fit_cache_dir': fit_cache.path, 'warm_start': warm_start, 'fit_queue_path': fit_queue_path,
+                            'fit_queue_workers': fit_queue_workers},
+                    n_jobs=n_jobs, telemetry=telemetry)
+print_summary(training.run(['evaluate', 'backtest', 'forecast', 'artifacts']), 'computed')
+split = training.value('split')
+keys = list(split)
+
+# Best order and fit counts of every series, results[file][column]
 results = {}
-for file, columns in files_and_columns.items():
-    results[file] = {}
-    for column in columns:
-        data = datasets[file][column]
-        order, seasonal_order, aic = best_sarima_params(data)
-        results[file][column] = {
-            'order': order,
-            'seasonal_order': seasonal_order,
-            'aic': aic
-        }
+for (file, column), result in training.value('order_search').items():
+    results.setdefault(file, {})[column] = result
+    # The fits ran in worker processes, so their per-series outcomes are recorded from the search results
+    counts = {'fits': result['n_fits'], 'failed': result['n_failed'], 'timed_out': result['n_timed_out'],
+              'not_converged': result['n_not_converged'], 'cached': result['n_cached'], 'warm_started': result['n_warm_started']}
+    telemetry.record('sarima_search_series', f'{file}|{column}', counts, fit_time_s=result['fit_time'], iterations=result['iterations'],
+                     warnings=result['warnings'])
 
 print(results)
 
-# Fit a SARIMA model and make predictions
+# Report the fits that failed, timed out or did not converge for each series
+for file, columns in results.items():
+    for column, result in columns.items():
+        print(f"{file} - {column}: {result['n_fits']} fits, {result['n_failed']} failed, "
+              f"{result['n_timed_out']} timed out, {result['n_not_converged']} not converged, "
+              f"{result['n_cached']} cached, {result['n_warm_started']} warm-started, "
+              f"{result['iterations']} optimizer iterations in {result['fit_time']:.1f}s, warnings: {result['warnings'] or 'none'}")
+
+# SARIMA models rebuilt from the fitted parameters, with their test-period forecasts
+sarima_orders = series_orders(training.params, training.value('order_search'))
 sarima_models = {}
 sarima_predictions = {}
-for file, train_data in train_datasets.items():
-    sarima_models[file] = {}
-    sarima_predictions[file] = {}
-    for column in train_data.columns:
-        test_data = test_datasets[file][column]
-        sarima_model, sarima_preds = fit_sarima(train_data[column], (2, 1, 2), (1, 1, 1, 12), test_data)
-        sarima_models[file][column] = sarima_model
-        sarima_predictions[file][column] = sarima_preds
-
-# Create lagged features and fit a Gradient Boosting model
+for (file, column), fit in training.value('sarima_fit').items():
+    sarima_models.setdefault(file, {})[column] = sarima_model(split[(file, column)]['train'], fit)
+    sarima_predictions.setdefault(file, {})[column] = fit['predictions']
+
+# Lag, rolling-mean and month-of-year features for the Gradient Boosting models
+feature_spec = FeatureSpec(lags=training.params['lags'], windows=training.params['windows'], calendar=training.params['calendar'])
+
+# One Gradient Boosting model per series, and a global model: one histogram-based boosted model on the
+# pooled features of all series, with series, fuel and sector identifiers; its training time and size
+# hardly change as series are added
 gb_models = {}
 gb_predictions = {}
-for file, train_data in train_datasets.items():
-    gb_models[file] = {}
-    gb_predictions[file] = {}
-    for column in train_data.columns:
-        test_data = test_datasets[file][column]
-        lagged_data = create_lagged_features(pd.concat([train_data[column], test_data]))
-        X_train, y_train = lagged_data.drop(column, axis=1)[:len(train_data)-1], lagged_data[column][:len(train_data)-1]
-        X_test, y_test = lagged_data.drop(column, axis=1)[len(train_data)-1:], lagged_data[column][len(train_data)-1:]
-        gb = GradientBoostingRegressor(random_state=42)
-        gb.fit(X_train, y_train)
-        gb_preds = gb.predict(X_test)
-        gb_models[file][column] = gb
-        gb_predictions[file][column] = gb_preds
-
-# Combine the SARIMA and Gradient Boosting predictions using a Linear Regression model
+for (file, column), fit in training.value('gb_fit').items():
+    gb_models.setdefault(file, {})[column] = fit['model']
+    gb_predictions.setdefault(file, {})[column] = fit['predictions']
+global_gb_model = training.value('global_gb')['model']
+global_gb_predictions = {}
+for (file, column), predictions in training.value('global_gb')['predictions'].items():
+    global_gb_predictions.setdefault(file, {})[column] = predictions
+print(f"Per-series GB: {len(keys)} models, {len(pickle.dumps(gb_models)) / 1e6:.2f} MB; "
+      f"global GB: 1 model, {len(pickle.dumps(global_gb_model)) / 1e6:.2f} MB")
+
+# The SARIMA and Gradient Boosting predictions combined by a Linear Regression model per series
 stacked_models = {}
 stacked_predictions = {}
-for file in files_and_columns.keys():
-    stacked_models[file] = {}
-    stacked_predictions[file] = {}
-    for column in train_datasets[file].columns:
-        lr = LinearRegression()
-        lr.fit(pd.DataFrame({'sarima': sarima_predictions[file][column], 'gb': gb_predictions[file][column]}), test_datasets[file][column])
-        stacked_preds = lr.predict(pd.DataFrame({'sarima': sarima_predictions[file][column], 'gb': gb_predictions[file][column]}))
-        stacked_models[file][column] = lr
-        stacked_predictions[file][column] = stacked_preds
+for (file, column), fit in training.value('stack').items():
+    stacked_models.setdefault(file, {})[column] = fit['model']
+    stacked_predictions.setdefault(file, {})[column] = fit['predictions']
+
+# Incremental updates: model_updater.update(new_rows, new_months) extends the SARIMA filters, adds a
+# few GB trees and updates the stackers instead of refitting everything; a series is only refitted in
+# full when its errors drift or its scheduled refit is due. The models end with the training months,
+# so the first call rolls them over test_panel, then each new EIA month is one more call
+model_updater = ModelUpdater(
+    panel.keys(), sarima_models, gb_models, stacked_models, train_panel.values, train_panel.index, feature_spec,
+    {(file, column): np.column_stack([sarima_predictions[file][column], gb_predictions[file][column]]) for file, column in panel.keys()},
+    {(file, column): test_datasets[file][column].to_numpy() for file, column in panel.keys()},
+    {(file, column): test_datasets[file].index for file, column in panel.keys()},
+    sarima_orders, cache=fit_cache)
 
 """# Predictions and Validations"""
 
@@ -291,146 +270,72 @@ for file in files_and_columns.keys():
 for file, preds in stacked_predictions.items():
     for column, pred in preds.items():
         print(f"{file} - {column}: {pred}")
-        plt.figure(figsize=(14, 6))
-        plt.plot(test_datasets[file].index, test_datasets[file][column], label='True Values', color='blue')
         pred_series = pd.Series(pred, index=test_datasets[file].index)
-        plt.plot(pred_series.index, pred_series, label='Predictions', color='red')
-        plt.title(f"{file} - {column}")
-        plt.xlabel('Time')
-        plt.ylabel('Value')
-        plt.legend()
-        plt.show()
+        output_chart(line_chart(f"stacked/{file}/{column}", "Stacked Predictions", f"{file} - {column}", 'Time', 'Value', [
+            line(test_datasets[file].index, test_datasets[file][column], 'True Values', color='blue'),
+            line(pred_series.index, pred_series, 'Predictions', color='red')]))
 
 """# Evaluation"""
 
 # Calculate the RMSE and MAPE for the predictions
 def calculate_rmse(true_values, predictions):
-    mse = mean_squared_error(true_values, predictions)
-    rmse = np.sqrt(mse)
-    return rmse
+    return rmse(true_values, predictions)
 
 def calculate_mape(true_values, predictions):
-    mape = np.mean(np.abs((true_values - predictions) / true_values)) * 100
-    return mape
-
-# Evaluating SARIMA and GB models
-evaluation_results = {}
-
-for file in files_and_columns.keys():
-    evaluation_results[file] = {}
-    for column in train_datasets[file].columns:
-        # Extracting predictions and true values
-        sarima_pred = sarima_predictions[file][column]
-        gb_pred = gb_predictions[file][column]
-        true_values = test_datasets[file][column]
-
-        # Calculating RMSE and MAPE
-        sarima_rmse = calculate_rmse(true_values, sarima_pred)
-        sarima_mape = calculate_mape(true_values, sarima_pred)
+    return mape(true_values, predictions)
 
-        gb_rmse = calculate_rmse(true_values, gb_pred)
-        gb_mape = calculate_mape(true_values, gb_pred)
-
-        # Storing results
-        evaluation_results[file][column] = {
-            'SARIMA_RMSE': sarima_rmse,
-            'SARIMA_MAPE': sarima_mape,
-            'GB_RMSE': gb_rmse,
-            'GB_MAPE': gb_mape
-        }
-
-# Evaluating the stacked model
-stacked_evaluation_results = {}
-
-for file in files_and_columns.keys():
-    stacked_evaluation_results[file] = {}
-    for column in train_datasets[file].columns:
-        # Extracting predictions and true values
-        stacked_pred = stacked_predictions[file][column]
-        true_values = test_datasets[file][column]
-
-        # Calculating RMSE and MAPE
-        stacked_rmse = calculate_rmse(true_values, stacked_pred)
-        stacked_mape = calculate_mape(true_values, stacked_pred)
-
-        # Storing results
-        stacked_evaluation_results[file][column] = {
-            'Stacked_RMSE': stacked_rmse,
-            'Stacked_MAPE': stacked_mape
-        }
+# Evaluating the SARIMA, GB, global GB and stacked models: every metric for every model and series
+# in one vectorized pass over a (model x series x time) array
+evaluation_table = training.value('evaluate')
 
 """# Comparison"""
 
-# Incorporating the stacked model results into the previous evaluation results for comparison
-
-for file in files_and_columns.keys():
-    for column in train_datasets[file].columns:
-        evaluation_results[file][column]['Stacked_RMSE'] = stacked_evaluation_results[file][column]['Stacked_RMSE']
-        evaluation_results[file][column]['Stacked_MAPE'] = stacked_evaluation_results[file][column]['Stacked_MAPE']
+# The combined evaluation results, in the nested layout used so far
+evaluation_results = {}
+evaluation_additional_metrics = {}
+for row in evaluation_table.itertuples(index=False):
+    evaluation_results.setdefault(row.file, {}).setdefault(row.column, {})
+    evaluation_additional_metrics.setdefault(row.file, {}).setdefault(row.column, {})
+    evaluation_results[row.file][row.column][f'{row.model}_RMSE'] = row.RMSE
+    evaluation_results[row.file][row.column][f'{row.model}_MAPE'] = row.MAPE
+    evaluation_additional_metrics[row.file][row.column][f'{row.model}_MAE'] = row.MAE
+    evaluation_additional_metrics[row.file][row.column][f'{row.model}_R2'] = row.R2
 
 # Return the combined evaluation results
 evaluation_results
 
-from sklearn.metrics import mean_absolute_error, r2_score
-
-# Calculating additional evaluation metrics
-evaluation_additional_metrics = {}
-
-for file in files_and_columns.keys():
-    evaluation_additional_metrics[file] = {}
-    for column in train_datasets[file].columns:
-        # Extracting predictions and true values
-        sarima_pred = sarima_predictions[file][column]
-        gb_pred = gb_predictions[file][column]
-        stacked_pred = stacked_predictions[file][column]
-        true_values = test_datasets[file][column]
-
-        # Calculating MAE and R2 for each model
-        sarima_mae = mean_absolute_error(true_values, sarima_pred)
-        sarima_r2 = r2_score(true_values, sarima_pred)
-
-        gb_mae = mean_absolute_error(true_values, gb_pred)
-        gb_r2 = r2_score(true_values, gb_pred)
-
-        stacked_mae = mean_absolute_error(true_values, stacked_pred)
-        stacked_r2 = r2_score(true_values, stacked_pred)
-
-        # Storing results
-        evaluation_additional_metrics[file][column] = {
-            'SARIMA_MAE': sarima_mae,
-            'SARIMA_R2': sarima_r2,
-            'GB_MAE': gb_mae,
-            'GB_R2': gb_r2,
-            'Stacked_MAE': stacked_mae,
-            'Stacked_R2': stacked_r2
-        }
-
 # Generating Residual Plots
 residual_plots = {}
 for file in files_and_columns.keys():
     residual_plots[file] = {}
     for column in train_datasets[file].columns:
-        plt.figure(figsize=(14, 6))
-
         # Calculating residuals
         sarima_residuals = test_datasets[file][column] - sarima_predictions[file][column]
         gb_residuals = test_datasets[file][column] - gb_predictions[file][column]
         stacked_residuals = test_datasets[file][column] - stacked_predictions[file][column]
 
         # Plotting residuals
-        plt.plot(test_datasets[file].index, sarima_residuals, label='SARIMA Residuals', color='blue')
-        plt.plot(test_datasets[file].index, gb_residuals, label='GB Residuals', color='red')
-        plt.plot(test_datasets[file].index, stacked_residuals, label='Stacked Residuals', color='green')
-
-        plt.title(f"Residuals for {file} - {column}")
-        plt.xlabel('Time')
-        plt.ylabel('Residual Value')
-        plt.legend()
-        plt.show()
+        residual_plots[file][column] = line_chart(f"residuals/{file}/{column}", "Residuals", f"Residuals for {file} - {column}",
+                                                  'Time', 'Residual Value', [
+            line(test_datasets[file].index, sarima_residuals, 'SARIMA Residuals', color='blue'),
+            line(test_datasets[file].index, gb_residuals, 'GB Residuals', color='red'),
+            line(test_datasets[file].index, stacked_residuals, 'Stacked Residuals', color='green')])
+        output_chart(residual_plots[file][column])
 
 # Return the additional evaluation metrics
 evaluation_additional_metrics
 
+"""# Walk-forward Backtest"""
+
+# Rolling-origin evaluation: 8 origins, 12-month horizon, one year apart. The stacker of each fold
+# is trained on out-of-fold predictions only, unlike the single split above where it is fitted on
+# the test set it is scored on. Folds beyond the nightly time budget (seconds) are dropped, oldest first
+backtest_results = training.value('backtest')
+
+# RMSE / MAPE / MAE / R2 per fold, series and model, and their mean over the folds
+backtest_metrics = backtest_results['metrics']
+backtest_metrics.groupby(['file', 'column', 'model'])[['RMSE', 'MAPE', 'MAE', 'R2']].mean()
+
 """# GB, SARIMA, Stacked"""
 
 # Plotting SARIMA, GB, Stacked predictions along with true labels for visualization
@@ -444,107 +349,63 @@ for file in files_and_columns.keys():
         gb_pred = gb_predictions[file][column]
         stacked_pred = stacked_predictions[file][column]
 
-        plt.figure(figsize=(16, 8))
-
         # Plotting true values and predictions
-        plt.plot(true_values.index, true_values, label='True Values', color='black', linestyle='--', linewidth=1.5)
-        plt.plot(true_values.index, sarima_pred, label='SARIMA Predictions', color='blue')
-        plt.plot(true_values.index, gb_pred, label='GB Predictions', color='red')
-        plt.plot(true_values.index, stacked_pred, label='Stacked Predictions', color='green')
-
-        plt.title(f"Predictions vs True Values for {file} - {column}")
-        plt.xlabel('Time')
-        plt.ylabel('Value')
-        plt.legend()
-        plt.grid(True)
-        plt.show()
+        output_chart(line_chart(f"comparison/{file}/{column}", "GB, SARIMA, Stacked", f"Predictions vs True Values for {file} - {column}",
+                                'Time', 'Value', [
+            line(true_values.index, true_values, 'True Values', color='black', linestyle='--', linewidth=1.5),
+            line(true_values.index, sarima_pred, 'SARIMA Predictions', color='blue'),
+            line(true_values.index, gb_pred, 'GB Predictions', color='red'),
+            line(true_values.index, stacked_pred, 'Stacked Predictions', color='green')], figsize=(16, 8), grid=True))
 
 
 
 """# Next 5 Years"""
 
-# Adjust the generate_forecast function to handle iterative forecasting correctly
-
-def generate_forecast(model, sarima_predictions, gb_model, forecast_length):
-    # Generate initial forecasts using SARIMA
-    sarima_forecast = model.forecast(steps=forecast_length)
-
-    # For GB we need to iteratively predict and use the last prediction as a new input
-    gb_forecast = []
-    last_observation = sarima_predictions.iloc[-1]
-    for _ in range(forecast_length):
-        new_prediction = gb_model.predict(np.array([last_observation]).reshape(1, -1))
-        gb_forecast.append(new_prediction[0])
-        last_observation = new_prediction
-
-    # Use the linear regression model to combine the forecasts
-    stacked_forecast = lr.predict(pd.DataFrame({'sarima': sarima_forecast, 'gb': gb_forecast}))
-    return stacked_forecast
-
-# Define the number of months to forecast
-forecast_length = 108  # 9 years * 12 months
-
-# Regenerate forecasts
+# Forecasts of every series for the next 9 years (108 months) from the end of the training data: the
+# stacked forecasts with their simulated 80% and 95% prediction intervals, and the SARIMA forecasts
+forecast_result = training.value('forecast')
+forecast_length = training.params['forecast_length']
+forecast_dates = forecast_result['dates']
 forecasts = {}
-for file in files_and_columns.keys():
-    forecasts[file] = {}
-    for column in train_datasets[file].columns:
-        model = sarima_models[file][column]
-        gb_model = gb_models[file][column]
-        lr = stacked_models[file][column]
-        forecast = generate_forecast(model, sarima_predictions[file][column], gb_model, forecast_length)
-        forecasts[file][column] = forecast
+forecast_intervals = {}
+for j, (file, column) in enumerate(forecast_result['keys']):
+    forecasts.setdefault(file, {})[column] = forecast_result['mean'][:, j]
+    forecast_intervals.setdefault(file, {})[column] = {level: (lower[:, j], upper[:, j])
+                                                       for level, (lower, upper) in forecast_result['intervals'].items()}
+
+# The fitted models saved as a compact artifact version; artifacts.load_artifacts().forecast(steps)
+# reproduces these forecasts in another process without retraining, and `python serving.py` serves them over HTTP
+artifact_version = training.value('artifacts')
+print(f'Saved model artifacts version {artifact_version}')
 
 # Display the forecasts for the first file and column as an example again
 example_file = list(files_and_columns.keys())[0]
 example_column = files_and_columns[example_file][0]
 forecasts[example_file][example_column]
 
-# Generate the date range for the forecasts
-forecast_dates = pd.date_range(start="2020-01-01", periods=forecast_length, freq='M')
-
-import matplotlib.pyplot as plt
-
 # Extract true values from 2020 onwards from the test dataset
 true_values_2020_onwards = test_datasets[example_file][example_column]
 
-# Compute the confidence intervals for SARIMA predictions
-confidence_intervals = sarima_models[example_file][example_column].get_forecast(steps=forecast_length).conf_int()
-
-# Plotting data from 2020 onwards with true values up to 2023
-plt.figure(figsize=(14, 7))
-# Plotting the true values from 2020 to 2023
-plt.plot(true_values_2020_onwards.index, true_values_2020_onwards, label="True Values (2020-2023)", color='blue')
-# Plotting forecasted values from 2020 to 2028
-plt.plot(forecast_dates, forecasts[example_file][example_column], label="Forecast (2020-2028)", color='red', linestyle='--')
-plt.fill_between(forecast_dates, confidence_intervals.iloc[:, 0], confidence_intervals.iloc[:, 1], color='pink', alpha=0.3, label="SARIMA Confidence Interval")
-plt.title(f"True Values (2020-2023) vs. Forecasted Values for {example_column}")
-plt.xlabel("Date")
-plt.ylabel("Value")
-plt.legend()
-plt.grid(True)
-plt.tight_layout()
-plt.show()
-
-|# Function to plot the data and forecasts for each dataset and column
+# Plotting data from 2020 onwards with true values up to 2023, and forecasted values from 2020 to 2028
+output_chart(line_chart(f"forecast_example/{example_file}/{example_column}", "Next 5 Years",
+                        f"True Values (2020-2023) vs. Forecasted Values for {example_column}", "Date", "Value", [
+    line(true_values_2020_onwards.index, true_values_2020_onwards, "True Values (2020-2023)", color='blue'),
+    line(forecast_dates, forecasts[example_file][example_column], "Forecast (2020-2028)", color='red', linestyle='--')],
+    band=(forecast_dates, *forecast_intervals[example_file][example_column][0.95], "95% Prediction Interval",
+          {'color': 'pink', 'alpha': 0.3}), figsize=(14, 7), grid=True, tight=True))
+
+# Function to plot the data and forecasts for each dataset and column
 def plot_true_vs_forecast(file, column):
     # Extract the true values and the forecasted values
     true_values = test_datasets[file][column]
     forecast_vals = forecasts[file][column]
-    confidence_intervals = sarima_models[file][column].get_forecast(steps=forecast_length).conf_int()
 
     # Plotting
-    plt.figure(figsize=(14, 7))
-    plt.plot(true_values.index, true_values, label="True Values", color='blue')
-    plt.plot(forecast_dates, forecast_vals, label="Forecast", color='red', linestyle='--')
-    plt.fill_between(forecast_dates, confidence_intervals.iloc[:, 0], confidence_intervals.iloc[:, 1], color='pink', alpha=0.3, label="SARIMA Confidence Interval")
-    plt.title(f"True vs. Forecasted Values for {column}")
-    plt.xlabel("Date")
-    plt.ylabel("Value")
-    plt.legend()
-    plt.grid(True)
-    plt.tight_layout()
-    plt.show()
+    output_chart(line_chart(f"forecast/{file}/{column}", "Forecasts", f"True vs. Forecasted Values for {column}", "Date", "Value", [
+        line(true_values.index, true_values, "True Values", color='blue'),
+        line(forecast_dates, forecast_vals, "Forecast", color='red', linestyle='--')],
+        band=(forecast_dates, *forecast_intervals[file][column][0.95], "95% Prediction Interval",
+              {'color': 'pink', 'alpha': 0.3}), figsize=(14, 7), grid=True, tight=True))
 
 # Loop through each dataset and column to plot the data and forecasts
 for file, columns in files_and_columns.items():
@@ -607,9 +468,9 @@ Let's begin our analysis:
 """
 
 # Function to generate SARIMA forecasts
-def generate_sarima_forecast(model, forecast_length):
-    forecast = model.get_forecast(steps=forecast_length)
-    mean_forecast = forecast.predicted_mean
+def generate_sarima_forecast(key):
+    forecast = forecast_result['sarima'][key]
+    mean_forecast = forecast.mean
     confidence_intervals = forecast.conf_int()
     return mean_forecast, confidence_intervals
 
@@ -622,17 +483,12 @@ def plot_sarima_forecast(file, column):
     confidence_intervals = sarima_confidence_intervals[file][column]
 
     # Plotting
-    plt.figure(figsize=(14, 7))
-    plt.plot(true_values.index, true_values, label="True Values", color='blue')
-    plt.plot(forecast_dates, forecast_vals, label="SARIMA Forecast", color='red', linestyle='--')
-    plt.fill_between(forecast_dates, confidence_intervals.iloc[:, 0], confidence_intervals.iloc[:, 1], color='pink', alpha=0.3, label="SARIMA Confidence Interval")
-    plt.title(f"True vs. SARIMA Forecasted Values for {column}")
-    plt.xlabel("Date")
-    plt.ylabel("Value")
-    plt.legend()
-    plt.grid(True)
-    plt.tight_layout()
-    plt.show()
+    output_chart(line_chart(f"sarima_forecast/{file}/{column}", "SARIMA Forecasts", f"True vs. SARIMA Forecasted Values for {column}",
+                            "Date", "Value", [
+        line(true_values.index, true_values, "True Values", color='blue'),
+        line(forecast_dates, forecast_vals, "SARIMA Forecast", color='red', linestyle='--')],
+        band=(forecast_dates, confidence_intervals.iloc[:, 0], confidence_intervals.iloc[:, 1], "SARIMA Confidence Interval",
+              {'color': 'pink', 'alpha': 0.3}), figsize=(14, 7), grid=True, tight=True))
 
 # Generate SARIMA forecasts for each dataset and column
 sarima_forecasts = {}
@@ -641,8 +497,7 @@ for file in files_and_columns.keys():
     sarima_forecasts[file] = {}
     sarima_confidence_intervals[file] = {}
     for column in train_datasets[file].columns:
-        model = sarima_models[file][column]
-        forecast, conf_int = generate_sarima_forecast(model, forecast_length)
+        forecast, conf_int = generate_sarima_forecast((file, column))
         sarima_forecasts[file][column] = forecast
         sarima_confidence_intervals[file][column] = conf_int
 
@@ -651,3 +506,10 @@ for file, columns in files_and_columns.items():
     for column in columns:
         plot_sarima_forecast(file, column)
 
+# Render every collected chart in parallel; charts whose data has not changed since the last report are skipped
+if report_mode:
+    with telemetry.stage('report') as stage:
+        report = render_report(report_charts, report_dir, n_jobs=n_jobs)
+        stage.count('rendered', report['rendered'])
+        stage.count('skipped', report['skipped'])
+    print(f"Report written to {report['index']}: {report['rendered']} charts rendered, {report['skipped']} unchanged")
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Vectorized lag, rolling-window and calendar features
+
+Builds the gradient-boosting design matrix for every series of a months x
+series array in one pass. Lags are gathered from a strided sliding-window
+view of the array and rolling means come from a cumulative sum, so no
+shifted frame is materialised per lag and the cost does not grow with the
+size of a rolling window.
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class FeatureSpec:
+    def __init__(self, lags=(1,), windows=(), calendar=False):
+        self.lags = tuple(sorted(set(lags)))
+        self.windows = tuple(sorted(set(windows)))
+        self.calendar = calendar
+        # Rows of history each feature row needs
+        self.history = max(self.lags + self.windows)
+
+    @property
+    def names(self):
+        names = [f'lag{lag}' for lag in self.lags] + [f'mean{window}' for window in self.windows]
+        if self.calendar:
+            names.append('month')
+        return names
+
+    # Features for every series at every row that has enough history.
+    # values is (n_months, n_series), months the month-of-year of each row.
+    # Returns X (n_rows, n_series, n_features) and y (n_rows, n_series), where row i
+    # predicts month i + history of values; y is a view into values
+    def build(self, values, months=None):
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim == 1:
+            values = values[:, None]
+        h = self.history
+        n_rows = values.shape[0] - h
+        X = np.empty((n_rows, values.shape[1], len(self.names)))
+
+        # window[t, j, k] is values[t + k, j], so lag l of target t + h sits at k = h - l
+        window = sliding_window_view(values, h + 1, axis=0)[:n_rows]
+        X[:, :, :len(self.lags)] = window[:, :, h - np.array(self.lags)]
+
+        column = len(self.lags)
+        if self.windows:
+            # Missing months are summed as zero and counted, so a gap only blanks the windows it falls in
+            missing = np.isnan(values)
+            zeros = np.zeros((1, values.shape[1]))
+            cumulative = np.concatenate([zeros, np.cumsum(np.where(missing, 0.0, values), axis=0)])
+            cumulative_missing = np.concatenate([zeros, np.cumsum(missing, axis=0)])
+            for window_size in self.windows:
+                # Mean of the window_size months before each target month
+                end, start = slice(h, h + n_rows), slice(h - window_size, h - window_size + n_rows)
+                means = (cumulative[end] - cumulative[start]) / window_size
+                means[cumulative_missing[end] > cumulative_missing[start]] = np.nan
+                X[:, :, column] = means
+                column += 1
+
+        if self.calendar:
+            X[:, :, column] = np.asarray(months)[h:, None]
+        return X, values[h:]
+
+    # Feature rows for the month after history, for every series at once.
+    # history is (n_months, n_series) with at least self.history rows. Returns (n_series, n_features)
+    def next_row(self, history, month=None):
+        history = np.asarray(history, dtype=np.float64)
+        if history.ndim == 1:
+            history = history[:, None]
+        parts = [history[-np.array(self.lags)].T]
+        for window_size in self.windows:
+            parts.append(history[-window_size:].mean(axis=0)[:, None])
+        if self.calendar:
+            parts.append(np.full((history.shape[1], 1), month, dtype=np.float64))
+        return np.hstack(parts)
+
+
+# Month-of-year of the steps months that follow last_month
+def future_months(last_month, steps):
+    return (last_month + np.arange(steps)) % 12 + 1
+
+
+# Rows whose features and target are all observed, per series: (n_rows, n_series)
+def complete_rows(X, y):
+    return np.isfinite(X).all(axis=2) & np.isfinite(y)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""On-disk cache of SARIMA fits
+
+Each fit is stored as a small JSON file keyed by a hash of the input series,
+the (order, seasonal_order) pair and the SARIMAX options, so unchanged series
+are never refit and a table that gains a month only misses on its own series.
+The latest fit of each named series is also kept under a data-independent key
+so a refit can warm-start from it.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+# Default location and limits of the cache
+CACHE_DIR = '.sarima_cache'
+MAX_BYTES = 64 * 1024 * 1024  # 64 MB
+MAX_AGE = 30 * 24 * 3600  # 30 days since the fit was written, however often it is read
+
+
+# Hash the series content together with the model specification
+def fit_key(data, order, seasonal_order, options):
+    values = np.ascontiguousarray(np.asarray(data, dtype=np.float64))
+    h = hashlib.sha256(values.tobytes())
+    spec = [list(order), list(seasonal_order), options]
+    h.update(json.dumps(spec, sort_keys=True).encode('utf-8'))
+    return h.hexdigest()
+
+
+# Key for the latest fit of a named series at a given order, whatever its data; lets the next
+# run warm-start from the previous run's parameters after the series gains new months
+def series_key(name, order, seasonal_order, options):
+    spec = [str(name), list(order), list(seasonal_order), options]
+    return 'series-' + hashlib.sha256(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class FitCache:
+    def __init__(self, path=CACHE_DIR, max_bytes=MAX_BYTES, max_age=MAX_AGE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, f'{key}.json')
+
+    # Return the stored record for key, or None on a miss or an expired entry
+    def get(self, key):
+        file = self._file(key)
+        try:
+            written = os.path.getmtime(file)
+            if time.time() - written > self.max_age:
+                os.remove(file)
+                return None
+            with open(file) as f:
+                record = json.load(f)
+            # The access time records the last read, for size-based eviction of the least recently
+            # used entries; the modification time stays the write time that max_age is measured from
+            os.utime(file, (time.time(), written))
+        except (OSError, ValueError):
+            return None
+        return record
+
+    # Write atomically so concurrent workers never see a partial entry
+    def put(self, key, record):
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(record, f)
+            os.replace(tmp, self._file(key))
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    # Drop expired entries, then the least recently used ones until under max_bytes
+    def prune(self):
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith('.json'):
+                continue
+            file = os.path.join(self.path, name)
+            try:
+                stat = os.stat(file)
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.max_age:
+                os.remove(file)
+            else:
+                entries.append((max(stat.st_atime, stat.st_mtime), stat.st_size, file))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, file in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(file)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.path):
+            if name.endswith('.json'):
+                os.remove(os.path.join(self.path, name))
@@ -0,0 +1,487 @@
+# -*- coding: utf-8 -*-
+"""Work queue for spreading SARIMA fits over worker processes and hosts
+
+The coordinator writes the series and one job per unit of work (a grid
+order, a warm-started block of orders, a stepwise walk or a final fit) into
+a SQLite file; workers started anywhere that can open the file claim jobs,
+run them and write the fit records back:
+
+    python fit_queue.py worker --queue /shared/fit_queue.sqlite
+    python fit_queue.py status --queue /shared/fit_queue.sqlite
+
+A claimed job carries a lease that the worker's heartbeat keeps extending
+while the fit runs. A job whose lease runs out (its worker was killed, lost
+its host or hung) is handed to the next worker that asks, up to
+MAX_ATTEMPTS times, so capacity is added or removed just by starting or
+stopping workers. search_sarima_orders_queued and fit_sarima_models_queued
+wait for their batch and assemble the same results and sarima_models as the
+in-process functions.
+
+Leases are compared against each host's clock, so hosts should keep their
+clocks within a few seconds of each other. WAL journaling needs memory
+shared between the processes; a queue used from several hosts on a network
+filesystem must be created with journal_mode='delete'.
+"""
+
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+
+from sarima_search import (FIT_MAX_ITER, FIT_TIME_LIMIT, STEPWISE_MAX_FITS, fit_block, fit_record, fit_sarima_model,
+                           pdq_combinations, search_results, stepwise_search)
+
+QUEUE_FILE = 'fit_queue.sqlite'
+JOURNAL_MODE = 'wal'
+
+# Seconds a claim lasts without a heartbeat; heartbeats are sent every third of it
+LEASE = 120
+
+# Claims per job before it is recorded as failed (a fit that keeps killing its worker fails for good)
+MAX_ATTEMPTS = 3
+
+# Seconds between polls of an idle worker and of a waiting coordinator
+POLL = 2.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    id TEXT PRIMARY KEY,
+    options TEXT NOT NULL,
+    submitted REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS series (
+    batch TEXT NOT NULL,
+    key TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (batch, key)
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    batch TEXT NOT NULL,
+    key TEXT NOT NULL,
+    spec TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    heartbeat REAL,
+    result TEXT,
+    error TEXT,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_until);
+CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch, status);
+"""
+
+
+class Job:
+    def __init__(self, id, batch, key, spec, attempts):
+        self.id = id
+        self.batch = batch
+        self.key = key
+        self.spec = spec
+        self.attempts = attempts
+
+
+class FitQueue:
+    # journal_mode only applies when the file is created
+    def __init__(self, path=QUEUE_FILE, lease=LEASE, max_attempts=MAX_ATTEMPTS, journal_mode=JOURNAL_MODE):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        created = not os.path.exists(path)
+        with self._connect() as conn:
+            if created and journal_mode:
+                conn.execute(f'PRAGMA journal_mode={journal_mode}')
+            conn.executescript(SCHEMA)
+
+    # A connection per operation, so heartbeat threads and forked workers never share one
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self._connect() as conn:
+            # Take the write lock up front, so two workers cannot claim the same job
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    # Jobs whose lease ran out on their last attempt fail instead of being claimed again
+    def _expire(self, conn, now, batch=None):
+        conn.execute("UPDATE jobs SET status = 'failed', error = ?, finished = ? "
+                     "WHERE status = 'running' AND lease_until < ? AND attempts >= ?" + (' AND batch = ?' if batch else ''),
+                     (f'lease expired on all {self.max_attempts} attempts', now, now, self.max_attempts) + ((batch,) if batch else ()))
+
+    # Add a batch: series {key: values}, jobs [(key, spec)] and the fit options every job runs with
+    def submit(self, series, jobs, options):
+        batch = uuid.uuid4().hex
+        with self._transaction() as conn:
+            conn.execute('INSERT INTO batches (id, options, submitted) VALUES (?, ?, ?)', (batch, json.dumps(options), time.time()))
+            conn.executemany('INSERT INTO series (batch, key, data) VALUES (?, ?, ?)',
+                             [(batch, json.dumps(key), np.asarray(values, dtype=np.float64).tobytes()) for key, values in series.items()])
+            conn.executemany('INSERT INTO jobs (batch, key, spec) VALUES (?, ?, ?)',
+                             [(batch, json.dumps(key), json.dumps(spec)) for key, spec in jobs])
+        return batch
+
+    # The next pending job, or one whose lease has run out, leased to worker; None when there is none
+    def claim(self, worker, batch=None):
+        now = time.time()
+        with self._transaction() as conn:
+            self._expire(conn, now)
+            query = ("SELECT id, batch, key, spec, attempts FROM jobs "
+                     "WHERE (status = 'pending' OR (status = 'running' AND lease_until < ?))")
+            arguments = [now]
+            if batch is not None:
+                query += ' AND batch = ?'
+                arguments.append(batch)
+            row = conn.execute(query + ' ORDER BY id LIMIT 1', arguments).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, heartbeat = ?, attempts = attempts + 1 "
+                         "WHERE id = ?", (worker, now + self.lease, now, row[0]))
+        id, batch, key, spec, attempts = row
+        return Job(id, batch, tuple(json.loads(key)), json.loads(spec), attempts + 1)
+
+    # Extend the lease; False once the job has been handed to another worker or finished
+    def heartbeat(self, job, worker):
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute("UPDATE jobs SET lease_until = ?, heartbeat = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                                  (now + self.lease, now, job.id, worker))
+        return cursor.rowcount > 0
+
+    # Record the result. A worker whose lease ran out still delivers it if no one has finished the job since
+    def complete(self, job, worker, result):
+        with self._connect() as conn:
+            cursor = conn.execute("UPDATE jobs SET status = 'done', worker = ?, result = ?, error = NULL, lease_until = NULL, "
+                                  "finished = ? WHERE id = ? AND status = 'running'", (worker, json.dumps(result), time.time(), job.id))
+        return cursor.rowcount > 0
+
+    # Put the job back for another attempt, or mark it failed after max_attempts
+    def fail(self, job, worker, error):
+        status = 'failed' if job.attempts >= self.max_attempts else 'pending'
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = ?, error = ?, lease_until = NULL, finished = ? "
+                         "WHERE id = ? AND worker = ? AND status = 'running'",
+                         (status, error, time.time() if status == 'failed' else None, job.id, worker))
+
+    # Hand the job back without using up an attempt (the worker is shutting down)
+    def release(self, job, worker):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'pending', attempts = attempts - 1, lease_until = NULL "
+                         "WHERE id = ? AND worker = ? AND status = 'running'", (job.id, worker))
+
+    def options(self, batch):
+        with self._connect() as conn:
+            return json.loads(conn.execute('SELECT options FROM batches WHERE id = ?', (batch,)).fetchone()[0])
+
+    def series(self, batch, key):
+        with self._connect() as conn:
+            data = conn.execute('SELECT data FROM series WHERE batch = ? AND key = ?', (batch, json.dumps(list(key)))).fetchone()[0]
+        return np.frombuffer(data, dtype=np.float64).copy()
+
+    # Jobs of the batch by status, e.g. {'done': 40, 'running': 4, 'pending': 12}
+    def counts(self, batch=None):
+        query = 'SELECT status, COUNT(*) FROM jobs' + (' WHERE batch = ?' if batch is not None else '') + ' GROUP BY status'
+        with self._connect() as conn:
+            return dict(conn.execute(query, () if batch is None else (batch,)).fetchall())
+
+    # Workers holding a live lease, with their job count and last heartbeat
+    def workers(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT worker, COUNT(*), MAX(heartbeat) FROM jobs WHERE status = 'running' AND lease_until >= ? "
+                                "GROUP BY worker ORDER BY worker", (time.time(),)).fetchall()
+
+    # (key, spec, status, result, error) of every job of the batch, in submission order
+    def results(self, batch):
+        with self._connect() as conn:
+            rows = conn.execute('SELECT key, spec, status, result, error FROM jobs WHERE batch = ? ORDER BY id', (batch,)).fetchall()
+        return [(tuple(json.loads(key)), json.loads(spec), status, None if result is None else json.loads(result), error)
+                for key, spec, status, result, error in rows]
+
+    def delete(self, batch):
+        with self._transaction() as conn:
+            for table, column in (('jobs', 'batch'), ('series', 'batch'), ('batches', 'id')):
+                conn.execute(f'DELETE FROM {table} WHERE {column} = ?', (batch,))
+
+    # Block until no job of the batch is pending or running; returns the final counts
+    def wait(self, batch, poll=POLL, timeout=None):
+        started = time.monotonic()
+        while True:
+            counts = self.counts(batch)
+            if not counts.get('pending') and not counts.get('running'):
+                return counts
+            if timeout is not None and time.monotonic() - started > timeout:
+                raise TimeoutError(f'Fit queue batch {batch} not finished after {timeout}s: {counts}')
+            # With no worker left to claim it, a job abandoned on its last attempt must still end as failed
+            with self._connect() as conn:
+                self._expire(conn, time.time(), batch)
+            time.sleep(poll)
+
+
+def _order_record(record):
+    return [list(record[0]), record[1]]
+
+
+# Run one job on data with the batch options; returns what is stored as its result
+def run_job(job, data, options, cache=None):
+    name = '|'.join(job.key)
+    spec = job.spec
+    if spec['kind'] == 'order':
+        return fit_record(data, tuple(spec['order']), cache, options['time_limit'], options['max_iter'],
+                          options['warm_start'], None, name)
+    if spec['kind'] == 'block':
+        fits = fit_block(data, [tuple(order) for order in spec['orders']], cache, options['time_limit'], options['max_iter'],
+                         options['warm_start'], name)
+        return [_order_record(item) for item in fits.items()]
+    if spec['kind'] == 'stepwise':
+        fits = stepwise_search(data, spec['max_fits'], cache, options['time_limit'], options['max_iter'], options['warm_start'], name)
+        return [_order_record(item) for item in fits.items()]
+    if spec['kind'] == 'fit':
+        import warnings
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            model_fit = fit_sarima_model(data, tuple(spec['order']), tuple(spec['seasonal_order']), cache, name, options['warm_start'])
+        return {'params': [float(x) for x in model_fit.params], 'aic': float(model_fit.aic)}
+    raise ValueError(f"Unknown fit job kind: {spec['kind']!r}")
+
+
+def _heartbeat(queue, job, worker, stop):
+    while not stop.wait(queue.lease / 3):
+        if not queue.heartbeat(job, worker):
+            return
+
+
+def worker_name():
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+# Claim and run jobs until stopped. batch limits the worker to one batch and stops it when the batch
+# is finished; idle_exit stops it after that many seconds without a job; max_jobs after that many jobs.
+# Returns the number of jobs run
+def run_worker(path=QUEUE_FILE, worker=None, batch=None, lease=LEASE, poll=POLL, idle_exit=None, max_jobs=None, verbose=False):
+    from fit_cache import FitCache
+    # One BLAS thread per worker so the workers, not numpy, own the cores
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(1)
+    except ImportError:
+        pass
+
+    queue = FitQueue(path, lease=lease)
+    worker = worker or worker_name()
+    series = {}
+    caches = {}
+    n_jobs = 0
+    idle_since = time.monotonic()
+    while max_jobs is None or n_jobs < max_jobs:
+        job = queue.claim(worker, batch)
+        if job is None:
+            if batch is not None:
+                counts = queue.counts(batch)
+                if not counts.get('pending') and not counts.get('running'):
+                    break
+            if idle_exit is not None and time.monotonic() - idle_since > idle_exit:
+                break
+            time.sleep(poll)
+            continue
+
+        # Fits run in this thread, where fit time limits can interrupt them; a second thread keeps the lease
+        stop = threading.Event()
+        beat = threading.Thread(target=_heartbeat, args=(queue, job, worker, stop), daemon=True)
+        beat.start()
+        try:
+            options = queue.options(job.batch)
+            if (job.batch, job.key) not in series:
+                series[(job.batch, job.key)] = queue.series(job.batch, job.key)
+            cache_dir = options.get('cache_dir')
+            if cache_dir is not None and cache_dir not in caches:
+                caches[cache_dir] = FitCache(cache_dir)
+            started = time.perf_counter()
+            result = run_job(job, series[(job.batch, job.key)], options, caches.get(cache_dir))
+            queue.complete(job, worker, result)
+            if verbose:
+                print(f"{worker}: job {job.id} {job.spec['kind']} {'|'.join(job.key)} in {time.perf_counter() - started:.1f}s")
+        except (KeyboardInterrupt, SystemExit):
+            queue.release(job, worker)
+            raise
+        except Exception:
+            queue.fail(job, worker, traceback.format_exc())
+        finally:
+            stop.set()
+            beat.join()
+        n_jobs += 1
+        idle_since = time.monotonic()
+    return n_jobs
+
+
+# Run the batch to completion, with local_workers worker processes on this host next to any remote ones
+def _run_batch(queue, batch, local_workers=0, poll=POLL, timeout=None):
+    import multiprocessing
+    processes = [multiprocessing.Process(target=run_worker, args=(queue.path,), kwargs={'batch': batch, 'lease': queue.lease, 'poll': poll})
+                 for _ in range(local_workers)]
+    for process in processes:
+        process.start()
+    try:
+        return queue.wait(batch, poll, timeout)
+    finally:
+        for process in processes:
+            process.join(timeout=poll * 2)
+            if process.is_alive():
+                process.terminate()
+
+
+def _options(time_limit, max_iter, warm_start, cache_dir):
+    return {'time_limit': time_limit, 'max_iter': max_iter, 'warm_start': warm_start,
+            'cache_dir': None if cache_dir is None else os.path.abspath(cache_dir)}
+
+
+# Jobs for the search, split like the in-process search: one per (series, order), per (series, d, D)
+# block when warm-starting the grid, or per series for the stepwise walk
+def search_jobs(keys, combinations=pdq_combinations, method='exhaustive', max_fits=STEPWISE_MAX_FITS, warm_start=False):
+    if method == 'exhaustive' and warm_start:
+        blocks = {}
+        for order in combinations:
+            blocks.setdefault((order[1], order[4]), []).append(list(order))
+        return [(key, {'kind': 'block', 'orders': orders}) for key in keys for orders in blocks.values()]
+    if method == 'exhaustive':
+        return [(key, {'kind': 'order', 'order': list(order)}) for key in keys for order in combinations]
+    if method == 'stepwise':
+        return [(key, {'kind': 'stepwise', 'max_fits': max_fits}) for key in keys]
+    raise ValueError(f"Unknown search method: {method!r} (expected 'exhaustive' or 'stepwise')")
+
+
+# search_sarima_orders through the queue: results[file][column] with the best order and fit counts.
+# cache_dir is a fit cache every worker can reach (e.g. on the shared disk); the batch is deleted
+# from the queue afterwards unless keep is set. A series none of whose fits succeeded keeps order
+# None, as in the in-process search, and raises a RuntimeWarning with the last job error
+def search_sarima_orders_queued(datasets, files_and_columns, queue, combinations=pdq_combinations, method='exhaustive',
+                                max_fits=STEPWISE_MAX_FITS, time_limit=FIT_TIME_LIMIT, max_iter=FIT_MAX_ITER, warm_start=False,
+                                cache_dir=None, local_workers=0, poll=POLL, timeout=None, keep=False):
+    import warnings
+    series = {(file, column): datasets[file][column] for file, columns in files_and_columns.items() for column in columns}
+    jobs = search_jobs(list(series), combinations, method, max_fits, warm_start)
+    batch = queue.submit(series, jobs, _options(time_limit, max_iter, warm_start, cache_dir))
+    try:
+        _run_batch(queue, batch, local_workers, poll, timeout)
+        fits = {key: {} for key in series}
+        errors = {}
+        for key, spec, status, result, error in queue.results(batch):
+            if status == 'done' and spec['kind'] == 'order':
+                fits[key][tuple(spec['order'])] = result
+            elif status == 'done':
+                fits[key].update((tuple(order), record) for order, record in result)
+            else:
+                # Jobs that failed for good count as failed fits: every order of a grid job, and one
+                # fit for a stepwise walk, whose orders are unknown (it is filed under None)
+                errors[key] = (error or status).strip().splitlines()[-1]
+                for order in spec.get('orders', [spec.get('order')]):
+                    fits[key][None if order is None else tuple(order)] = {'status': 'failed', 'aic': None, 'params': None,
+                                                                          'converged': False}
+    finally:
+        if not keep:
+            queue.delete(batch)
+    results = search_results(fits, files_and_columns, combinations)
+    for (file, column) in series:
+        if results[file][column]['order'] is None:
+            warnings.warn(f'No SARIMA fit of {file}|{column} succeeded in the fit queue'
+                          + (f': {errors[(file, column)]}' if (file, column) in errors else ''), RuntimeWarning)
+    return results
+
+
+# The fixed-order fits of the training loop through the queue: sarima_models[file][column], rebuilt
+# here from the fitted parameters. orders[file][column] = {'order': ..., 'seasonal_order': ...}
+def fit_sarima_models_queued(train_datasets, orders, queue, warm_start=False, cache_dir=None, local_workers=0, poll=POLL,
+                             timeout=None, keep=False):
+    import warnings
+    from statsmodels.tsa.statespace.sarimax import SARIMAX
+    from sarima_search import SARIMAX_OPTIONS
+    series = {(file, column): train_datasets[file][column] for file, columns in orders.items() for column in columns}
+    jobs = [(key, {'kind': 'fit', 'order': list(orders[key[0]][key[1]]['order']),
+                   'seasonal_order': list(orders[key[0]][key[1]]['seasonal_order'])}) for key in series]
+    batch = queue.submit(series, jobs, _options(FIT_TIME_LIMIT, FIT_MAX_ITER, warm_start, cache_dir))
+    try:
+        _run_batch(queue, batch, local_workers, poll, timeout)
+        rows = queue.results(batch)
+    finally:
+        if not keep:
+            queue.delete(batch)
+
+    failed = [f'{file}|{column}: {(error or status).strip().splitlines()[-1]}'
+              for (file, column), spec, status, result, error in rows if status != 'done']
+    if failed:
+        raise RuntimeError('SARIMA fits failed in the queue:\n' + '\n'.join(failed))
+
+    sarima_models = {file: {} for file in orders}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for (file, column), spec, status, result, error in rows:
+            model = SARIMAX(series[(file, column)], order=tuple(spec['order']), seasonal_order=tuple(spec['seasonal_order']),
+                            **SARIMAX_OPTIONS)
+            sarima_models[file][column] = model.smooth(np.asarray(result['params']))
+    return sarima_models
+
+
+def print_status(queue):
+    with queue._connect() as conn:
+        rows = conn.execute('SELECT b.id, b.submitted, j.status, COUNT(*) FROM batches b JOIN jobs j ON j.batch = b.id '
+                            'GROUP BY b.id, j.status ORDER BY b.submitted').fetchall()
+    batches = {}
+    for batch, submitted, status, count in rows:
+        batches.setdefault((batch, submitted), {})[status] = count
+    for (batch, submitted), counts in batches.items():
+        summary = ', '.join(f'{count} {status}' for status, count in sorted(counts.items()))
+        print(f"{batch[:12]}  submitted {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(submitted))}  {summary}")
+    if not batches:
+        print('No batches in the queue')
+    for worker, count, heartbeat in queue.workers():
+        print(f'worker {worker}: {count} job(s), last heartbeat {time.time() - heartbeat:.0f}s ago')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='SARIMA fit queue: run a worker or show the queue')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('worker', help='claim and run fit jobs')
+    command.add_argument('--queue', default=QUEUE_FILE, help=f'queue file (default: {QUEUE_FILE})')
+    command.add_argument('--name', default=None, help='worker name (default: host-pid)')
+    command.add_argument('--lease', type=float, default=LEASE, help='seconds a claim lasts without a heartbeat')
+    command.add_argument('--poll', type=float, default=POLL, help='seconds between polls when idle')
+    command.add_argument('--idle-exit', type=float, default=None, help='exit after this many seconds without a job (default: never)')
+    command.add_argument('--max-jobs', type=int, default=None, help='exit after this many jobs')
+    command = commands.add_parser('status', help='jobs per batch and live workers')
+    command.add_argument('--queue', default=QUEUE_FILE, help=f'queue file (default: {QUEUE_FILE})')
+    args = parser.parse_args(argv)
+
+    if args.command == 'worker':
+        try:
+            n_jobs = run_worker(args.queue, args.name, lease=args.lease, poll=args.poll, idle_exit=args.idle_exit,
+                                max_jobs=args.max_jobs, verbose=True)
+        except KeyboardInterrupt:
+            return 130
+        print(f'{n_jobs} job(s) run')
+    else:
+        print_status(FitQueue(args.queue))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""SARIMA forecast results computed once and shared
+
+Runs each fitted model's Kalman forecast recursion a single time for the
+longest horizon anyone asks for and keeps the mean, the forecast variance
+and the intervals at every configured confidence level. Plots, exports and
+the stacked forecasts then read from the same result; shorter horizons are
+slices of it, and an interval at an extra level only needs the stored
+variance, not another recursion.
+"""
+
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+# Confidence levels whose intervals are computed with every forecast
+LEVELS = (0.8, 0.95)
+
+
+def _z(level):
+    return NormalDist().inv_cdf(0.5 + level / 2)
+
+
+class SarimaForecast:
+    # mean holds the predicted means (a Series on the forecast dates when the model was fitted on
+    # a dated series), variance the forecast variance of each step
+    def __init__(self, mean, variance, levels=LEVELS):
+        self.mean = mean if isinstance(mean, pd.Series) else pd.Series(np.asarray(mean, dtype=np.float64))
+        self.variance = np.asarray(variance, dtype=np.float64)
+        self.std = np.sqrt(self.variance)
+        self.intervals = {level: self._interval(level) for level in levels}
+
+    def __len__(self):
+        return len(self.mean)
+
+    def _interval(self, level):
+        spread = _z(level) * self.std
+        return self.mean.to_numpy() - spread, self.mean.to_numpy() + spread
+
+    # (lower, upper) arrays at a confidence level
+    def interval(self, level=0.95):
+        if level not in self.intervals:
+            self.intervals[level] = self._interval(level)
+        return self.intervals[level]
+
+    # Same layout as statsmodels' conf_int(alpha): lower and upper columns on the forecast index
+    def conf_int(self, alpha=0.05):
+        lower, upper = self.interval(round(1 - alpha, 10))
+        return pd.DataFrame({'lower': lower, 'upper': upper}, index=self.mean.index)
+
+    # The first steps of this forecast
+    def head(self, steps):
+        if steps == len(self):
+            return self
+        return SarimaForecast(self.mean.iloc[:steps], self.variance[:steps], tuple(self.intervals))
+
+
+class ForecastResultCache:
+    def __init__(self, levels=LEVELS):
+        self.levels = tuple(levels)
+        self._results = {}
+        self.computations = 0
+
+    # Forecast of model_fit for steps, keyed by the series key. A result is reused while the
+    # key still maps to the same fitted model and covers at least steps months
+    def get(self, key, model_fit, steps):
+        entry = self._results.get(key)
+        if entry is None or entry[0] is not model_fit or len(entry[1]) < steps:
+            prediction = model_fit.get_forecast(steps=steps)
+            forecast = SarimaForecast(prediction.predicted_mean, prediction.var_pred_mean, self.levels)
+            self._results[key] = entry = (model_fit, forecast)
+            self.computations += 1
+        return entry[1].head(steps)
+
+    # Mean forecasts of several series as one (steps, n_series) array
+    def means(self, keys, models, steps):
+        return np.column_stack([self.get(key, model_fit, steps).mean.to_numpy() for key, model_fit in zip(keys, models)])
+
+    def clear(self):
+        self._results.clear()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Batched recursive multi-step forecasting
+
+Advances every series together: each horizon step builds one feature row
+per series and evaluates all the Gradient Boosting models in a single
+vectorized pass, then combines SARIMA and GB forecasts through each series'
+stacking model. The per-series GB ensembles are compiled into padded node
+arrays so that one step costs a few array operations instead of one
+sklearn predict call per series.
+"""
+
+import numpy as np
+
+
+class CompiledEnsemble:
+    # Per-series trees packed into (n_series, n_trees, n_nodes) arrays. Leaves point to
+    # themselves, so a fixed number of descent steps lands every tree on its leaf
+    ARRAYS = ['feature', 'threshold', 'left', 'right', 'value', 'baseline']
+
+    def __init__(self, feature, threshold, left, right, value, baseline, depth):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.baseline = baseline
+        self.depth = int(depth)
+
+    # Pack the trees of one GradientBoostingRegressor per series
+    @classmethod
+    def from_models(cls, models, n_features):
+        trees = [[estimator.tree_ for estimator in model.estimators_[:, 0]] for model in models]
+        n_series = len(models)
+        n_trees = max(len(series_trees) for series_trees in trees)
+        n_nodes = max(tree.node_count for series_trees in trees for tree in series_trees)
+        depth = max(tree.max_depth for series_trees in trees for tree in series_trees)
+
+        feature = np.zeros((n_series, n_trees, n_nodes), dtype=np.intp)
+        threshold = np.full((n_series, n_trees, n_nodes), np.inf)
+        left = np.zeros((n_series, n_trees, n_nodes), dtype=np.intp)
+        right = np.zeros((n_series, n_trees, n_nodes), dtype=np.intp)
+        value = np.zeros((n_series, n_trees, n_nodes))
+        baseline = np.zeros(n_series)
+
+        for i, (model, series_trees) in enumerate(zip(models, trees)):
+            for t, tree in enumerate(series_trees):
+                nodes = tree.node_count
+                leaf = tree.children_left == -1
+                feature[i, t, :nodes] = np.where(leaf, 0, tree.feature)
+                threshold[i, t, :nodes] = np.where(leaf, np.inf, tree.threshold)
+                left[i, t, :nodes] = np.where(leaf, np.arange(nodes), tree.children_left)
+                right[i, t, :nodes] = np.where(leaf, np.arange(nodes), tree.children_right)
+                value[i, t, :nodes] = model.learning_rate * tree.value[:, 0, 0]
+            baseline[i] = _baseline(model, n_features)
+        return cls(feature, threshold, left, right, value, baseline, depth)
+
+    # One prediction per series from X of shape (n_series, n_features)
+    def predict(self, X):
+        return self.predict_rows(np.asarray(X)[:, None, :])[:, 0]
+
+    # Predictions for several rows per series: X is (n_series, n_rows, n_features), each
+    # series' rows go through that series' trees. Returns (n_series, n_rows)
+    def predict_rows(self, X):
+        # sklearn trees split on float32 features; round the same way so routing matches exactly
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_series, n_rows, n_features = X.shape
+        feature, threshold, children, value = self._flat()
+
+        # Flat indexes: node holds the position of each (series, tree, row) node in the flattened
+        # node arrays, and row_start the position of each (series, row) in the flattened X
+        n_trees, n_nodes = self.feature.shape[1:]
+        node = np.repeat((np.arange(n_series * n_trees) * n_nodes).reshape(n_series, n_trees, 1), n_rows, axis=2)
+        row_start = (np.arange(n_series * n_rows) * n_features).reshape(n_series, 1, n_rows)
+        X = X.ravel()
+        for _ in range(self.depth):
+            go_right = np.take(X, np.take(feature, node) + row_start) > np.take(threshold, node)
+            node *= 2
+            node += go_right
+            node = np.take(children, node)
+        return self.baseline[:, None] + np.take(value, node).sum(axis=1)
+
+    # Node arrays flattened over (series, tree, node), with both children of each node side by
+    # side as flat positions, so one descent step is a few 1-d gathers
+    def _flat(self):
+        if getattr(self, '_flat_arrays', None) is None:
+            n_series, n_trees, n_nodes = self.feature.shape
+            offset = (np.arange(n_series * n_trees) * n_nodes).reshape(n_series, n_trees, 1)
+            children = np.stack([self.left + offset, self.right + offset], axis=-1)
+            self._flat_arrays = (np.ravel(self.feature), np.ravel(self.threshold), children.ravel(), np.ravel(self.value))
+        return self._flat_arrays
+
+
+def _baseline(model, n_features):
+    if model.init_ == 'zero':
+        return 0.0
+    return float(np.ravel(model.init_.predict(np.zeros((1, n_features))))[0])
+
+
+# Batched predict function for the GB models over (n_series, n_rows, n_features) rows:
+# the model's own predict_rows when it has one (compiled ensembles, the global model),
+# one compiled pass for per-series GradientBoostingRegressors, one predict call for a
+# single pooled model, and a per-model loop for anything else
+def row_predictor(gb_models, n_features):
+    if hasattr(gb_models, 'predict_rows'):
+        return gb_models.predict_rows
+    if not isinstance(gb_models, (list, tuple)):
+        return lambda X: gb_models.predict(X.reshape(-1, X.shape[2])).reshape(X.shape[:2])
+    from sklearn.ensemble import GradientBoostingRegressor
+    if all(isinstance(model, GradientBoostingRegressor) and model.loss in ('squared_error', 'absolute_error', 'huber', 'quantile')
+           for model in gb_models):
+        return CompiledEnsemble.from_models(gb_models, n_features).predict_rows
+    return lambda X: np.array([model.predict(X[i]) for i, model in enumerate(gb_models)])
+
+
+# Batched predict function for one (n_series, n_features) row per series
+def batch_predictor(gb_models, n_features):
+    predict_rows = row_predictor(gb_models, n_features)
+    return lambda X: predict_rows(X[:, None, :])[:, 0]
+
+
+# Recursive GB forecast for all series. history is (n_months, n_series); returns (steps, n_series)
+def recursive_gb_forecast(gb_models, history, feature_spec, months, steps):
+    history = np.asarray(history, dtype=np.float64)
+    n_series = history.shape[1]
+    predict = batch_predictor(gb_models, len(feature_spec.names))
+
+    # Rolling buffer: the last feature_spec.history months followed by the forecast so far
+    h = feature_spec.history
+    buffer = np.empty((h + steps, n_series))
+    buffer[:h] = history[-h:]
+    for step in range(steps):
+        features = feature_spec.next_row(buffer[step:step + h], months[step])
+        buffer[h + step] = predict(features)
+    return buffer[h:]
+
+
+# Apply every series' linear stacker to its SARIMA and GB forecasts at once
+def stack_forecasts(stackers, sarima_forecast, gb_forecast):
+    coef = np.array([stacker.coef_ for stacker in stackers])
+    intercept = np.array([stacker.intercept_ for stacker in stackers])
+    return sarima_forecast * coef[:, 0] + gb_forecast * coef[:, 1] + intercept
+
+
+# Stacked forecasts for all series: SARIMA forecasts, batched recursive GB forecasts,
+# combined through each series' meta-model. Returns (steps, n_series). sarima_forecast,
+# when given, holds the already computed (steps, n_series) SARIMA means
+def generate_forecasts(sarima_models, history, gb_models, stackers, forecast_length, feature_spec, months, sarima_forecast=None):
+    if sarima_forecast is None:
+        sarima_forecast = np.column_stack([np.asarray(model.forecast(steps=forecast_length)) for model in sarima_models])
+    gb_forecast = recursive_gb_forecast(gb_models, history, feature_spec, months, forecast_length)
+    return stack_forecasts(stackers, sarima_forecast, gb_forecast)
+
+
+# Stacked forecast for a single series
+def generate_forecast(model, history, gb_model, stacker, forecast_length, feature_spec, months):
+    history = np.asarray(history, dtype=np.float64).reshape(-1, 1)
+    return generate_forecasts([model], history, [gb_model], [stacker], forecast_length, feature_spec, months)[:, 0]
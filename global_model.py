@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""One gradient-boosting model pooled across all series
+
+Trains a single HistGradientBoostingRegressor on the lag, rolling-mean and
+calendar features of every series stacked together, with the series, fuel
+and sector as categorical features. Each series is divided by its own
+training scale before pooling, so tables measured in barrels, cubic feet
+and kilowatthours share trees, and predictions are scaled back per series.
+Training cost grows with the number of pooled rows only, binned once, and
+the size of the model does not depend on the number of series.
+"""
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import HistGradientBoostingRegressor
+
+# Most categories HistGradientBoostingRegressor accepts in one categorical feature
+MAX_CATEGORIES = 255
+
+
+# Integer codes of a metadata column, with NaN for a missing value
+def _codes(values):
+    codes, _ = pd.factorize(pd.Series(values))
+    return np.where(codes < 0, np.nan, codes).astype(np.float64)
+
+
+class GlobalGBModel:
+    # metadata is the Panel metadata (one row per series, in column order); feature_spec the
+    # FeatureSpec of the X it will be fitted on
+    def __init__(self, metadata, feature_spec, max_iter=300, learning_rate=0.05, max_leaf_nodes=31, random_state=42):
+        self.feature_spec = feature_spec
+        n_series = len(metadata)
+        self.ids = np.column_stack([np.arange(n_series, dtype=np.float64), _codes(metadata['fuel']), _codes(metadata['sector'])])
+        # Lags and rolling means are in the units of the series and get scaled; calendar features do not
+        self.n_scaled = len(feature_spec.lags) + len(feature_spec.windows)
+        n_features = len(feature_spec.names)
+        categorical = [n_features + 1, n_features + 2]
+        if n_series <= MAX_CATEGORIES:
+            categorical.insert(0, n_features)
+        self.model = HistGradientBoostingRegressor(max_iter=max_iter, learning_rate=learning_rate, max_leaf_nodes=max_leaf_nodes,
+                                                   categorical_features=categorical, random_state=random_state)
+        self.scale = None
+
+    # Pooled design matrix: scaled features of every (series, row) with the series identifiers
+    def _pool(self, X):
+        X = np.array(X, dtype=np.float64)
+        X[..., :self.n_scaled] /= self.scale[:, None, None]
+        ids = np.broadcast_to(self.ids[:, None, :], X.shape[:2] + (self.ids.shape[1],))
+        return np.concatenate([X, ids], axis=2).reshape(-1, X.shape[2] + self.ids.shape[1])
+
+    # Fit on X (n_rows, n_series, n_features) and y (n_rows, n_series) from FeatureSpec.build,
+    # keeping the rows marked in rows (n_rows, n_series), e.g. from complete_rows
+    def fit(self, X, y, rows=None):
+        X = np.asarray(X, dtype=np.float64).transpose(1, 0, 2)
+        y = np.asarray(y, dtype=np.float64).T
+        if rows is None:
+            rows = np.isfinite(y).T
+        rows = np.asarray(rows).T
+        # Per-series scale: the mean absolute training target
+        self.scale = np.array([np.mean(np.abs(y[i, rows[i]])) if rows[i].any() else 1.0 for i in range(len(y))])
+        self.scale[~(self.scale > 0)] = 1.0
+        pooled = self._pool(X)
+        target = (y / self.scale[:, None]).ravel()
+        keep = rows.ravel()
+        self.model.fit(pooled[keep], target[keep])
+        return self
+
+    # Predictions for X (n_series, n_rows, n_features), every series through the same model
+    def predict_rows(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        return self.model.predict(self._pool(X)).reshape(X.shape[:2]) * self.scale[:, None]
+
+    # One prediction per series from X (n_series, n_features)
+    def predict(self, X):
+        return self.predict_rows(np.asarray(X)[:, None, :])[:, 0]
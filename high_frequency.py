@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""High-frequency mode for hourly and daily load series
+
+A seasonal SARIMA with s = 24 or 168 carries a state vector of hundreds of
+elements, and with millions of points it cannot be fitted in useful time.
+Here the seasonal structure comes from Fourier terms of every period
+instead (daily and weekly cycles for hourly data), estimated with a trend by
+least squares over the whole history, accumulated chunk by chunk. A
+low-order, non-seasonal SARIMAX models the short-memory errors on the most
+recent points only. GB features are built chunk by chunk into one float32
+matrix, with the position in the longest cycle as the calendar feature,
+and a histogram-based model is trained on the most recent rows. The two
+forecasts are stacked on a holdout like the monthly models. Every pass over
+the history is linear in its length and the windowed fits have a fixed
+cost, so fit and forecast time grow linearly with the series. For long
+horizons an optional second forecaster runs on block means (e.g. hourly
+data aggregated to days).
+"""
+
+import warnings
+
+import numpy as np
+
+from features import FeatureSpec
+
+# Daily and weekly cycles of hourly data, with the Fourier harmonics used for each
+PERIODS = (24, 168)
+HARMONICS = (4, 3)
+
+# Non-seasonal ARMA order of the errors left by the Fourier regression
+ORDER = (2, 0, 1)
+
+# Most recent points the error model is fitted on, and rows the GB model is trained on
+FIT_POINTS = 20000
+MAX_TRAIN_ROWS = 1000000
+
+# Rows per chunk when building regression and feature matrices
+CHUNK_SIZE = 100000
+
+# Points held out to fit the stacker (one week of hourly data)
+HOLDOUT = 168
+
+
+# Fourier terms (cos, sin of each harmonic of each period) at the time points t: (len(t), 2 * sum(harmonics))
+def fourier_terms(t, periods=PERIODS, harmonics=HARMONICS):
+    t = np.asarray(t, dtype=np.float64)
+    columns = []
+    for period, n_harmonics in zip(periods, harmonics):
+        for k in range(1, n_harmonics + 1):
+            angle = (2 * np.pi * k / period) * t
+            columns.extend((np.cos(angle), np.sin(angle)))
+    return np.column_stack(columns) if columns else np.empty((len(t), 0))
+
+
+# Mean of every factor consecutive points, aligned so the last block ends with the last point
+# (an incomplete first block is dropped); missing points are left out of their block's mean
+def aggregate(values, factor):
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values) // factor * factor
+    blocks = values[len(values) - n:].reshape(-1, factor)
+    observed = np.isfinite(blocks)
+    counts = observed.sum(axis=1)
+    sums = np.where(observed, blocks, 0.0).sum(axis=1)
+    return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+
+# Lags at 1-3 steps and one full cycle of each period, rolling means over the shortest and longest
+# cycle, and the position in the longest cycle as the calendar feature
+def default_feature_spec(periods=PERIODS):
+    cycles = sorted({int(round(period)) for period in periods if period >= 2})
+    windows = (cycles[0], cycles[-1]) if cycles else ()
+    return FeatureSpec(lags=(1, 2, 3) + tuple(cycles), windows=windows, calendar=bool(cycles))
+
+
+# Features of every row of values with enough history, built chunk_size rows at a time into one
+# (n_rows, n_features) matrix of dtype; phases is the calendar value of every point. Returns X and
+# the targets y (a view into values)
+def build_features(values, feature_spec, phases=None, chunk_size=CHUNK_SIZE, dtype=np.float32):
+    values = np.asarray(values, dtype=np.float64)
+    h = feature_spec.history
+    n_rows = max(len(values) - h, 0)
+    X = np.empty((n_rows, len(feature_spec.names)), dtype=dtype)
+    for start in range(0, n_rows, chunk_size):
+        stop = min(start + chunk_size, n_rows)
+        chunk_phases = None if phases is None else phases[start:stop + h]
+        X[start:stop] = feature_spec.build(values[start:stop + h], chunk_phases)[0][:, 0]
+    return X, values[h:]
+
+
+class FourierSarimax:
+    def __init__(self, periods=PERIODS, harmonics=HARMONICS, order=ORDER, trend=True, fit_points=FIT_POINTS, chunk_size=CHUNK_SIZE):
+        self.periods = tuple(periods)
+        self.harmonics = tuple(harmonics)
+        self.order = tuple(order)
+        self.trend = trend
+        self.fit_points = fit_points
+        self.chunk_size = chunk_size
+        self.coef = None
+        self.errors = None
+        self.n = 0
+        self.time_scale = 1.0
+
+    # Regression design (intercept, trend, Fourier terms) of the points start .. start + n - 1
+    def design(self, start, n):
+        t = np.arange(start, start + n, dtype=np.float64)
+        columns = [np.ones((n, 1))]
+        if self.trend:
+            columns.append((t / self.time_scale)[:, None])
+        columns.append(fourier_terms(t, self.periods, self.harmonics))
+        return np.hstack(columns)
+
+    def fit(self, y):
+        from statsmodels.tsa.statespace.sarimax import SARIMAX
+        y = np.asarray(y, dtype=np.float64)
+        self.n = len(y)
+        self.time_scale = float(max(self.n, 1))
+
+        # Normal equations accumulated over chunks, skipping missing points
+        n_columns = self.design(0, 1).shape[1]
+        xtx = np.zeros((n_columns, n_columns))
+        xty = np.zeros(n_columns)
+        for start in range(0, self.n, self.chunk_size):
+            chunk = y[start:start + self.chunk_size]
+            observed = np.isfinite(chunk)
+            A = self.design(start, len(chunk))[observed]
+            xtx += A.T @ A
+            xty += A.T @ chunk[observed]
+        self.coef = np.linalg.lstsq(xtx, xty, rcond=None)[0]
+
+        start = max(self.n - self.fit_points, 0)
+        residuals = y[start:] - self.design(start, self.n - start) @ self.coef
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            self.errors = SARIMAX(residuals, order=self.order, trend='n').fit(disp=False)
+        return self
+
+    # Roll the model forward over new points without refitting
+    def extend(self, new_observations):
+        new_observations = np.asarray(new_observations, dtype=np.float64)
+        residuals = new_observations - self.design(self.n, len(new_observations)) @ self.coef
+        self.errors = self.errors.extend(residuals)
+        self.n += len(new_observations)
+        return self
+
+    # Mean and variance of the next steps points
+    def forecast(self, steps):
+        prediction = self.errors.get_forecast(steps=steps)
+        mean = self.design(self.n, steps) @ self.coef + np.asarray(prediction.predicted_mean)
+        return mean, np.asarray(prediction.var_pred_mean)
+
+
+class HighFrequencyGB:
+    # period is the cycle whose position is the calendar feature (ignored when feature_spec has none)
+    def __init__(self, feature_spec=None, period=max(PERIODS), max_train_rows=MAX_TRAIN_ROWS, chunk_size=CHUNK_SIZE,
+                 max_iter=200, learning_rate=0.1, random_state=42):
+        from sklearn.ensemble import HistGradientBoostingRegressor
+        self.feature_spec = feature_spec or default_feature_spec((period,))
+        self.period = int(round(period))
+        self.max_train_rows = max_train_rows
+        self.chunk_size = chunk_size
+        self.model = HistGradientBoostingRegressor(max_iter=max_iter, learning_rate=learning_rate, random_state=random_state)
+        self.history = None
+        self.n = 0
+
+    def _phases(self, start, n):
+        return np.arange(start, start + n) % self.period if self.feature_spec.calendar else None
+
+    def fit(self, y):
+        y = np.asarray(y, dtype=np.float64)
+        h = self.feature_spec.history
+        # Only the most recent rows are trained on, so the feature matrix stays bounded
+        start = max(len(y) - h - self.max_train_rows, 0)
+        X, target = build_features(y[start:], self.feature_spec, self._phases(start, len(y) - start), self.chunk_size)
+        # Missing features are handled by the model; rows without a target are dropped
+        observed = np.isfinite(target)
+        self.model.fit(X[observed], target[observed])
+        self.history = y[-h:].copy()
+        self.n = len(y)
+        return self
+
+    # New points only extend the history the recursion starts from
+    def extend(self, new_observations):
+        self.history = np.concatenate([self.history, np.asarray(new_observations, dtype=np.float64)])[-self.feature_spec.history:]
+        self.n += len(new_observations)
+        return self
+
+    # Recursive forecast of the next steps points
+    def forecast(self, steps):
+        h = self.feature_spec.history
+        buffer = np.empty(h + steps)
+        buffer[:h] = self.history
+        phases = self._phases(self.n, steps)
+        for step in range(steps):
+            row = self.feature_spec.next_row(buffer[step:step + h], None if phases is None else phases[step])
+            buffer[h + step] = self.model.predict(row)[0]
+        return buffer[h:]
+
+
+class HighFrequencyForecaster:
+    # aggregate, when set, also fits a forecaster on means of that many points (e.g. 24 for
+    # hourly data) for forecast_aggregated, whose periods are the original ones in blocks
+    def __init__(self, periods=PERIODS, harmonics=HARMONICS, order=ORDER, feature_spec=None, holdout=HOLDOUT,
+                 aggregate=None, fit_points=FIT_POINTS, max_train_rows=MAX_TRAIN_ROWS, chunk_size=CHUNK_SIZE):
+        self.periods = tuple(periods)
+        self.harmonics = tuple(harmonics)
+        self.order = tuple(order)
+        self.feature_spec = feature_spec or default_feature_spec(self.periods)
+        self.holdout = holdout
+        self.aggregate = aggregate
+        self.fit_points = fit_points
+        self.max_train_rows = max_train_rows
+        self.chunk_size = chunk_size
+        self.sarimax = None
+        self.gb = None
+        self.stacker = None
+        self.long_horizon = None
+
+    def fit(self, y):
+        from sklearn.linear_model import LinearRegression
+        y = np.asarray(y, dtype=np.float64)
+        train, holdout = y[:-self.holdout], y[-self.holdout:]
+        self.sarimax = FourierSarimax(self.periods, self.harmonics, self.order, fit_points=self.fit_points,
+                                      chunk_size=self.chunk_size).fit(train)
+        self.gb = HighFrequencyGB(self.feature_spec, max(self.periods, default=1), self.max_train_rows, self.chunk_size).fit(train)
+
+        # Stack the two on their holdout forecasts, then roll both models over the holdout
+        predictions = np.column_stack([self.sarimax.forecast(self.holdout)[0], self.gb.forecast(self.holdout)])
+        observed = np.isfinite(holdout)
+        self.stacker = LinearRegression().fit(predictions[observed], holdout[observed])
+        self.sarimax.extend(holdout)
+        self.gb.extend(holdout)
+
+        if self.aggregate:
+            kept = [(period / self.aggregate, n) for period, n in zip(self.periods, self.harmonics) if period / self.aggregate >= 2]
+            periods = tuple(period for period, _ in kept)
+            # A harmonic must stay below half the period in blocks
+            harmonics = tuple(min(n, int((period - 1) // 2)) for period, n in kept)
+            self.long_horizon = HighFrequencyForecaster(
+                periods, harmonics, self.order, default_feature_spec(periods), max(self.holdout // self.aggregate, 7),
+                fit_points=self.fit_points, max_train_rows=self.max_train_rows, chunk_size=self.chunk_size).fit(aggregate(y, self.aggregate))
+        return self
+
+    # Stacked forecast of the next steps points
+    def forecast(self, steps):
+        predictions = np.column_stack([self.sarimax.forecast(steps)[0], self.gb.forecast(steps)])
+        return self.stacker.predict(predictions)
+
+    # Stacked forecast of the means of the next blocks blocks of aggregate points
+    def forecast_aggregated(self, blocks):
+        if self.long_horizon is None:
+            raise ValueError('Fit with aggregate set to forecast block means')
+        return self.long_horizon.forecast(blocks)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""Columnar ingest cache for the EIA Excel tables
+
+Each workbook is parsed once, streaming its rows in read-only mode and
+keeping only `Month` and the requested columns as typed float arrays, and
+the cleaned frame (float columns, datetime index) is stored as an
+uncompressed Arrow IPC file. Later loads memory-map that file instead of
+parsing the Excel again. The cache is stale when the source file's
+modification time and size change and its content hash no longer matches.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from array import array
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+# Default location of the cache
+INGEST_CACHE_DIR = '.ingest_cache'
+
+# Cells the EIA tables use for missing values
+MISSING_VALUES = ["Not Available"]
+
+
+def _file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _cache_paths(file, cache_dir):
+    name = os.path.basename(file)
+    return os.path.join(cache_dir, f'{name}.arrow'), os.path.join(cache_dir, f'{name}.json')
+
+
+def _cell_value(value, missing):
+    if value is None:
+        return np.nan
+    if isinstance(value, str):
+        value = value.strip()
+        return np.nan if value in missing or not value else float(value)
+    return float(value)
+
+
+# Linear interpolation of the missing values of every column at once, as pandas'
+# interpolate(method='linear'): gaps are filled between their neighbours, trailing gaps repeat
+# the last value and leading gaps stay missing
+def interpolate_gaps(values):
+    values = np.asarray(values)
+    if values.ndim == 1:
+        return interpolate_gaps(values[:, None])[:, 0]
+    n = len(values)
+    valid = ~np.isnan(values)
+    rows = np.arange(n)[:, None]
+    columns = np.arange(values.shape[1])
+    # Position of the nearest observed value at or before / at or after each row
+    left = np.maximum.accumulate(np.where(valid, rows, -1), axis=0)
+    right = np.minimum.accumulate(np.where(valid, rows, n)[::-1], axis=0)[::-1]
+    left_values = values[np.maximum(left, 0), columns]
+    right_values = np.where(right < n, values[np.minimum(right, n - 1), columns], left_values)
+    weight = np.where(right < n, (rows - left) / np.maximum(right - left, 1), 0.0)
+    filled = left_values + (right_values - left_values) * weight
+    return np.where(valid | (left < 0), values, filled).astype(values.dtype, copy=False)
+
+
+# Parse a workbook, keeping only Month and the requested columns, into floats with a datetime index.
+# The sheet is streamed row by row in read-only mode and only the cells between the first and last
+# wanted column are read; each value goes straight into a typed array, so memory grows with the
+# selected columns rather than the width of the sheet
+def parse_table(file, columns, dtype=np.float64):
+    columns = list(columns)
+    missing = set(MISSING_VALUES)
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [None if name is None else str(name).strip() for name in next(rows)]
+        absent = [name for name in ['Month'] + columns if name not in header]
+        if absent:
+            raise ValueError(f'{file}: columns not found in the sheet: {absent}')
+        positions = [header.index(name) for name in ['Month'] + columns]
+        first = min(positions)
+        offsets = [position - first for position in positions]
+        width = max(offsets) + 1
+
+        months = []
+        values = [array('d') for _ in columns]
+        # Row 1 is the header and row 2 the units row
+        for row in workbook.worksheets[0].iter_rows(min_row=3, min_col=first + 1, max_col=first + width, values_only=True):
+            if len(row) < width:
+                row += (None,) * (width - len(row))
+            if all(row[offset] is None for offset in offsets):
+                continue
+            months.append(row[offsets[0]])
+            for column_values, offset in zip(values, offsets[1:]):
+                column_values.append(_cell_value(row[offset], missing))
+    finally:
+        workbook.close()
+
+    data = np.empty((len(months), len(columns)), dtype=dtype)
+    for j, column_values in enumerate(values):
+        data[:, j] = np.frombuffer(column_values, dtype=np.float64)
+    index = pd.DatetimeIndex(pd.to_datetime(months), name='Month')
+    return pd.DataFrame(interpolate_gaps(data), index=index, columns=columns)
+
+
+# Compare the source file against the stored metadata, hashing only when mtime or size moved
+def _is_fresh(file, meta, meta_path):
+    stat = os.stat(file)
+    if meta['mtime_ns'] == stat.st_mtime_ns and meta['size'] == stat.st_size:
+        return True
+    if meta['sha256'] != _file_hash(file):
+        return False
+    # Touched but unchanged: remember the new stat so the next check is cheap again
+    meta.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+    _write_meta(meta_path, meta)
+    return True
+
+
+def _write_meta(meta_path, meta):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(meta_path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, meta_path)
+
+
+def _read_cached(arrow_path, columns):
+    table = feather.read_table(arrow_path, columns=['Month'] + list(columns), memory_map=True)
+    return table.to_pandas().set_index('Month')
+
+
+# Load the cleaned table for file, parsing the Excel only when the cache is missing or stale
+def load_table(file, columns, cache_dir=INGEST_CACHE_DIR):
+    columns = list(columns)
+    os.makedirs(cache_dir, exist_ok=True)
+    arrow_path, meta_path = _cache_paths(file, cache_dir)
+
+    cached_columns = []
+    if os.path.exists(arrow_path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if _is_fresh(file, meta, meta_path):
+            if set(columns) <= set(meta['columns']):
+                return _read_cached(arrow_path, columns)
+            # Same workbook, new columns: reparse once with the union so requests don't thrash
+            cached_columns = [column for column in meta['columns'] if column not in columns]
+
+    df = parse_table(file, columns + cached_columns)
+    stat = os.stat(file)
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    os.close(fd)
+    feather.write_feather(pa.Table.from_pandas(df.reset_index(), preserve_index=False), tmp, compression='uncompressed')
+    os.replace(tmp, arrow_path)
+    _write_meta(meta_path, {
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'sha256': _file_hash(file),
+        'columns': list(df.columns)
+    })
+    return df[columns]
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Vectorized forecast metrics over the whole portfolio
+
+Computes RMSE, MAPE, MAE and R2 for every model, (fold,) series and time
+step in one pass over a (model x [fold x] series x time) array. Missing
+values are masked out of every metric and zero actuals are left out of
+MAPE, so one bad month never turns a whole score into NaN or infinity.
+"""
+
+import numpy as np
+import pandas as pd
+
+METRICS = ['RMSE', 'MAPE', 'MAE', 'R2']
+
+
+# Metric arrays over the last (time) axis. actuals broadcasts against predictions,
+# e.g. (series, time) actuals against (model, series, time) predictions
+def metric_arrays(actuals, predictions):
+    actuals = np.asarray(actuals, dtype=np.float64)
+    predictions = np.asarray(predictions, dtype=np.float64)
+    actuals = np.broadcast_to(actuals, predictions.shape)
+
+    valid = np.isfinite(actuals) & np.isfinite(predictions)
+    n = valid.sum(axis=-1)
+    errors = np.where(valid, actuals - predictions, 0.0)
+    observed = np.where(valid, actuals, 0.0)
+    nonzero = valid & (actuals != 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sse = np.sum(errors ** 2, axis=-1)
+        mean = observed.sum(axis=-1) / n
+        sst = np.sum(np.where(valid, (actuals - mean[..., None]) ** 2, 0.0), axis=-1)
+        ape = np.where(nonzero, np.abs(errors) / np.abs(np.where(nonzero, actuals, 1.0)), 0.0)
+        return {
+            'RMSE': np.sqrt(sse / n),
+            'MAPE': np.where(nonzero.any(axis=-1), ape.sum(axis=-1) / nonzero.sum(axis=-1) * 100, np.nan),
+            'MAE': np.abs(errors).sum(axis=-1) / n,
+            'R2': np.where(sst > 0, 1 - sse / np.where(sst > 0, sst, 1.0), np.nan),
+        }
+
+
+def rmse(true_values, predictions):
+    return float(metric_arrays(true_values, predictions)['RMSE'])
+
+
+def mape(true_values, predictions):
+    return float(metric_arrays(true_values, predictions)['MAPE'])
+
+
+# One tidy table of every metric for every model and series (and fold when the arrays have a
+# fold axis). predictions maps model name -> array shaped like actuals: (series, time) or
+# (fold, series, time); keys are the (file, column) of each series
+def metrics_table(actuals, predictions, keys):
+    models = list(predictions)
+    scores = metric_arrays(actuals, np.stack([predictions[model] for model in models]))
+
+    shape = scores['RMSE'].shape
+    positions = np.indices(shape).reshape(len(shape), -1)
+    table = {'model': np.asarray(models, dtype=object)[positions[0]]}
+    if len(shape) == 3:
+        table['fold'] = positions[1]
+    series = positions[-1]
+    table['file'] = np.asarray([file for file, _ in keys], dtype=object)[series]
+    table['column'] = np.asarray([column for _, column in keys], dtype=object)[series]
+    for name in METRICS:
+        table[name] = scores[name].ravel()
+    return pd.DataFrame(table)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Aligned months x series panel
+
+All sector series live in one contiguous float64 array (rows are months,
+columns are series) with per-series metadata for file, column, fuel, sector
+and unit. Splits, lags and per-file frames are views into that array rather
+than copies, so later stages can work on whole-portfolio arrays at once.
+"""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# Fuel and unit of each EIA table, keyed by the table number prefix of the file name
+TABLE_METADATA = {
+    'Table_3.7': ('Petroleum', 'Thousand Barrels Per Day'),
+    'Table_4.3': ('Natural Gas', 'Billion Cubic Feet'),
+    'Table_7.6': ('Electricity', 'Million Kilowatthours'),
+}
+
+SECTORS = ['Residential', 'Commercial', 'Industrial', 'Transportation', 'Electric Power']
+
+# The EIA workbooks and the sector columns read from each
+FILES_AND_COLUMNS = {
+    'Table_3.7a_Petroleum_Consumption___Residential_and_Commercial_Sectors.xlsx':['Total Petroleum Consumed by the Residential Sector', 'Total Petroleum Consumed by the Commercial Sector'],
+    'Table_3.7b_Petroleum_Consumption___Industrial_Sector.xlsx':['Total Petroleum Consumed by the Industrial Sector'],
+    'Table_4.3_Natural_Gas_Consumption_by_Sector.xlsx':['Natural Gas Consumed by the Residential Sector','Natural Gas Consumed by the Commercial Sector', 'Natural Gas Consumed by the Industrial Sector, Total', 'Natural Gas Consumed by the Transportation Sector, Total'],
+    'Table_7.6_Electricity_End_Use.xlsx':['Electricity Sales to Ultimate Customers, Residential', 'Electricity Sales to Ultimate Customers, Commercial', 'Electricity Sales to Ultimate Customers, Industrial', 'Electricity Sales to Ultimate Customers, Transportation'],
+    'Table_3.7c_Petroleum_Consumption___Transportation_and_Electric_Power_Sectors.xlsx':['Total Petroleum Consumed by the Transportation Sector']
+    }
+
+
+def series_metadata(file, column):
+    fuel, unit = None, None
+    for prefix, (table_fuel, table_unit) in TABLE_METADATA.items():
+        if file.startswith(prefix):
+            fuel, unit = table_fuel, table_unit
+            break
+    sector = next((name for name in SECTORS if name in column), None)
+    return {'file': file, 'column': column, 'fuel': fuel, 'sector': sector, 'unit': unit}
+
+
+class Panel:
+    def __init__(self, values, index, metadata):
+        self.values = values
+        self.index = index
+        # One row per series, in column order of values
+        self.metadata = metadata
+        self._positions = {(file, column): i for i, (file, column) in enumerate(zip(metadata['file'], metadata['column']))}
+
+    # Build a panel from datasets[file] frames, aligning every table on a common month index.
+    # Every series must cover the same months, or one split row would leave the shorter series
+    # with missing test months: tables that start or end on different months are cut to the
+    # months all of them cover (with a warning), or rejected with ragged='raise'
+    @classmethod
+    def from_datasets(cls, datasets, files_and_columns, ragged='trim'):
+        if ragged not in ('trim', 'raise'):
+            raise ValueError(f"Unknown ragged handling: {ragged!r} (expected 'trim' or 'raise')")
+        frames = []
+        records = []
+        for file, columns in files_and_columns.items():
+            frames.append(datasets[file][columns])
+            records.extend(series_metadata(file, column) for column in columns)
+        first = max(frame.index.min() for frame in frames)
+        last = min(frame.index.max() for frame in frames)
+        cut = {file: int((frame.index < first).sum() + (frame.index > last).sum())
+               for file, frame in zip(files_and_columns, frames)}
+        if any(cut.values()):
+            ranges = ', '.join(f'{file}: {frame.index.min():%Y-%m} to {frame.index.max():%Y-%m}'
+                               for file, frame in zip(files_and_columns, frames) if cut[file])
+            if ragged == 'raise':
+                raise ValueError(f'Tables cover different months ({ranges}); common range {first:%Y-%m} to {last:%Y-%m}')
+            warnings.warn(f'Tables cover different months; keeping {first:%Y-%m} to {last:%Y-%m} and dropping '
+                          + ', '.join(f'{n} month(s) of {file}' for file, n in cut.items() if n))
+        aligned = pd.concat(frames, axis=1, join='outer', sort=True).loc[first:last]
+        values = np.ascontiguousarray(aligned.to_numpy(dtype=np.float64))
+        return cls(values, aligned.index, pd.DataFrame(records))
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    def position(self, file, column):
+        return self._positions[(file, column)]
+
+    def keys(self):
+        return list(self._positions)
+
+    # Same series and metadata over different rows or values (no copy of the metadata)
+    def with_values(self, values, index=None):
+        return Panel(values, self.index if index is None else index, self.metadata)
+
+    def rows(self, start=None, stop=None):
+        return Panel(self.values[start:stop], self.index[start:stop], self.metadata)
+
+    # Split every series at the same month (every series covers the same months); both halves are views
+    def split(self, test_size=0.2):
+        train_size = int(len(self) * (1 - test_size))
+        return self.rows(None, train_size), self.rows(train_size, None)
+
+    # Aligned (lagged, current) views: row t of the first is row t - lag of the panel
+    def lag(self, lag=1):
+        return self.values[:-lag], self.values[lag:]
+
+    def series(self, file, column):
+        return pd.Series(self.values[:, self.position(file, column)], index=self.index, name=column, copy=False)
+
+    # datasets[file]-style frame; a view, since each file's series are adjacent in the panel
+    def frame(self, file):
+        positions = np.flatnonzero(self.metadata['file'].to_numpy() == file)
+        block = self.values[:, positions[0]:positions[-1] + 1]
+        return pd.DataFrame(block, index=self.index, columns=list(self.metadata['column'].iloc[positions]), copy=False)
+
+    # The nested {file: DataFrame} layout the rest of the script iterates over
+    def to_datasets(self):
+        return {file: self.frame(file) for file in dict.fromkeys(self.metadata['file'])}
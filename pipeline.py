@@ -0,0 +1,779 @@
+# -*- coding: utf-8 -*-
+"""The training flow as a memoized, incremental dependency graph
+
+ingest -> preprocess -> split -> order_search -> sarima_fit -> gb_fit ->
+global_gb -> stack -> evaluate -> backtest -> forecast -> report, plus
+artifacts (the models saved for forecast-only processes), each stage a
+function of its declared inputs and parameters. The notebook runs these same
+stages. A stage's result is stored under a hash of the hashes of its inputs,
+the parameters it reads and its code version (its own source, the helpers it
+calls and every repo module it imports, directly or through other modules),
+and the Excel files are hashed by content, so a rerun only recomputes what
+a change can reach. Stages from split to stack run per series: every series is cached
+on its own, only the series whose inputs changed are recomputed, and those
+are spread over a process pool.
+
+    python pipeline.py run                   # everything, reusing what is unchanged
+    python pipeline.py run stack --force stack
+    python pipeline.py status                # what a run would recompute
+    python pipeline.py graph
+"""
+
+import argparse
+import ast
+import dis
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+import pickle
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+import numpy as np
+
+from fit_cache import CACHE_DIR as FIT_CACHE_DIR
+from panel import FILES_AND_COLUMNS
+
+PIPELINE_DIR = '.pipeline_cache'
+
+# Directory of the repo's modules; only their source goes into code versions
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Bump to invalidate every stored result, e.g. after a change of the storage format
+PIPELINE_VERSION = 1
+
+# Settings of every stage. The notebook (energy_consumption_by_sectors.py) runs the same stages
+# with these settings, changing only 'ragged'; see the comments there for what each one does
+PARAMS = {
+    'files_and_columns': FILES_AND_COLUMNS,
+    'data_dir': '.',
+    # 'own': every table keeps its own months; 'trim' / 'raise': as Panel.from_datasets
+    'ragged': 'own',
+    'test_size': 0.2,
+    'search_method': 'stepwise',
+    'max_fits': 40,
+    'time_limit': 60,
+    'max_iter': 50,
+    # Fixed {'order': ..., 'seasonal_order': ...} for every series, or None for the searched orders
+    'sarima_order': None,
+    'fit_cache_dir': FIT_CACHE_DIR,
+    'warm_start': True,
+    'fit_queue_path': None,
+    'fit_queue_workers': 1,
+    'lags': tuple(range(1, 13)),
+    'windows': (3, 12),
+    'calendar': True,
+    'forecast_length': 108,
+    'levels': (0.8, 0.95),
+    'n_paths': 5000,
+    'seed': 42,
+    'backtest_origins': 8,
+    'backtest_horizon': 12,
+    'backtest_step': 12,
+    'backtest_time_budget': 3600,
+    'report_dir': 'report',
+    'artifact_dir': 'artifacts',
+}
+
+
+def _digest(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else json.dumps(part, sort_keys=True, default=str).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _value_hash(value):
+    return _digest(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def _file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+# Series keys are (file, column) pairs; on disk and in telemetry they are written 'file|column'
+def series_name(key):
+    return f'{key[0]}|{key[1]}'
+
+
+# Functions of function's own module that it calls, directly or through one another, by name
+def _helpers(function, found=None):
+    found = {} if found is None else found
+    codes = [function.__code__]
+    while codes:
+        code = codes.pop()
+        codes.extend(const for const in code.co_consts if inspect.iscode(const))
+        for name in {instruction.argval for instruction in dis.get_instructions(code) if instruction.opname == 'LOAD_GLOBAL'}:
+            helper = function.__globals__.get(name)
+            if (inspect.isfunction(helper) and helper.__module__ == function.__module__
+                    and helper is not function and name not in found):
+                found[name] = helper
+                _helpers(helper, found)
+    return found
+
+
+# Names of the modules a code object imports, including imports inside nested functions
+def _code_imports(code):
+    names = set()
+    codes = [code]
+    while codes:
+        code = codes.pop()
+        codes.extend(const for const in code.co_consts if inspect.iscode(const))
+        names.update(instruction.argval for instruction in dis.get_instructions(code) if instruction.opname == 'IMPORT_NAME')
+    return names
+
+
+# Modules function uses: the ones it imports and those of the module-level names it reads
+def _function_modules(function):
+    names = _code_imports(function.__code__)
+    for instruction in dis.get_instructions(function):
+        value = function.__globals__.get(instruction.argval) if instruction.opname == 'LOAD_GLOBAL' else None
+        if inspect.ismodule(value):
+            names.add(value.__name__)
+        elif inspect.isfunction(value) or inspect.isclass(value):
+            names.add(value.__module__)
+    return names
+
+
+# Source file of a module when it is one of the repo's own (the pipeline itself excluded: its
+# stage functions and helpers are versioned one by one)
+def _repo_module_file(name):
+    if name in ('__main__', __name__, 'pipeline'):
+        return None
+    try:
+        spec = importlib.util.find_spec(name.split('.')[0])
+    except (ImportError, ValueError):
+        return None
+    origin = spec.origin if spec is not None else None
+    if origin is None or not origin.endswith('.py') or os.path.dirname(os.path.abspath(origin)) != REPO_DIR:
+        return None
+    return origin
+
+
+# Repo modules reachable from names through their imports (at module level or inside functions),
+# as {name: source file}
+def _module_closure(names):
+    files, seen = {}, set()
+    pending = list(names)
+    while pending:
+        name = pending.pop().split('.')[0]
+        if name in seen:
+            continue
+        seen.add(name)
+        file = _repo_module_file(name)
+        if file is None:
+            continue
+        files[name] = file
+        with open(file, 'rb') as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                pending.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                pending.append(node.module)
+    return files
+
+
+class Stage:
+    # inputs name upstream stages, params the PARAMS entries the stage reads. A per_series stage
+    # is called once per series with that series' item of every per-series input; a keyed stage
+    # runs once but returns {series key: item}, hashed item by item so that downstream series
+    # only see their own changes. sources(params) lists input files hashed by content. A stage
+    # that writes files gives outputs_present(params, value), and its stored result only counts
+    # as up to date while that says the files are in place
+    def __init__(self, name, function, inputs=(), params=(), per_series=False, keyed=False, sources=None, outputs_present=None):
+        self.name = name
+        self.function = function
+        self.inputs = tuple(inputs)
+        self.params = tuple(params)
+        self.per_series = per_series
+        self.keyed = keyed or per_series
+        self.sources = sources
+        self.outputs_present = outputs_present
+
+    # Repo modules the stage and its helpers import, followed through the modules' own
+    # imports: {name: source file}
+    def modules(self):
+        functions = [self.function, *_helpers(self.function).values()]
+        return _module_closure(set().union(*(_function_modules(function) for function in functions)))
+
+    # Hash of the stage's source, the helpers it calls in its own module and the source of modules()
+    def code_version(self):
+        helpers = _helpers(self.function)
+        parts = [PIPELINE_VERSION, inspect.getsource(self.function).encode('utf-8')]
+        parts.extend(inspect.getsource(helpers[name]).encode('utf-8') for name in sorted(helpers))
+        modules = self.modules()
+        for name in sorted(modules):
+            with open(modules[name], 'rb') as f:
+                parts.extend([name, f.read()])
+        return _digest(*parts)
+
+
+class ResultStore:
+    def __init__(self, path=PIPELINE_DIR):
+        self.path = path
+
+    def _files(self, stage, key):
+        stem = os.path.join(self.path, stage, key)
+        return f'{stem}.pkl', f'{stem}.json'
+
+    def meta(self, stage, key):
+        value_file, meta_file = self._files(stage, key)
+        if not os.path.exists(value_file):
+            return None
+        try:
+            with open(meta_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load(self, stage, key):
+        with open(self._files(stage, key)[0], 'rb') as f:
+            return pickle.load(f)
+
+    # Store value and its meta record; the value is written first, so a meta file always has its value
+    def save(self, stage, key, value, meta):
+        value_file, meta_file = self._files(stage, key)
+        directory = os.path.dirname(value_file)
+        os.makedirs(directory, exist_ok=True)
+        for file, write, mode in ((value_file, lambda f: pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL), 'wb'),
+                                  (meta_file, lambda f: json.dump(meta, f), 'w')):
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, mode) as f:
+                write(f)
+            os.replace(tmp, file)
+
+    # Remove every stored result not in used ({stage: set of keys}); returns how many were removed
+    def prune(self, used):
+        removed = 0
+        if not os.path.isdir(self.path):
+            return removed
+        for stage in os.listdir(self.path):
+            directory = os.path.join(self.path, stage)
+            if stage not in used:
+                removed += len([name for name in os.listdir(directory) if name.endswith('.pkl')])
+                shutil.rmtree(directory)
+                continue
+            for name in os.listdir(directory):
+                key, extension = os.path.splitext(name)
+                if key not in used[stage]:
+                    os.remove(os.path.join(directory, name))
+                    removed += extension == '.pkl'
+        return removed
+
+
+def _run_job(job):
+    function, params, key, inputs = job
+    return function(params, key, **inputs)
+
+
+class Pipeline:
+    def __init__(self, stages=None, params=None, store=None, n_jobs=None, telemetry=None):
+        self.stages = {stage.name: stage for stage in (stages or STAGES)}
+        self.params = dict(PARAMS, **(params or {}))
+        self.store = store or ResultStore()
+        self.n_jobs = n_jobs
+        self.telemetry = telemetry
+        # Per stage: the output hash (or {series key: hash}) and the store key of each result
+        self._hashes = {}
+        self._entries = {}
+        self._values = {}
+
+    # Stages needed for targets (every stage when None), in graph order
+    def plan(self, targets=None):
+        if not targets:
+            return list(self.stages)
+        needed = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in self.stages:
+                raise ValueError(f'Unknown stage: {name!r} (expected one of {", ".join(self.stages)})')
+            if name not in needed:
+                needed.add(name)
+                pending.extend(self.stages[name].inputs)
+        return [name for name in self.stages if name in needed]
+
+    def _stage_params(self, stage):
+        return {name: self.params[name] for name in stage.params}
+
+    # Output of a stage: the whole result, or one series' item of a keyed stage
+    def value(self, name, key=None):
+        stage = self.stages[name]
+        if stage.per_series:
+            if key is None:
+                return {series: self.value(name, series) for series in self._hashes[name]}
+            cache_key = (name, key)
+            if cache_key not in self._values:
+                self._values[cache_key] = self.store.load(name, self._entries[name][key])
+            return self._values[cache_key]
+        if name not in self._values:
+            self._values[name] = self.store.load(name, self._entries[name])
+        return self._values[name] if key is None else self._values[name][key]
+
+    def _input_hash(self, name, key=None):
+        hashes = self._hashes.get(name)
+        if hashes is None:
+            return None
+        if self.stages[name].keyed:
+            if key is not None:
+                return hashes.get(key)
+            return None if None in hashes.values() else _digest([[series_name(k), h] for k, h in hashes.items()])
+        return hashes
+
+    # Run the stages needed for targets, reusing stored results whose inputs, parameters and
+    # code are unchanged. With execute=False nothing is computed: stale results get no hash,
+    # and everything downstream of them is reported stale too. Returns, per stage, how many
+    # results were reused and how many were (or would be) computed
+    def run(self, targets=None, force=(), execute=True):
+        force = set(force)
+        summary = {}
+        for name in self.plan(targets):
+            stage = self.stages[name]
+            telemetry_stage = self.telemetry.stage(name) if self.telemetry is not None and execute else nullcontext()
+            with telemetry_stage as record:
+                if stage.per_series:
+                    cached, computed = self._run_per_series(stage, name in force, execute)
+                else:
+                    cached, computed = self._run_whole(stage, name in force, execute)
+                if record is not None:
+                    record.count('cached', cached)
+                    record.count('computed', computed)
+            summary[name] = {'cached': cached, 'computed': computed}
+        return summary
+
+    # What a run would do, without running anything
+    def status(self, targets=None, force=()):
+        return self.run(targets, force, execute=False)
+
+    def _run_whole(self, stage, force, execute):
+        input_hashes = [self._input_hash(name) for name in stage.inputs]
+        sources = [_file_hash(path) for path in stage.sources(self.params)] if stage.sources is not None else []
+        if None in input_hashes:
+            self._hashes[stage.name] = None
+            return 0, 1
+        key = _digest(stage.name, stage.code_version(), self._stage_params(stage), input_hashes, sources)
+        meta = None if force else self.store.meta(stage.name, key)
+        if meta is not None and stage.outputs_present is not None:
+            if not stage.outputs_present(self._stage_params(stage), self.store.load(stage.name, key)):
+                meta = None
+        computed = meta is None
+        if computed:
+            if not execute:
+                self._hashes[stage.name] = None
+                return 0, 1
+            value = stage.function(self._stage_params(stage), **{name: self.value(name) for name in stage.inputs})
+            if stage.keyed:
+                meta = {'items': [[*series, _value_hash(item)] for series, item in value.items()]}
+            else:
+                meta = {'hash': _value_hash(value)}
+            self.store.save(stage.name, key, value, meta)
+            self._values[stage.name] = value
+        self._entries[stage.name] = key
+        self._hashes[stage.name] = {tuple(item[:-1]): item[-1] for item in meta['items']} if stage.keyed else meta['hash']
+        return int(not computed), int(computed)
+
+    def _run_per_series(self, stage, force, execute):
+        keyed_inputs = [name for name in stage.inputs if self.stages[name].keyed]
+        if not keyed_inputs:
+            raise ValueError(f'Per-series stage {stage.name!r} needs a keyed input')
+        if self._hashes.get(keyed_inputs[0]) is None:
+            # The series are not known until the keyed stage before this one has run
+            self._hashes[stage.name] = None
+            return 0, sum(len(columns) for columns in self.params['files_and_columns'].values())
+        series_keys = list(self._hashes[keyed_inputs[0]])
+        code, params = stage.code_version(), self._stage_params(stage)
+
+        hashes, entries, stale = {}, {}, []
+        for series in series_keys:
+            input_hashes = [self._input_hash(name, series if name in keyed_inputs else None) for name in stage.inputs]
+            if None in input_hashes:
+                hashes[series] = None
+                stale.append(series)
+                continue
+            entries[series] = key = _digest(stage.name, code, params, series_name(series), input_hashes)
+            meta = None if force else self.store.meta(stage.name, key)
+            hashes[series] = None if meta is None else meta['hash']
+            if meta is None:
+                stale.append(series)
+        self._hashes[stage.name] = hashes
+        self._entries[stage.name] = entries
+        if not execute or not stale:
+            return len(series_keys) - len(stale), len(stale)
+
+        jobs = [(stage.function, params, series,
+                 {name: self.value(name, series if name in keyed_inputs else None) for name in stage.inputs})
+                for series in stale]
+        n_jobs = min(self.n_jobs or os.cpu_count() or 1, len(jobs))
+        # Each result is stored as soon as it arrives, so an interrupted stage keeps its finished series
+        with (ProcessPoolExecutor(max_workers=n_jobs) if n_jobs > 1 else nullcontext()) as executor:
+            results = executor.map(_run_job, jobs) if executor is not None else map(_run_job, jobs)
+            for series, value in zip(stale, results):
+                hashes[series] = _value_hash(value)
+                self.store.save(stage.name, entries[series], value, {'hash': hashes[series]})
+                self._values[(stage.name, series)] = value
+        return len(series_keys) - len(stale), len(stale)
+
+    # Store keys of every result the last run used, for ResultStore.prune
+    def used_entries(self):
+        return {name: set(entries.values()) if isinstance(entries, dict) else {entries}
+                for name, entries in self._entries.items()}
+
+
+# Stages
+
+
+def _source_files(params):
+    return [os.path.join(params['data_dir'], file) for file in params['files_and_columns']]
+
+
+def ingest(params):
+    from ingest import load_table
+    return {file: load_table(os.path.join(params['data_dir'], file), columns)
+            for file, columns in params['files_and_columns'].items()}
+
+
+# One item per series. With ragged='own' every series keeps its own table's months (without
+# trailing missing months), so a new month in one workbook only changes the series of that workbook;
+# otherwise the tables are aligned on the months all of them cover, as Panel.from_datasets does
+def preprocess(params, ingest):
+    if params['ragged'] != 'own':
+        from panel import Panel
+        panel = Panel.from_datasets(ingest, params['files_and_columns'], ragged=params['ragged'])
+        return {key: panel.series(*key) for key in panel.keys()}
+    items = {}
+    for file, columns in params['files_and_columns'].items():
+        for column in columns:
+            series = ingest[file][column]
+            items[(file, column)] = series.loc[:series.last_valid_index()]
+    return items
+
+
+def split(params, key, preprocess):
+    train_size = int(len(preprocess) * (1 - params['test_size']))
+    return {'train': preprocess.iloc[:train_size], 'test': preprocess.iloc[train_size:]}
+
+
+def _fit_cache(params):
+    from fit_cache import FitCache
+    return None if params['fit_cache_dir'] is None else FitCache(params['fit_cache_dir'])
+
+
+# Best order of one series with the fit counts of the search (see sarima_search.fit_counts), in this
+# process or through the fit queue when fit_queue_path is set
+def order_search(params, key, split):
+    from backtest import DEFAULT_ORDER
+    file, column = key
+    datasets, files_and_columns = {file: split['train'].to_frame(column)}, {file: [column]}
+    options = {'method': params['search_method'], 'max_fits': params['max_fits'], 'time_limit': params['time_limit'],
+               'max_iter': params['max_iter'], 'warm_start': params['warm_start']}
+    if params['fit_queue_path'] is None:
+        from sarima_search import search_sarima_orders
+        result = search_sarima_orders(datasets, files_and_columns, n_jobs=1, cache=_fit_cache(params), **options)[file][column]
+    else:
+        from fit_queue import FitQueue, search_sarima_orders_queued
+        result = search_sarima_orders_queued(datasets, files_and_columns, FitQueue(params['fit_queue_path']),
+                                             cache_dir=params['fit_cache_dir'], local_workers=params['fit_queue_workers'],
+                                             **options)[file][column]
+    if result['order'] is None:
+        # Every fit failed: fall back to the orders the script has always used
+        result.update(order=DEFAULT_ORDER['order'], seasonal_order=DEFAULT_ORDER['seasonal_order'], aic=None)
+    return result
+
+
+# The orders the SARIMA models are fitted with: the fixed sarima_order, or each series' searched order
+def series_orders(params, order_search):
+    orders = {}
+    for (file, column), result in order_search.items():
+        order = params['sarima_order'] or result
+        orders.setdefault(file, {})[column] = {'order': tuple(order['order']), 'seasonal_order': tuple(order['seasonal_order'])}
+    return orders
+
+
+# Only the fitted parameters are stored (a fitted SARIMAX result keeps every filter and smoother
+# array and runs to megabytes); sarima_model rebuilds the result from them, as the fit cache does.
+# Fits go through the fit cache, warm-started from the series' previous fit, and the warnings they
+# raise are counted by category
+def sarima_fit(params, key, split, order_search):
+    import warnings
+    from sarima_search import fit_sarima_model
+    file, column = key
+    order = series_orders(params, {key: order_search})[file][column]
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        if params['fit_queue_path'] is None:
+            model_fit = fit_sarima_model(split['train'], order['order'], order['seasonal_order'], _fit_cache(params),
+                                         series_name(key), params['warm_start'])
+        else:
+            from fit_queue import FitQueue, fit_sarima_models_queued
+            model_fit = fit_sarima_models_queued({file: split['train'].to_frame(column)}, {file: {column: order}},
+                                                 FitQueue(params['fit_queue_path']), params['warm_start'], params['fit_cache_dir'],
+                                                 params['fit_queue_workers'])[file][column]
+        predictions = np.asarray(model_fit.forecast(steps=len(split['test'])))
+    retvals = getattr(model_fit, 'mle_retvals', None) or {}
+    counts = {}
+    for warning in caught:
+        counts[warning.category.__name__] = counts.get(warning.category.__name__, 0) + 1
+    return {'order': order['order'], 'seasonal_order': order['seasonal_order'], 'params': np.asarray(model_fit.params),
+            'predictions': predictions, 'converged': bool(retvals.get('converged', True)), 'warnings': counts}
+
+
+def sarima_model(train, fit):
+    import warnings
+    from statsmodels.tsa.statespace.sarimax import SARIMAX
+    from sarima_search import SARIMAX_OPTIONS
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        model = SARIMAX(train, order=fit['order'], seasonal_order=fit['seasonal_order'], **SARIMAX_OPTIONS)
+        return model.smooth(fit['params'])
+
+
+# Training series cut to the last training month all of them have, so the portfolio forecasts start
+# from one month; series of tables that end later are rolled back to it (their SARIMA state is
+# rebuilt on the shorter series with the fitted parameters). Returns {key: train}, the months x
+# series history and that month
+def _common_train(split, keys):
+    import pandas as pd
+    last_month = min(split[key]['train'].index[-1] for key in keys)
+    train = {key: split[key]['train'].loc[:last_month] for key in keys}
+    history = pd.concat([train[key] for key in keys], axis=1, ignore_index=True).to_numpy(dtype=np.float64)
+    return train, history, last_month
+
+
+# Series of different lengths as one (series, time) array, padded with NaN (left out of every metric)
+def _padded(arrays):
+    padded = np.full((len(arrays), max(len(array) for array in arrays)), np.nan)
+    for i, array in enumerate(arrays):
+        padded[i, :len(array)] = array
+    return padded
+
+
+def _feature_spec(params):
+    from features import FeatureSpec
+    return FeatureSpec(lags=params['lags'], windows=params['windows'], calendar=params['calendar'])
+
+
+def gb_fit(params, key, split):
+    from sklearn.ensemble import GradientBoostingRegressor
+    from features import complete_rows
+    feature_spec = _feature_spec(params)
+    series = np.concatenate([split['train'].to_numpy(), split['test'].to_numpy()])
+    months = np.concatenate([split['train'].index.month, split['test'].index.month])
+    X, y = feature_spec.build(series, months)
+    complete = complete_rows(X, y)[:, 0]
+    n_train_rows = len(split['train']) - feature_spec.history
+    rows = complete[:n_train_rows]
+    model = GradientBoostingRegressor(random_state=42).fit(X[:n_train_rows, 0][rows], y[:n_train_rows, 0][rows])
+    return {'model': model, 'predictions': model.predict(X[n_train_rows:, 0])}
+
+
+def stack(params, key, split, sarima_fit, gb_fit):
+    import pandas as pd
+    from sklearn.linear_model import LinearRegression
+    features = pd.DataFrame({'sarima': sarima_fit['predictions'], 'gb': gb_fit['predictions']})
+    model = LinearRegression().fit(features, split['test'].to_numpy())
+    return {'model': model, 'predictions': model.predict(features)}
+
+
+# Series items aligned in one Panel on the months all of them cover (see Panel.from_datasets)
+def _panel(items):
+    import pandas as pd
+    from panel import Panel
+    columns = {}
+    for (file, column), series in items.items():
+        columns.setdefault(file, {})[column] = series
+    return Panel.from_datasets({file: pd.DataFrame(series) for file, series in columns.items()},
+                               {file: list(series) for file, series in columns.items()})
+
+
+# One histogram-based boosted model on the pooled features of all series (see global_model.py),
+# trained on the months up to the earliest end of training; returns the model and its predictions
+# for every series' test months
+def global_gb(params, split):
+    import pandas as pd
+    from features import complete_rows
+    from global_model import GlobalGBModel
+    keys = list(split)
+    feature_spec = _feature_spec(params)
+    panel = _panel({key: pd.concat([split[key]['train'], split[key]['test']]) for key in keys})
+    n_train = int((panel.index <= min(split[key]['train'].index[-1] for key in keys)).sum())
+    X, y = feature_spec.build(panel.values, panel.index.month)
+    complete = complete_rows(X, y)
+    n_train_rows = n_train - feature_spec.history
+    model = GlobalGBModel(panel.metadata, feature_spec).fit(X[:n_train_rows], y[:n_train_rows], complete[:n_train_rows])
+    test_predictions = model.predict_rows(X[n_train_rows:].transpose(1, 0, 2))
+    predictions = {key: pd.Series(test_predictions[panel.position(*key)], index=panel.index[n_train:])
+                   .reindex(split[key]['test'].index).to_numpy() for key in keys}
+    return {'model': model, 'predictions': predictions}
+
+
+def evaluate(params, split, sarima_fit, gb_fit, global_gb, stack):
+    from metrics import metrics_table
+    keys = list(split)
+    predictions = {'SARIMA': [sarima_fit[key]['predictions'] for key in keys], 'GB': [gb_fit[key]['predictions'] for key in keys],
+                   'GlobalGB': [global_gb['predictions'][key] for key in keys], 'Stacked': [stack[key]['predictions'] for key in keys]}
+    return metrics_table(_padded([split[key]['test'].to_numpy() for key in keys]),
+                         {model: _padded(arrays) for model, arrays in predictions.items()}, keys)
+
+
+# Rolling-origin backtest (see backtest.py) over the series aligned on their common months
+def backtest(params, preprocess, order_search):
+    from backtest import walk_forward_backtest
+    return walk_forward_backtest(_panel(preprocess), _feature_spec(params), n_origins=params['backtest_origins'],
+                                 horizon=params['backtest_horizon'], step=params['backtest_step'],
+                                 orders=series_orders(params, order_search), cache=_fit_cache(params),
+                                 time_budget=params['backtest_time_budget'])
+
+
+# Stacked forecasts of every series in one batched pass, the SARIMA forecasts and intervals,
+# and simulated prediction intervals of the stacked forecasts
+def forecast(params, split, sarima_fit, gb_fit, stack):
+    import pandas as pd
+    from artifacts import state_space_arrays
+    from features import future_months
+    from forecast_results import ForecastResultCache
+    from forecasting import generate_forecasts, row_predictor
+    from simulation import stacked_intervals
+
+    keys = list(split)
+    steps = params['forecast_length']
+    feature_spec = _feature_spec(params)
+    train, history, last_month = _common_train(split, keys)
+    months = future_months(last_month.month, steps)
+    sarima_models = [sarima_model(train[key], sarima_fit[key]) for key in keys]
+    gb_models = [gb_fit[key]['model'] for key in keys]
+    stackers = [stack[key]['model'] for key in keys]
+
+    sarima_cache = ForecastResultCache(levels=params['levels'])
+    mean = generate_forecasts(sarima_models, history, gb_models, stackers, steps, feature_spec, months,
+                              sarima_forecast=sarima_cache.means(keys, sarima_models, steps))
+    simulation = stacked_intervals(
+        state_space_arrays(sarima_models), row_predictor(gb_models, len(feature_spec.names)), history, feature_spec, months,
+        [split[key]['test'].to_numpy() - gb_fit[key]['predictions'] for key in keys],
+        [stacker.coef_ for stacker in stackers], [stacker.intercept_ for stacker in stackers],
+        steps, levels=params['levels'], n_paths=params['n_paths'], seed=params['seed'], forecast=mean)
+    return {
+        'keys': keys,
+        'dates': pd.date_range(last_month, periods=steps + 1, freq='MS')[1:],
+        'mean': mean,
+        'intervals': simulation['intervals'],
+        'sarima': {key: sarima_cache.get(key, model, steps) for key, model in zip(keys, sarima_models)},
+    }
+
+
+def report(params, split, sarima_fit, gb_fit, stack, forecast):
+    from charts import line, line_chart, render_report
+    level = max(params['levels'])
+    charts = []
+    for j, (file, column) in enumerate(forecast['keys']):
+        test = split[(file, column)]['test']
+        charts.append(line_chart(f"comparison/{file}/{column}", "GB, SARIMA, Stacked", f"Predictions vs True Values for {file} - {column}",
+                                 'Time', 'Value', [
+            line(test.index, test, 'True Values', color='black', linestyle='--', linewidth=1.5),
+            line(test.index, sarima_fit[(file, column)]['predictions'], 'SARIMA Predictions', color='blue'),
+            line(test.index, gb_fit[(file, column)]['predictions'], 'GB Predictions', color='red'),
+            line(test.index, stack[(file, column)]['predictions'], 'Stacked Predictions', color='green')], figsize=(16, 8), grid=True))
+        lower, upper = forecast['intervals'][level]
+        charts.append(line_chart(f"forecast/{file}/{column}", "Forecasts", f"True vs. Forecasted Values for {column}", "Date", "Value", [
+            line(test.index, test, "True Values", color='blue'),
+            line(forecast['dates'], forecast['mean'][:, j], "Forecast", color='red', linestyle='--')],
+            band=(forecast['dates'], lower[:, j], upper[:, j], f"{level:.0%} Prediction Interval", {'color': 'pink', 'alpha': 0.3}),
+            figsize=(14, 7), grid=True, tight=True))
+    return render_report(charts, params['report_dir'])
+
+
+def _report_present(params, result):
+    return os.path.exists(result['index'])
+
+
+# Save the models as an artifact version (see artifacts.py); returns the version
+def artifacts(params, split, sarima_fit, gb_fit, stack):
+    from artifacts import save_artifacts
+    keys = list(split)
+    train, history, last_month = _common_train(split, keys)
+    nested = {}
+    for name, models in (('sarima', {key: sarima_model(train[key], sarima_fit[key]) for key in keys}),
+                         ('gb', {key: gb_fit[key]['model'] for key in keys}), ('stack', {key: stack[key]['model'] for key in keys})):
+        nested[name] = {}
+        for (file, column), model in models.items():
+            nested[name].setdefault(file, {})[column] = model
+    return save_artifacts(keys, nested['sarima'], nested['gb'], nested['stack'], history, last_month, _feature_spec(params),
+                          [split[key]['test'].to_numpy() - gb_fit[key]['predictions'] for key in keys], params['artifact_dir'])
+
+
+# The saved version must still be there and be the latest one, which forecast-only processes load
+def _artifacts_present(params, version):
+    from artifacts import LATEST
+    try:
+        with open(os.path.join(params['artifact_dir'], LATEST)) as f:
+            latest = f.read().strip()
+    except OSError:
+        return False
+    return latest == version and os.path.isdir(os.path.join(params['artifact_dir'], version))
+
+
+FEATURE_PARAMS = ('lags', 'windows', 'calendar')
+FIT_PARAMS = ('warm_start', 'fit_cache_dir', 'fit_queue_path', 'fit_queue_workers')
+
+STAGES = [
+    Stage('ingest', ingest, params=('files_and_columns', 'data_dir'), sources=_source_files),
+    Stage('preprocess', preprocess, ('ingest',), ('files_and_columns', 'ragged'), keyed=True),
+    Stage('split', split, ('preprocess',), ('test_size',), per_series=True),
+    Stage('order_search', order_search, ('split',), ('search_method', 'max_fits', 'time_limit', 'max_iter') + FIT_PARAMS,
+          per_series=True),
+    Stage('sarima_fit', sarima_fit, ('split', 'order_search'), ('sarima_order',) + FIT_PARAMS, per_series=True),
+    Stage('gb_fit', gb_fit, ('split',), FEATURE_PARAMS, per_series=True),
+    Stage('global_gb', global_gb, ('split',), FEATURE_PARAMS),
+    Stage('stack', stack, ('split', 'sarima_fit', 'gb_fit'), per_series=True),
+    Stage('evaluate', evaluate, ('split', 'sarima_fit', 'gb_fit', 'global_gb', 'stack')),
+    Stage('backtest', backtest, ('preprocess', 'order_search'),
+          FEATURE_PARAMS + ('backtest_origins', 'backtest_horizon', 'backtest_step', 'backtest_time_budget', 'sarima_order', 'fit_cache_dir')),
+    Stage('forecast', forecast, ('split', 'sarima_fit', 'gb_fit', 'stack'),
+          FEATURE_PARAMS + ('forecast_length', 'levels', 'n_paths', 'seed')),
+    Stage('report', report, ('split', 'sarima_fit', 'gb_fit', 'stack', 'forecast'), ('levels', 'report_dir'),
+          outputs_present=_report_present),
+    Stage('artifacts', artifacts, ('split', 'sarima_fit', 'gb_fit', 'stack'), FEATURE_PARAMS + ('artifact_dir',),
+          outputs_present=_artifacts_present),
+]
+
+
+def print_summary(summary, verb):
+    for name, counts in summary.items():
+        print(f"{name:14s} {counts['cached']:4d} up to date, {counts['computed']:4d} {verb}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the training flow as an incremental dependency graph')
+    parser.add_argument('command', choices=['run', 'status', 'graph'])
+    parser.add_argument('targets', nargs='*', help='stages to bring up to date, with everything they depend on (default: all)')
+    parser.add_argument('--force', nargs='*', default=[], metavar='STAGE', help='recompute these stages even when up to date')
+    parser.add_argument('--n-jobs', type=int, default=None, help='worker processes for per-series stages (default: every core)')
+    parser.add_argument('--data-dir', default=PARAMS['data_dir'])
+    parser.add_argument('--cache-dir', default=PIPELINE_DIR)
+    parser.add_argument('--prune', action='store_true', help='after a full run, delete stored results it did not use')
+    args = parser.parse_args()
+
+    if args.command == 'graph':
+        for stage in STAGES:
+            kind = 'per series' if stage.per_series else 'keyed' if stage.keyed else 'whole'
+            print(f"{stage.name:14s} <- {', '.join(stage.inputs) or '(Excel files)':40s} [{kind}] {', '.join(sorted(stage.modules()))}")
+    else:
+        from telemetry import Telemetry
+        pipeline = Pipeline(params={'data_dir': args.data_dir}, store=ResultStore(args.cache_dir), n_jobs=args.n_jobs,
+                            telemetry=Telemetry() if args.command == 'run' else None)
+        if args.command == 'status':
+            print_summary(pipeline.status(args.targets, args.force), 'to compute')
+        else:
+            print_summary(pipeline.run(args.targets, args.force), 'computed')
+            if 'evaluate' in pipeline.plan(args.targets):
+                print(pipeline.value('evaluate').groupby('model')[['RMSE', 'MAPE', 'MAE', 'R2']].mean())
+            if args.prune and not args.targets:
+                print(f'Pruned {pipeline.store.prune(pipeline.used_entries())} stored results')
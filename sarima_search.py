@@ -0,0 +1,478 @@
+# -*- coding: utf-8 -*-
+"""SARIMA order search
+
+Picks the lowest-AIC SARIMA order for every series, either by fitting the
+full (p, d, q, P, D, Q) grid ("exhaustive") or by a stepwise walk over
+neighbouring orders with d and D taken from unit-root tests ("stepwise").
+The (series x order) work is spread over a process pool.
+"""
+
+import itertools
+import os
+import signal
+import threading
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from statsmodels.tsa.seasonal import STL
+from statsmodels.tsa.statespace.sarimax import SARIMAX
+from statsmodels.tools.sm_exceptions import InterpolationWarning
+from statsmodels.tsa.stattools import kpss
+
+from fit_cache import fit_key, series_key
+
+## To find the best paramters to fit SARIMA
+# Define the p, d, q and P, D, Q ranges
+p = d = q = range(0, 3)  # for non-seasonal orders
+P = D = Q = range(0, 2)  # for seasonal orders
+s = 12  # for monthly data with yearly seasonality
+
+# Create a list of all possible combinations of p, d, q, P, D, Q, and s
+pdq_combinations = [(x[0], x[1], x[2], x[3], x[4], x[5], s) for x in list(itertools.product(p, d, q, P, D, Q))]
+
+# Default number of fits a stepwise search may spend on one series
+STEPWISE_MAX_FITS = 40
+
+# Per-fit limits in the order search: wall-clock seconds and optimizer iterations
+FIT_TIME_LIMIT = 60
+FIT_MAX_ITER = 50
+
+# Options passed to every SARIMAX model, also part of the fit cache key
+SARIMAX_OPTIONS = {'enforce_stationarity': False, 'enforce_invertibility': False}
+
+# Series, fit cache and fit options shared with the worker processes, set once per worker by _init_worker
+_worker_series = {}
+_worker_cache = None
+_worker_options = {}
+
+
+class FitTimeout(Exception):
+    pass
+
+
+def _split_order(order):
+    return (order[0], order[1], order[2]), (order[3], order[4], order[5], order[6])
+
+
+# Caught warnings by category name, e.g. {'ConvergenceWarning': 1}
+def _warning_counts(caught):
+    counts = {}
+    for warning in caught:
+        counts[warning.category.__name__] = counts.get(warning.category.__name__, 0) + 1
+    return counts
+
+
+# Summary of a fitted model as stored in the fit cache
+def _record(results, fit_time=None, warm_started=False):
+    retvals = results.mle_retvals or {}
+    converged = bool(retvals.get('converged', True))
+    return {
+        'status': 'ok' if converged else 'not_converged',
+        'aic': float(results.aic),
+        'params': [float(x) for x in results.params],
+        'param_names': list(results.model.param_names),
+        'converged': converged,
+        'iterations': retvals.get('iterations'),
+        'fit_time': fit_time,
+        'warm_started': warm_started
+    }
+
+
+# Starting parameters for model taken from a donor fit: coefficients the donor also has
+# keep its values, new lags start at zero (the donor model itself), sigma2 comes from the donor
+def warm_start_params(model, donor):
+    if donor is None or not donor.get('params') or not donor.get('param_names'):
+        return None
+    values = dict(zip(donor['param_names'], donor['params']))
+    if 'sigma2' not in values:
+        return None
+    return np.array([values.get(name, 0.0) for name in model.param_names])
+
+
+# Closest successful fit in fits to order with the same differencing (d and D), by L1 distance
+# over (p, q, P, Q); ties go to the lower AIC
+def closest_donor(fits, order):
+    best = None
+    for other, record in fits.items():
+        if record.get('params') is None or other[1] != order[1] or other[4] != order[4]:
+            continue
+        distance = sum(abs(a - b) for a, b in zip((other[0], other[2], other[3], other[5]), (order[0], order[2], order[3], order[5])))
+        rank = (distance, record['aic'])
+        if best is None or rank < best[0]:
+            best = (rank, record)
+    return None if best is None else best[1]
+
+
+# Stop a fit once it runs past its deadline. The optimizer callback checks between
+# iterations; on the main thread of a (worker) process SIGALRM also interrupts a fit
+# that is stuck inside a single likelihood evaluation
+class _Deadline:
+    def __init__(self, time_limit):
+        self.time_limit = time_limit
+        self.use_alarm = (time_limit is not None and hasattr(signal, 'setitimer')
+                          and threading.current_thread() is threading.main_thread())
+
+    def _alarm(self, signum, frame):
+        raise FitTimeout()
+
+    def check(self, *args):
+        if self.time_limit is not None and time.monotonic() > self.deadline:
+            raise FitTimeout()
+
+    def __enter__(self):
+        if self.time_limit is not None:
+            self.deadline = time.monotonic() + self.time_limit
+        if self.use_alarm:
+            self.previous_handler = signal.signal(signal.SIGALRM, self._alarm)
+            signal.setitimer(signal.ITIMER_REAL, self.time_limit)
+        return self
+
+    def __exit__(self, *exc):
+        if self.use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self.previous_handler)
+        return False
+
+
+# Fit a single SARIMA order and return a record with its AIC, parameters, optimizer
+# iterations, fit time and status: 'ok', 'not_converged', 'failed' or 'timeout'.
+# With warm_start the optimizer starts from the previous run's fit of the named series
+# at this order when the cache has one, otherwise from the donor record
+def fit_record(data, order, cache=None, time_limit=FIT_TIME_LIMIT, max_iter=FIT_MAX_ITER, warm_start=False, donor=None, name=None):
+    order, seasonal_order = _split_order(order)
+    options = dict(SARIMAX_OPTIONS, maxiter=max_iter)
+    if cache is not None:
+        key = fit_key(data, order, seasonal_order, options)
+        record = cache.get(key)
+        if record is not None:
+            return dict(record, cached=True)
+        if warm_start and name is not None:
+            donor = cache.get(series_key(name, order, seasonal_order, options)) or donor
+
+    record = {'status': 'failed', 'aic': None, 'params': None, 'converged': False}
+    # Warnings are recorded with the fit rather than printed or silenced: fits run in worker
+    # processes, where the caller's telemetry cannot see them
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        try:
+            with _Deadline(time_limit) as deadline:
+                started = time.perf_counter()
+                model = SARIMAX(data, order=order, seasonal_order=seasonal_order, **SARIMAX_OPTIONS)
+                start_params = warm_start_params(model, donor) if warm_start else None
+                results = model.fit(start_params=start_params, disp=False, maxiter=max_iter, callback=deadline.check)
+                fit_time = time.perf_counter() - started
+        except FitTimeout:
+            # Not cached: a longer time limit on a later run should get another try
+            return {'status': 'timeout', 'aic': None, 'params': None, 'converged': False, 'warnings': _warning_counts(caught)}
+        except Exception:
+            results = None
+    if results is not None and np.isfinite(results.aic):
+        record = _record(results, fit_time, start_params is not None)
+    record['warnings'] = _warning_counts(caught)
+
+    if cache is not None:
+        cache.put(key, record)
+        if name is not None and record['params'] is not None:
+            cache.put(series_key(name, order, seasonal_order, options), record)
+    return record
+
+
+# Fit a single SARIMA order and return its AIC (None when the fit fails or times out)
+def fit_order(data, order, cache=None, time_limit=FIT_TIME_LIMIT, max_iter=FIT_MAX_ITER):
+    return fit_record(data, order, cache, time_limit, max_iter)['aic']
+
+
+# Fit a SARIMA model, rebuilding it from cached parameters instead of re-optimizing when possible.
+# With warm_start and a series name, a refit on changed data starts from the previous run's parameters.
+# A fit that runs past time_limit (seconds) raises FitTimeout
+def fit_sarima_model(data, order, seasonal_order, cache=None, name=None, warm_start=False, time_limit=None):
+    model = SARIMAX(data, order=order, seasonal_order=seasonal_order, **SARIMAX_OPTIONS)
+    start_params = None
+    if cache is not None:
+        key = fit_key(data, order, seasonal_order, SARIMAX_OPTIONS)
+        record = cache.get(key)
+        if record is not None and record['params'] is not None:
+            return model.smooth(np.asarray(record['params']))
+        if warm_start and name is not None:
+            start_params = warm_start_params(model, cache.get(series_key(name, order, seasonal_order, SARIMAX_OPTIONS)))
+
+    with _Deadline(time_limit) as deadline:
+        started = time.perf_counter()
+        model_fit = model.fit(start_params=start_params, disp=False, callback=deadline.check)
+        fit_time = time.perf_counter() - started
+    if cache is not None:
+        record = _record(model_fit, fit_time, start_params is not None)
+        cache.put(key, record)
+        if name is not None:
+            cache.put(series_key(name, order, seasonal_order, SARIMAX_OPTIONS), record)
+    return model_fit
+
+
+# Number of differences needed for stationarity, from repeated KPSS tests
+def ndiffs(data, alpha=0.05, max_d=max(d)):
+    x = np.asarray(data, dtype=float)
+    x = x[np.isfinite(x)]
+    for n in range(max_d + 1):
+        if len(x) < 3 or np.ptp(x) == 0:
+            return n
+        with warnings.catch_warnings():
+            # Only the notice that the p-value is beyond the table's range, which the test expects
+            warnings.simplefilter('ignore', InterpolationWarning)
+            p_value = kpss(x, regression='c', nlags='auto')[1]
+        if p_value >= alpha:
+            return n
+        x = np.diff(x)
+    return max_d
+
+
+# Number of seasonal differences, from the strength of the STL seasonal component
+def nsdiffs(data, m=s, threshold=0.64, max_D=max(D)):
+    x = np.asarray(data, dtype=float)
+    x = x[np.isfinite(x)]
+    for n in range(max_D + 1):
+        if len(x) < 2 * m + 1 or np.ptp(x) == 0:
+            return n
+        decomposition = STL(x, period=m).fit()
+        remainder = decomposition.resid
+        strength = max(0.0, 1 - np.var(remainder) / np.var(remainder + decomposition.seasonal))
+        if strength < threshold:
+            return n
+        x = x[m:] - x[:-m]
+    return max_D
+
+
+# Orders one step away from the current one, in a fixed order so the walk is deterministic
+def _neighbours(order):
+    p_, d_, q_, P_, D_, Q_, s_ = order
+    steps = [(-1, 0, 0, 0), (1, 0, 0, 0), (0, -1, 0, 0), (0, 1, 0, 0),
+             (-1, -1, 0, 0), (1, 1, 0, 0),
+             (0, 0, -1, 0), (0, 0, 1, 0), (0, 0, 0, -1), (0, 0, 0, 1),
+             (0, 0, -1, -1), (0, 0, 1, 1)]
+    for dp, dq, dP, dQ in steps:
+        candidate = (p_ + dp, d_, q_ + dq, P_ + dP, D_, Q_ + dQ, s_)
+        if candidate[0] in p and candidate[2] in q and candidate[3] in P and candidate[5] in Q:
+            yield candidate
+
+
+# Stepwise search: start from a few seed models and move to the best neighbouring order
+# until no neighbour improves the AIC or the fit budget is spent.
+# Returns fits[order] -> fit record for every order tried
+def stepwise_search(data, max_fits=STEPWISE_MAX_FITS, cache=None, time_limit=FIT_TIME_LIMIT, max_iter=FIT_MAX_ITER,
+                    warm_start=False, name=None):
+    d_ = ndiffs(data)
+    D_ = nsdiffs(data)
+    seeds = [(2, d_, 2, 1, D_, 1, s), (0, d_, 0, 0, D_, 0, s), (1, d_, 0, 1, D_, 0, s), (0, d_, 1, 0, D_, 1, s)]
+
+    fits = {}
+
+    def evaluate(order):
+        if order not in fits and len(fits) < max_fits:
+            # Neighbouring orders start from the closest order already fitted
+            donor = closest_donor(fits, order) if warm_start else None
+            fits[order] = fit_record(data, order, cache, time_limit, max_iter, warm_start, donor, name)
+        return fits[order]['aic'] if order in fits else None
+
+    current = None
+    current_aic = float("inf")
+    for order in seeds:
+        aic = evaluate(order)
+        if aic is not None and aic < current_aic:
+            current, current_aic = order, aic
+
+    while current is not None and len(fits) < max_fits:
+        improved = False
+        for order in _neighbours(current):
+            aic = evaluate(order)
+            if aic is not None and aic < current_aic:
+                current, current_aic = order, aic
+                improved = True
+                break
+        if not improved:
+            break
+
+    return fits
+
+
+# Fit a block of grid orders for one series in sequence, each warm-started from the
+# closest order of the block already fitted
+def fit_block(data, orders, cache=None, time_limit=FIT_TIME_LIMIT, max_iter=FIT_MAX_ITER, warm_start=False, name=None):
+    fits = {}
+    for order in orders:
+        donor = closest_donor(fits, order) if warm_start else None
+        fits[order] = fit_record(data, order, cache, time_limit, max_iter, warm_start, donor, name)
+    return fits
+
+
+def _set_worker_state(series, cache, options):
+    global _worker_series, _worker_cache, _worker_options
+    _worker_series = series
+    _worker_cache = cache
+    _worker_options = options
+
+
+def _init_worker(series, cache, options):
+    _set_worker_state(series, cache, options)
+    # One BLAS thread per worker so the pool, not numpy, owns the cores
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(1)
+    except ImportError:
+        pass
+
+
+def _series_name(key):
+    return '|'.join(key) if isinstance(key, tuple) else None
+
+
+def _fit_job(job):
+    key, order = job
+    options = _worker_options
+    return key, order, fit_record(_worker_series[key], order, _worker_cache, options['time_limit'], options['max_iter'],
+                                  options['warm_start'], None, _series_name(key))
+
+
+def _block_job(job):
+    key, orders = job
+    return key, fit_block(_worker_series[key], orders, _worker_cache, name=_series_name(key), **_worker_options)
+
+
+def _stepwise_job(job):
+    key, max_fits = job
+    return key, stepwise_search(_worker_series[key], max_fits, _worker_cache, name=_series_name(key), **_worker_options)
+
+
+# Pick the winner deterministically: lowest AIC, ties go to the earlier order in the grid
+def _select_best(fits, combinations):
+    best_aic = float("inf")
+    best_order = None
+    best_seasonal_order = None
+    for order in combinations:
+        record = fits.get(order)
+        if record is not None and record['aic'] is not None and record['aic'] < best_aic:
+            best_aic = record['aic']
+            best_order = order[0], order[1], order[2]
+            best_seasonal_order = order[3], order[4], order[5], order[6]
+    return best_order, best_seasonal_order, best_aic
+
+
+# Orders in the grid first, then any extra orders a stepwise walk tried, in the order it tried them
+def _tried(fits, combinations):
+    grid = [order for order in combinations if order in fits]
+    seen = set(grid)
+    return grid + [order for order in fits if order not in seen]
+
+
+# How many fits of one series were tried, failed, timed out, did not converge, came from the
+# cache or were warm-started, with the optimizer iterations and fit time spent on the fresh ones
+def fit_counts(fits):
+    records = list(fits.values())
+    statuses = [record['status'] for record in records]
+    fresh = [record for record in records if record['params'] is not None and not record.get('cached')]
+    warning_counts = {}
+    for record in records:
+        if not record.get('cached'):
+            for category, n in record.get('warnings', {}).items():
+                warning_counts[category] = warning_counts.get(category, 0) + n
+    return {
+        'n_fits': len(statuses),
+        'n_failed': statuses.count('failed'),
+        'n_timed_out': statuses.count('timeout'),
+        'n_not_converged': statuses.count('not_converged'),
+        'n_cached': sum(1 for record in records if record.get('cached')),
+        'n_warm_started': sum(1 for record in fresh if record.get('warm_started')),
+        'iterations': sum(record.get('iterations') or 0 for record in fresh),
+        'fit_time': sum(record.get('fit_time') or 0.0 for record in fresh),
+        'warnings': warning_counts
+    }
+
+
+def _resolve_n_jobs(n_jobs):
+    if n_jobs is None or n_jobs <= 0:
+        return os.cpu_count() or 1
+    return n_jobs
+
+
+def _map(function, jobs, series, n_jobs, cache, options, chunksize=1):
+    n_jobs = min(_resolve_n_jobs(n_jobs), len(jobs)) if jobs else 1
+    if n_jobs == 1:
+        _set_worker_state(series, cache, options)
+        try:
+            yield from map(function, jobs)
+        finally:
+            _set_worker_state({}, None, {})
+        return
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(series, cache, options)) as executor:
+        yield from executor.map(function, jobs, chunksize=chunksize)
+
+
+# Run the order search for every series, on a process pool when n_jobs > 1.
+# Returns fits[key][order] -> fit record for every order tried
+def _run_fits(series, combinations, n_jobs, cache=None, method='exhaustive', max_fits=STEPWISE_MAX_FITS,
+              time_limit=FIT_TIME_LIMIT, max_iter=FIT_MAX_ITER, warm_start=False):
+    fits = {key: {} for key in series}
+    options = {'time_limit': time_limit, 'max_iter': max_iter, 'warm_start': warm_start}
+
+    if method == 'exhaustive' and warm_start:
+        # One job per (series, d, D) block, so every fit in a block can start from an already fitted neighbour
+        blocks = {}
+        for order in combinations:
+            blocks.setdefault((order[1], order[4]), []).append(order)
+        jobs = [(key, orders) for key in series for orders in blocks.values()]
+        for key, block_fits in _map(_block_job, jobs, series, n_jobs, cache, options):
+            fits[key].update(block_fits)
+    elif method == 'exhaustive':
+        # One job per (series, order); small chunks keep the pool balanced, since fit times vary a lot
+        jobs = [(key, order) for key in series for order in combinations]
+        chunksize = max(1, len(jobs) // (_resolve_n_jobs(n_jobs) * 8))
+        for key, order, record in _map(_fit_job, jobs, series, n_jobs, cache, options, chunksize):
+            fits[key][order] = record
+    elif method == 'stepwise':
+        # The walk is sequential within a series, so one job per series
+        jobs = [(key, max_fits) for key in series]
+        for key, series_fits in _map(_stepwise_job, jobs, series, n_jobs, cache, options):
+            fits[key] = series_fits
+    else:
+        raise ValueError(f"Unknown search method: {method!r} (expected 'exhaustive' or 'stepwise')")
+
+    if cache is not None:
+        cache.prune()
+    return fits
+
+
+# Function to determine the best SARIMA parameters based on AIC
+def best_sarima_params(data, combinations=pdq_combinations, n_jobs=1, cache=None, method='exhaustive', max_fits=STEPWISE_MAX_FITS,
+                       time_limit=FIT_TIME_LIMIT, max_iter=FIT_MAX_ITER, warm_start=False):
+    series = {0: np.asarray(data, dtype=float)}
+    fits = _run_fits(series, combinations, n_jobs, cache, method, max_fits, time_limit, max_iter, warm_start)
+    return _select_best(fits[0], _tried(fits[0], combinations))
+
+
+# Determine the best SARIMA parameters for every (file, column) series in one parallel pass
+def search_sarima_orders(datasets, files_and_columns, combinations=pdq_combinations, n_jobs=None, cache=None, method='exhaustive',
+                         max_fits=STEPWISE_MAX_FITS, time_limit=FIT_TIME_LIMIT, max_iter=FIT_MAX_ITER, warm_start=False):
+    series = {}
+    for file, columns in files_and_columns.items():
+        for column in columns:
+            series[(file, column)] = np.asarray(datasets[file][column], dtype=float)
+
+    fits = _run_fits(series, combinations, n_jobs, cache, method, max_fits, time_limit, max_iter, warm_start)
+    return search_results(fits, files_and_columns, combinations)
+
+
+# Best order and fit counts of every series, results[file][column], from fits[(file, column)][order]
+def search_results(fits, files_and_columns, combinations=pdq_combinations):
+    results = {}
+    for file, columns in files_and_columns.items():
+        results[file] = {}
+        for column in columns:
+            series_fits = fits[(file, column)]
+            order, seasonal_order, aic = _select_best(series_fits, _tried(series_fits, combinations))
+            results[file][column] = {
+                'order': order,
+                'seasonal_order': seasonal_order,
+                'aic': aic,
+                **fit_counts(series_fits)
+            }
+    return results
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""Local forecast-serving HTTP API
+
+A small asyncio HTTP/1.1 server over the saved model artifacts. GET
+/forecast returns one series' stacked point forecast with a prediction
+interval (lower, upper) from simulated stacked paths, and the SARIMA and GB
+forecasts it combines, with the SARIMA interval, as JSON. Results
+are kept in an LRU cache with a time-to-live, keyed by model version, series,
+horizon and interval level, and concurrent identical requests share a single
+computation. The server follows the LATEST artifact version, so saving new
+models changes the version in every cache key instead of serving stale
+forecasts. benchmark() measures latency and throughput against a running
+server.
+
+    python serving.py --port 8050
+    python serving.py --benchmark
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import time
+from collections import OrderedDict
+from statistics import NormalDist
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from artifacts import ARTIFACT_DIR, LATEST, load_artifacts
+
+HOST = '127.0.0.1'
+PORT = 8050
+
+# Result cache limits
+CACHE_ENTRIES = 1024
+CACHE_TTL = 300  # 5 minutes
+
+# Longest horizon a request may ask for
+MAX_HORIZON = 240
+
+# Simulated paths behind the stacked intervals, with a fixed seed so a cached result and a
+# recomputed one agree
+INTERVAL_PATHS = 2000
+INTERVAL_SEED = 0
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# LRU cache whose entries also expire ttl seconds after they were stored
+class ResultCache:
+    def __init__(self, max_entries=CACHE_ENTRIES, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value):
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ForecastService:
+    def __init__(self, path=ARTIFACT_DIR, cache=None):
+        self.path = path
+        self.cache = cache if cache is not None else ResultCache()
+        self.artifacts = None
+        self._latest_mtime = None
+        self._inflight = {}
+        self.computations = 0
+        self.reload()
+
+    # Switch to the LATEST artifact version when it has changed on disk
+    def reload(self):
+        mtime = os.stat(os.path.join(self.path, LATEST)).st_mtime_ns
+        if mtime != self._latest_mtime:
+            self.artifacts = load_artifacts(self.path)
+            self._latest_mtime = mtime
+        return self.artifacts
+
+    # Forecasts of every series for one horizon and level; each series' result is cached separately
+    def _compute(self, artifacts, horizon, level):
+        sarima_mean, sarima_variance = artifacts.sarima_forecast(horizon)
+        gb = artifacts.gb_forecast(horizon)
+        coef = artifacts.array('stacker_coef')
+        stacked = sarima_mean * coef[:, 0] + gb * coef[:, 1] + artifacts.array('stacker_intercept')
+        lower, upper = artifacts.stacked_intervals(horizon, (level,), INTERVAL_PATHS, INTERVAL_SEED, forecast=stacked)['intervals'][level]
+        z = NormalDist().inv_cdf(0.5 + level / 2)
+        spread = z * np.sqrt(sarima_variance)
+        dates = [str(date) for date in artifacts.forecast_dates(horizon)]
+        results = {}
+        for j, (file, column) in enumerate(artifacts.keys):
+            results[(file, column)] = {
+                'file': file,
+                'column': column,
+                'version': artifacts.version,
+                'horizon': horizon,
+                'level': level,
+                'dates': dates,
+                'forecast': stacked[:, j].tolist(),
+                'lower': lower[:, j].tolist(),
+                'upper': upper[:, j].tolist(),
+                'sarima': sarima_mean[:, j].tolist(),
+                'sarima_lower': (sarima_mean[:, j] - spread[:, j]).tolist(),
+                'sarima_upper': (sarima_mean[:, j] + spread[:, j]).tolist(),
+                'gb': gb[:, j].tolist(),
+            }
+        self.computations += 1
+        return results
+
+    # Runs when a computation ends, whether or not anyone is still waiting for it: the batch
+    # stops being in flight and its results go into the cache
+    def _finish(self, batch_key, pending):
+        del self._inflight[batch_key]
+        if pending.cancelled() or pending.exception() is not None:
+            return
+        version, horizon, level = batch_key
+        for series, series_result in pending.result().items():
+            self.cache.put((version, series, horizon, level), series_result)
+
+    # One series' forecast, from the cache when possible. Identical requests that arrive while
+    # a computation is running wait for that computation instead of starting their own. Every
+    # requester, the one that started it included, waits through a shield, so a cancelled
+    # request (e.g. a dropped connection) leaves the computation running for the others
+    async def forecast(self, key, horizon, level):
+        artifacts = self.reload()
+        if key not in artifacts.keys:
+            raise RequestError(404, f'Unknown series {key[0]} | {key[1]}')
+        cache_key = (artifacts.version, key, horizon, level)
+        result = self.cache.get(cache_key)
+        if result is not None:
+            return result
+
+        batch_key = (artifacts.version, horizon, level)
+        pending = self._inflight.get(batch_key)
+        if pending is None:
+            loop = asyncio.get_running_loop()
+            pending = loop.run_in_executor(None, self._compute, artifacts, horizon, level)
+            self._inflight[batch_key] = pending
+            pending.add_done_callback(functools.partial(self._finish, batch_key))
+        results = await asyncio.shield(pending)
+        return results[key]
+
+    # Route a GET request to a (status, JSON body) pair
+    async def handle(self, method, target):
+        if method != 'GET':
+            raise RequestError(405, f'{method} is not supported')
+        url = urlsplit(target)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        if url.path == '/health':
+            return 200, {'status': 'ok', 'version': self.reload().version}
+        if url.path == '/series':
+            artifacts = self.reload()
+            return 200, {'version': artifacts.version,
+                         'series': [{'id': i, 'file': file, 'column': column} for i, (file, column) in enumerate(artifacts.keys)]}
+        if url.path == '/stats':
+            return 200, {'cache_entries': len(self.cache), 'hits': self.cache.hits, 'misses': self.cache.misses,
+                         'computations': self.computations}
+        if url.path == '/forecast':
+            return 200, await self.forecast(self._series(query), *self._horizon_and_level(query))
+        raise RequestError(404, f'No route for {url.path}')
+
+    # Series by position (?series=3) or by name (?file=...&column=...)
+    def _series(self, query):
+        keys = self.artifacts.keys
+        if 'series' in query:
+            try:
+                return keys[int(query['series'])]
+            except (ValueError, IndexError):
+                raise RequestError(404, f"Unknown series {query['series']}")
+        if 'file' in query and 'column' in query:
+            return (query['file'], query['column'])
+        raise RequestError(400, 'Give series=<id> or file=<file>&column=<column>')
+
+    @staticmethod
+    def _horizon_and_level(query):
+        try:
+            horizon = int(query.get('horizon', 12))
+            level = float(query.get('level', 0.95))
+        except ValueError:
+            raise RequestError(400, 'horizon must be an integer and level a number')
+        if not 1 <= horizon <= MAX_HORIZON:
+            raise RequestError(400, f'horizon must be between 1 and {MAX_HORIZON}')
+        if not 0 < level < 1:
+            raise RequestError(400, 'level must be between 0 and 1')
+        return horizon, round(level, 6)
+
+    # One connection: HTTP/1.1 requests with keep-alive until the client closes
+    async def serve_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                if int(headers.get('content-length', 0) or 0):
+                    await reader.readexactly(int(headers['content-length']))
+
+                try:
+                    method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                    status, body = await self.handle(method, target)
+                except RequestError as e:
+                    status, body = e.status, {'error': str(e)}
+                except ValueError:
+                    status, body = 400, {'error': 'Malformed request line'}
+                except Exception as e:
+                    status, body = 500, {'error': repr(e)}
+
+                payload = json.dumps(body).encode('utf-8')
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write((f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+                              f'Content-Type: application/json\r\n'
+                              f'Content-Length: {len(payload)}\r\n'
+                              f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode('latin-1') + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host=HOST, port=PORT):
+        return await asyncio.start_server(self.serve_connection, host, port)
+
+
+# Minimal keep-alive HTTP client for the benchmark: returns the status and the decoded body
+async def _get(reader, writer, target):
+    writer.write(f'GET {target} HTTP/1.1\r\nHost: {HOST}\r\n\r\n'.encode('latin-1'))
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+# Latency and throughput of n_requests /forecast calls spread over concurrency connections,
+# cycling through every series and the given horizons
+async def benchmark(host=HOST, port=PORT, n_requests=2000, concurrency=16, horizons=(12, 24, 60)):
+    reader, writer = await asyncio.open_connection(host, port)
+    _, listing = await _get(reader, writer, '/series')
+    writer.close()
+    targets = [f"/forecast?series={series['id']}&horizon={horizon}" for horizon in horizons for series in listing['series']]
+
+    latencies = []
+    errors = 0
+    counter = iter(range(n_requests))
+
+    async def worker():
+        nonlocal errors
+        reader, writer = await asyncio.open_connection(host, port)
+        for i in counter:
+            started = time.perf_counter()
+            status, _ = await _get(reader, writer, targets[i % len(targets)])
+            latencies.append(time.perf_counter() - started)
+            errors += status != 200
+        writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies = np.array(latencies) * 1000
+    return {
+        'requests': n_requests,
+        'concurrency': concurrency,
+        'errors': errors,
+        'seconds': elapsed,
+        'requests_per_second': n_requests / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'max_ms': float(latencies.max()),
+    }
+
+
+# Start a server on a free port and benchmark it with a cold and then a warm cache
+async def _run_benchmark(path, n_requests, concurrency):
+    service = ForecastService(path)
+    server = await service.start(HOST, 0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        for label in ('cold cache', 'warm cache'):
+            result = await benchmark(HOST, port, n_requests, concurrency)
+            print(f"{label}: {result['requests_per_second']:.0f} req/s, p50 {result['p50_ms']:.2f} ms, "
+                  f"p95 {result['p95_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms, errors {result['errors']}, "
+                  f'computations {service.computations}')
+
+
+async def _serve(path, host, port):
+    service = ForecastService(path)
+    server = await service.start(host, port)
+    print(f'Serving forecasts of artifact version {service.artifacts.version} on http://{host}:{port}')
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve forecasts from saved model artifacts')
+    parser.add_argument('--path', default=ARTIFACT_DIR)
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--benchmark', action='store_true', help='benchmark a temporary server instead of serving')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+    if args.benchmark:
+        asyncio.run(_run_benchmark(args.path, args.requests, args.concurrency))
+    else:
+        asyncio.run(_serve(args.path, args.host, args.port))
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Monte Carlo prediction intervals for the stacked forecast
+
+Simulates future paths of every series at once: SARIMA paths from each
+model's state-space form (initial state drawn from the filtered state at
+the end of the data, then state and observation disturbances each step),
+GB paths from the recursive forecast with a resampled out-of-sample
+residual added at every step, so the errors feed into later lags, and the
+two combined through each series' stacker. Every step is a few array
+operations over all series and paths; paths are generated in chunks so
+the working memory is set by the chunk size, while only the final stacked
+paths are kept for the quantiles. A recursive GB path costs a pass through
+every tree per step, far more than a SARIMA path, so a smaller set of GB
+paths is simulated and each stacked path pairs a SARIMA path with one of
+them drawn at random. The noisy GB paths drift away from the recursive GB
+forecast, so the intervals are the spread of the simulated paths around
+their median placed around the point forecast, which they always contain.
+"""
+
+import numpy as np
+
+# Default number of simulated (stacked and GB) paths, paths per chunk, and interval levels
+N_PATHS = 5000
+GB_PATHS = 500
+CHUNK_SIZE = 1000
+LEVELS = (0.8, 0.95)
+
+
+# Square-root factor L of a stack of covariance matrices (M = L L^T), keeping only the
+# directions with non-zero variance in some series, so rank-one disturbances stay rank one
+def covariance_factor(matrices, tolerance=1e-12):
+    eigenvalues, eigenvectors = np.linalg.eigh(matrices)
+    scale = np.maximum(eigenvalues.max(axis=-1, keepdims=True), 0.0)
+    keep = (eigenvalues > tolerance * scale).any(axis=0)
+    return eigenvectors[..., keep] * np.sqrt(np.clip(eigenvalues[..., keep], 0.0, None))[:, None, :]
+
+
+# SARIMA sample paths (steps, n_series, n_paths) from stacked state-space arrays
+# (see artifacts.state_space_arrays)
+def simulate_sarima(arrays, steps, n_paths, rng):
+    design = np.asarray(arrays['design'])
+    transition = np.asarray(arrays['transition'])
+    obs_std = np.sqrt(np.asarray(arrays['obs_cov']))[:, None]
+    disturbance = covariance_factor(np.asarray(arrays['state_cov']))
+    initial = covariance_factor(np.asarray(arrays['state_cov_end']))
+    n_series = design.shape[0]
+
+    # States are (n_series, n_states, n_paths), so each transition is one batched matrix product
+    state = np.asarray(arrays['state'])[:, :, None] + initial @ rng.standard_normal((n_series, initial.shape[2], n_paths))
+    paths = np.empty((steps, n_series, n_paths))
+    for step in range(steps):
+        paths[step] = np.einsum('nk,nkp->np', design, state) + obs_std * rng.standard_normal((n_series, n_paths))
+        state = transition @ state + disturbance @ rng.standard_normal((n_series, disturbance.shape[2], n_paths))
+    return paths
+
+
+def _chunks(n, chunk_size):
+    return [min(chunk_size, n - start) for start in range(0, n, chunk_size)]
+
+
+# Residuals of each series, padded into one (n_series, n_residuals) array with their counts
+def _residual_table(residuals):
+    residuals = [np.asarray(r, dtype=np.float64)[np.isfinite(r)] for r in residuals]
+    counts = np.array([len(r) for r in residuals])
+    table = np.zeros((len(residuals), max(counts.max(), 1)))
+    for i, r in enumerate(residuals):
+        table[i, :len(r)] = r
+    return table, np.maximum(counts, 1)
+
+
+# Recursive GB sample paths (steps, n_series, n_paths): every step predicts all paths of all
+# series in one pass, adds a residual drawn from that series' residuals and feeds the result
+# back into the next step's features
+def simulate_gb(predict_rows, history, feature_spec, months, steps, residuals, n_paths, rng):
+    history = np.asarray(history, dtype=np.float64)
+    n_series = history.shape[1]
+    table, counts = _residual_table(residuals)
+    draws = (rng.random((n_series, steps * n_paths)) * counts[:, None]).astype(np.intp)
+    shocks = np.take_along_axis(table, draws, axis=1).reshape(n_series, steps, n_paths)
+
+    h = feature_spec.history
+    buffer = np.empty((h + steps, n_series, n_paths))
+    buffer[:h] = history[-h:, :, None]
+    for step in range(steps):
+        window = buffer[step:step + h].reshape(h, n_series * n_paths)
+        features = feature_spec.next_row(window, months[step]).reshape(n_series, n_paths, -1)
+        buffer[h + step] = predict_rows(features) + shocks[:, step]
+    return buffer[h:]
+
+
+# Point forecasts (steps, n_series) of the same inputs: the SARIMA state mean carried forward
+# by the transition matrices and the recursive GB forecast, combined through the stackers
+def point_forecast(arrays, predict_rows, history, feature_spec, months, coef, intercept, steps):
+    design = np.asarray(arrays['design'])
+    transition = np.asarray(arrays['transition'])
+    state = np.array(arrays['state'])
+    history = np.asarray(history, dtype=np.float64)
+    h = feature_spec.history
+    buffer = np.empty((h + steps, history.shape[1]))
+    buffer[:h] = history[-h:]
+    sarima = np.empty((steps, design.shape[0]))
+    for step in range(steps):
+        sarima[step] = np.einsum('nk,nk->n', design, state)
+        state = np.einsum('nkl,nl->nk', transition, state)
+        buffer[h + step] = predict_rows(feature_spec.next_row(buffer[step:step + h], months[step])[:, None, :])[:, 0]
+    coef = np.asarray(coef, dtype=np.float64)
+    return sarima * coef[:, 0] + buffer[h:] * coef[:, 1] + np.asarray(intercept, dtype=np.float64)
+
+
+# Simulated stacked forecasts for every series. arrays are the stacked SARIMA state-space
+# arrays, predict_rows a GB row predictor (see forecasting.row_predictor), residuals the GB
+# out-of-sample residuals of each series and coef / intercept the stackers' (n_series, 2) and
+# (n_series,) coefficients. forecast is the stacked point forecast the intervals belong to,
+# computed from the same inputs when not given. Returns the forecast, the mean and median
+# paths and the (lower, upper) interval around the forecast at each level, every one (steps, n_series)
+def stacked_intervals(arrays, predict_rows, history, feature_spec, months, residuals, coef, intercept, steps,
+                      levels=LEVELS, n_paths=N_PATHS, gb_paths=GB_PATHS, chunk_size=CHUNK_SIZE, seed=None, forecast=None):
+    if forecast is None:
+        forecast = point_forecast(arrays, predict_rows, history, feature_spec, months, coef, intercept, steps)
+    forecast = np.asarray(forecast, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    coef = np.asarray(coef, dtype=np.float64)
+    intercept = np.asarray(intercept, dtype=np.float64)[:, None]
+    n_series = coef.shape[0]
+    gb_paths = min(gb_paths, n_paths)
+
+    gb = np.concatenate([simulate_gb(predict_rows, history, feature_spec, months, steps, residuals, size, rng)
+                         for size in _chunks(gb_paths, chunk_size)], axis=2)
+    paths = np.empty((steps, n_series, n_paths))
+    start = 0
+    for size in _chunks(n_paths, chunk_size):
+        sarima = simulate_sarima(arrays, steps, size, rng)
+        pairs = rng.integers(0, gb_paths, size)
+        paths[:, :, start:start + size] = coef[:, 0, None] * sarima + coef[:, 1, None] * gb[:, :, pairs] + intercept
+        start += size
+
+    quantiles = sorted({q for level in levels for q in ((1 - level) / 2, (1 + level) / 2)} | {0.5})
+    values = dict(zip(quantiles, np.quantile(paths, quantiles, axis=2)))
+    median = values[0.5]
+    return {
+        'forecast': forecast,
+        'mean': paths.mean(axis=2),
+        'median': median,
+        'intervals': {level: (forecast - (median - values[(1 - level) / 2]), forecast + (values[(1 + level) / 2] - median))
+                      for level in levels},
+        'n_paths': n_paths,
+    }
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Synthetic EIA-like monthly consumption tables
+
+Writes workbooks in the layout of the EIA `Table_*.xlsx` downloads: a Month
+column, a units row under the header, one column per sector series plus
+columns the pipeline does not use, and "Not Available" cells both at the
+start of the record and scattered through it. Levels, trends, seasonal
+shapes and noise differ by fuel and sector, so the series look like the
+real ones to the models without needing the proprietary files. Any number
+of series and years can be generated for benchmarks.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from ingest import MISSING_VALUES
+from panel import SECTORS, TABLE_METADATA
+
+# Typical level of each fuel's series and the month of its seasonal peak (1 = January)
+FUEL_LEVELS = {'Petroleum': 1000.0, 'Natural Gas': 400.0, 'Electricity': 100000.0}
+SECTOR_PEAKS = {'Residential': 1, 'Commercial': 7, 'Industrial': 3, 'Transportation': 7, 'Electric Power': 8}
+
+START = '1973-01-01'
+
+
+def _column_name(fuel, sector, copy):
+    name = f'{fuel} Consumed by the {sector} Sector'
+    return name if copy == 0 else f'{name} {copy + 1}'
+
+
+# Table layout for n_series series, spread over the EIA tables: {file: [columns]} like
+# files_and_columns in the pipeline
+def synthetic_layout(n_series=12):
+    tables = list(TABLE_METADATA)
+    layout = {}
+    for i in range(n_series):
+        prefix = tables[i % len(tables)]
+        fuel, _ = TABLE_METADATA[prefix]
+        sector = SECTORS[(i // len(tables)) % len(SECTORS)]
+        copy = i // (len(tables) * len(SECTORS))
+        layout.setdefault(f'{prefix}_Synthetic_{fuel.replace(" ", "_")}_Consumption.xlsx', []).append(_column_name(fuel, sector, copy))
+    return layout
+
+
+# One monthly series: trend, a seasonal cycle peaking in the sector's peak month, a slow random walk
+# and noise, kept positive
+def synthetic_series(n_months, fuel, sector, rng):
+    t = np.arange(n_months)
+    level = FUEL_LEVELS[fuel] * rng.uniform(0.5, 1.5)
+    trend = level * rng.uniform(-0.002, 0.004) * t
+    peak = SECTOR_PEAKS.get(sector, 1)
+    seasonal = level * rng.uniform(0.05, 0.3) * np.cos(2 * np.pi * (t % 12 + 1 - peak) / 12)
+    walk = np.cumsum(rng.normal(0, level * 0.01, n_months))
+    noise = rng.normal(0, level * 0.02, n_months)
+    return np.maximum(level + trend + seasonal + walk + noise, level * 0.05)
+
+
+# Write the workbooks for n_series series over years of months into directory. leading_missing
+# months at the start of every series and a missing_rate share of the other months are
+# "Not Available". Returns the {file: [columns]} layout
+def write_tables(directory, n_series=12, years=50, leading_missing=12, missing_rate=0.005, extra_columns=1, seed=0):
+    rng = np.random.default_rng(seed)
+    n_months = years * 12
+    months = pd.date_range(START, periods=n_months, freq='MS')
+    layout = synthetic_layout(n_series)
+    os.makedirs(directory, exist_ok=True)
+
+    for file, columns in layout.items():
+        fuel, unit = next(TABLE_METADATA[prefix] for prefix in TABLE_METADATA if file.startswith(prefix))
+        table = {'Month': [None] + list(months)}
+        names = columns + [f'{fuel} Consumed, Other {k + 1}' for k in range(extra_columns)]
+        for name in names:
+            sector = next((sector for sector in SECTORS if sector in name), 'Residential')
+            values = np.round(synthetic_series(n_months, fuel, sector, rng), 3).astype(object)
+            missing = rng.random(n_months) < missing_rate
+            missing[:leading_missing] = True
+            # Never blank the last month, so interpolation always has a right-hand value
+            missing[-1] = False
+            values[missing] = MISSING_VALUES[0]
+            table[name] = [f'({unit})'] + list(values)
+        pd.DataFrame(table).to_excel(os.path.join(directory, file), index=False)
+    return layout
+
+
+# Hourly load series of n_points: daily and weekly cycles whose shape drifts slowly, a trend and
+# AR(1) noise, with a missing_rate share of the points missing
+def synthetic_load(n_points, level=1000.0, missing_rate=0.0, seed=0):
+    from scipy.signal import lfilter
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_points, dtype=np.float64)
+    daily = 0.15 * np.sin(2 * np.pi * (t - 6) / 24) + 0.05 * np.cos(4 * np.pi * t / 24)
+    weekly = 0.08 * np.where((t // 24) % 7 >= 5, -1.0, 0.4)
+    drift = 1 + 0.1 * np.sin(2 * np.pi * t / (24 * 365.25))
+    noise = lfilter([1.0], [1.0, -0.8], rng.normal(0, 0.02, n_points))
+    values = level * (1 + 0.00000002 * t + drift * (daily + weekly) + noise)
+    if missing_rate:
+        values[rng.random(n_points) < missing_rate] = np.nan
+    return values
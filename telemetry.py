@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""Stage-level telemetry for pipeline runs
+
+Each `with telemetry.stage(name, series=...)` block appends one JSON line
+to the telemetry file with its wall time, CPU time (this process, plus any
+child processes that finished during the stage), peak resident memory,
+outcome counts (ok / failed / not converged, or anything the stage counts)
+and the warnings raised inside it, grouped by category. Stages nest, and
+every record carries the run id and its parent stage, so a run can be
+grouped and compared with earlier ones. Stages named in `profile` also run
+under cProfile; the .prof file goes next to the telemetry file and can be
+opened with pstats, snakeviz or turned into a flame graph with flameprof.
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import resource
+import sys
+import time
+import traceback
+import uuid
+import warnings
+from collections import Counter
+from contextlib import contextmanager
+
+TELEMETRY_FILE = 'telemetry.jsonl'
+PROFILE_DIR = 'profiles'
+
+# Linux lets a process reset its peak RSS (VmHWM), which gives a per-stage peak
+_CLEAR_REFS = '/proc/self/clear_refs'
+_STATUS = '/proc/self/status'
+
+
+def _peak_rss():
+    try:
+        with open(_STATUS) as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # Fallback: the peak of the whole process so far (bytes on macOS, kilobytes elsewhere)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _reset_peak_rss():
+    try:
+        with open(_CLEAR_REFS, 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _children_cpu():
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+class Stage:
+    def __init__(self, name, series, parent, fields):
+        self.name = name
+        self.series = series
+        self.parent = parent
+        self.fields = fields
+        self.counts = Counter()
+        self.warnings = Counter()
+        self.peak = 0
+
+    # Count an outcome of this stage, e.g. stage.count('not_converged')
+    def count(self, outcome, n=1):
+        self.counts[outcome] += n
+
+    # Extra fields for the record
+    def add(self, **fields):
+        self.fields.update(fields)
+
+
+class Telemetry:
+    # profile lists the stage names to run under cProfile
+    def __init__(self, path=TELEMETRY_FILE, profile=(), run_id=None):
+        self.path = path
+        self.profile = set(profile)
+        self.run_id = run_id or f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self._stack = []
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.profile_dir = os.path.join(directory, PROFILE_DIR)
+
+    def _write(self, record):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+
+    @contextmanager
+    def stage(self, name, series=None, capture_warnings=True, **fields):
+        parent = self._stack[-1] if self._stack else None
+        stage = Stage(name, series, parent.name if parent else None, fields)
+        # The parent's peak so far is read before the reset, then the child's peak is folded back in on exit
+        if parent is not None:
+            parent.peak = max(parent.peak, _peak_rss())
+        per_stage_peak = _reset_peak_rss()
+        self._stack.append(stage)
+
+        profiler = cProfile.Profile() if name in self.profile else None
+        status, error = 'ok', None
+        started_at = time.time()
+        wall, cpu, children = time.perf_counter(), time.process_time(), _children_cpu()
+        try:
+            with warnings.catch_warnings(record=capture_warnings) as caught:
+                if capture_warnings:
+                    warnings.simplefilter('always')
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    yield stage
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+            for warning in caught or ():
+                stage.warnings[warning.category.__name__] += 1
+        except BaseException as e:
+            status, error = 'error', ''.join(traceback.format_exception_only(type(e), e)).strip()
+            raise
+        finally:
+            wall, cpu, children = time.perf_counter() - wall, time.process_time() - cpu, _children_cpu() - children
+            stage.peak = max(stage.peak, _peak_rss())
+            self._stack.pop()
+            if parent is not None:
+                parent.peak = max(parent.peak, stage.peak)
+
+            record = {
+                'run': self.run_id,
+                'stage': name,
+                'series': series,
+                'parent': stage.parent,
+                'status': status,
+                'start': started_at,
+                'wall_s': round(wall, 6),
+                'cpu_s': round(cpu, 6),
+                'children_cpu_s': round(children, 6),
+                # Without a per-stage reset this is the process peak up to the end of the stage
+                'peak_rss_mb': round(stage.peak / 2 ** 20, 2),
+                'peak_is_stage': per_stage_peak,
+                'counts': dict(stage.counts),
+                'warnings': dict(stage.warnings),
+            }
+            if error is not None:
+                record['error'] = error
+            if profiler is not None:
+                record['profile'] = self._save_profile(profiler, name, series)
+            record.update(stage.fields)
+            self._write(record)
+
+    # A record for work that was timed elsewhere, e.g. per-series results reported by a worker pool
+    def record(self, name, series=None, counts=None, **fields):
+        parent = self._stack[-1].name if self._stack else None
+        self._write(dict({'run': self.run_id, 'stage': name, 'series': series, 'parent': parent, 'status': 'ok',
+                          'start': time.time(), 'counts': dict(counts or {})}, **fields))
+
+    def _save_profile(self, profiler, name, series):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        label = name if series is None else f'{name}-{series}'
+        stem = os.path.join(self.profile_dir, f"{self.run_id}-{''.join(c if c.isalnum() or c in '._-' else '_' for c in label)}")
+        profiler.dump_stats(f'{stem}.prof')
+        # A readable summary of the hottest functions next to the binary profile
+        with open(f'{stem}.txt', 'w') as f:
+            pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(40)
+        return f'{stem}.prof'
+
+
+# Records of a telemetry file, optionally only those of one run
+def read_telemetry(path=TELEMETRY_FILE, run_id=None):
+    records = []
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if run_id is None or record['run'] == run_id:
+                records.append(record)
+    return records
@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingRegressor
+from sklearn.linear_model import LinearRegression
+from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+from artifacts import load_artifacts, save_artifacts
+from features import FeatureSpec, future_months
+from forecasting import generate_forecasts
+
+FEATURE_SPEC = FeatureSpec(lags=(1, 2, 12), windows=(3,), calendar=True)
+KEYS = [('Table_2.1a.xlsx', 'a'), ('Table_2.1a.xlsx', 'b'), ('Table_4.3.xlsx', 'c')]
+# Different state dimensions per series, so the stored arrays are padded
+ORDERS = [((1, 1, 1), (0, 1, 1, 12)), ((2, 1, 0), (1, 1, 0, 12)), ((0, 1, 1), (0, 0, 0, 0))]
+STEPS = 18
+
+
+def _fitted(tmp_path):
+    rng = np.random.default_rng(0)
+    index = pd.date_range('2005-01-01', periods=120, freq='MS')
+    t = np.arange(len(index))[:, None]
+    values = 50 + 0.1 * t + 5 * np.sin(2 * np.pi * t / 12 + np.arange(len(KEYS))) + rng.normal(0, 1, (len(index), len(KEYS)))
+    months = index.month.to_numpy()
+    X, y = FEATURE_SPEC.build(values, months)
+
+    sarima_models, gb_models, stackers, residuals = {}, {}, {}, []
+    for i, ((file, column), (order, seasonal_order)) in enumerate(zip(KEYS, ORDERS)):
+        model_fit = SARIMAX(values[:, i], order=order, seasonal_order=seasonal_order,
+                            enforce_stationarity=False, enforce_invertibility=False).fit(disp=False)
+        gb = GradientBoostingRegressor(n_estimators=30 + 10 * i, max_depth=3, random_state=42).fit(X[:, i], y[:, i])
+        stacker = LinearRegression().fit(np.column_stack([model_fit.fittedvalues[FEATURE_SPEC.history:], gb.predict(X[:, i])]), y[:, i])
+        sarima_models.setdefault(file, {})[column] = model_fit
+        gb_models.setdefault(file, {})[column] = gb
+        stackers.setdefault(file, {})[column] = stacker
+        residuals.append(y[-24:, i] - gb.predict(X[-24:, i]))
+
+    version = save_artifacts(KEYS, sarima_models, gb_models, stackers, values, index[-1], FEATURE_SPEC, residuals, path=str(tmp_path))
+    return sarima_models, gb_models, stackers, values, index, version
+
+
+def test_sarima_forecast_matches_statsmodels(tmp_path):
+    sarima_models, _, _, _, _, _ = _fitted(tmp_path)
+    mean, variance = load_artifacts(str(tmp_path)).sarima_forecast(STEPS)
+    for i, (file, column) in enumerate(KEYS):
+        expected = sarima_models[file][column].get_forecast(STEPS)
+        np.testing.assert_allclose(mean[:, i], expected.predicted_mean, rtol=1e-8)
+        np.testing.assert_allclose(variance[:, i], expected.var_pred_mean, rtol=1e-6)
+
+
+def test_stacked_forecast_matches_fitted_models(tmp_path):
+    sarima_models, gb_models, stackers, values, index, _ = _fitted(tmp_path)
+    expected = generate_forecasts([sarima_models[f][c] for f, c in KEYS], values, [gb_models[f][c] for f, c in KEYS],
+                                  [stackers[f][c] for f, c in KEYS], STEPS, FEATURE_SPEC, future_months(index[-1].month, STEPS))
+    artifacts = load_artifacts(str(tmp_path))
+    np.testing.assert_allclose(artifacts.forecast(STEPS), expected, rtol=1e-8)
+    assert artifacts.forecast_dates(1)[0] == np.datetime64(index[-1] + pd.DateOffset(months=1), 'D')
+
+
+def test_saving_unchanged_models_reuses_the_version(tmp_path):
+    _, _, _, _, _, version = _fitted(tmp_path)
+    assert _fitted(tmp_path)[-1] == version
+    assert set(os.listdir(tmp_path)) == {'LATEST', version}
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest import walk_forward_backtest
+from features import FeatureSpec
+from panel import Panel
+from sarima_search import fit_sarima_model
+
+FEATURE_SPEC = FeatureSpec(lags=(1, 2, 12), windows=(3,), calendar=True)
+FILES_AND_COLUMNS = {'Table_4.3.xlsx': ['a', 'b']}
+ORDER = {'order': (1, 1, 0), 'seasonal_order': (0, 1, 1, 12)}
+ORDERS = {'Table_4.3.xlsx': {'a': ORDER, 'b': ORDER}}
+
+
+def _panel(n_months=96):
+    rng = np.random.default_rng(0)
+    t = np.arange(n_months)[:, None]
+    values = 100 + 0.2 * t + 5 * np.sin(2 * np.pi * t / 12 + np.arange(2)) + rng.normal(0, 1, (n_months, 2))
+    index = pd.date_range('2000-01-01', periods=n_months, freq='MS', name='Month')
+    return Panel.from_datasets({'Table_4.3.xlsx': pd.DataFrame(values, columns=['a', 'b'], index=index)}, FILES_AND_COLUMNS)
+
+
+def test_sarima_is_fitted_at_the_oldest_origin_and_extended():
+    panel = _panel()
+    result = walk_forward_backtest(panel, FEATURE_SPEC, n_origins=3, horizon=6, step=6, orders=ORDERS, n_jobs=2)
+    origins = [panel.index.get_loc(origin) for origin in result['origins']]
+    assert origins == [78, 84, 90] and result['sarima_skipped'] == []
+    values = panel.values[:, 0]
+    model_fit = fit_sarima_model(values[:origins[0]], ORDER['order'], ORDER['seasonal_order'])
+    for k, origin in enumerate(origins):
+        if k > 0:
+            model_fit = model_fit.extend(values[origins[k - 1]:origin])
+        np.testing.assert_allclose(result['predictions']['SARIMA'][k, :, 0], model_fit.forecast(6), rtol=1e-6)
+        np.testing.assert_array_equal(result['actuals'][k, :, 0], values[origin:origin + 6])
+    assert np.isfinite(result['metrics']['RMSE']).all()
+
+
+def test_sarima_fits_respect_the_time_budget():
+    with pytest.warns(RuntimeWarning, match='SARIMA of 2 series not fitted'):
+        result = walk_forward_backtest(_panel(), FEATURE_SPEC, n_origins=2, horizon=6, step=6, orders=ORDERS, n_jobs=4,
+                                       time_budget=1e-9)
+    assert result['sarima_skipped'] == [('Table_4.3.xlsx', 'a'), ('Table_4.3.xlsx', 'b')]
+    assert np.isnan(result['predictions']['SARIMA']).all()
+    # GB folds already handed to a worker still finish
+    assert np.isfinite(result['predictions']['GB']).all()
+
+
+def test_too_short_panel_is_rejected():
+    with pytest.raises(ValueError, match='too few for a backtest'):
+        walk_forward_backtest(_panel(12), FEATURE_SPEC, n_origins=2, horizon=12, step=12)
@@ -0,0 +1,67 @@
+import os
+import time
+
+import numpy as np
+
+from fit_cache import FitCache, fit_key
+from sarima_search import fit_sarima_model
+
+
+def _age(cache, key, seconds, read_seconds_ago=0):
+    now = time.time()
+    os.utime(os.path.join(cache.path, f'{key}.json'), (now - read_seconds_ago, now - seconds))
+
+
+def test_round_trip_and_miss(tmp_path):
+    cache = FitCache(str(tmp_path))
+    record = {'status': 'ok', 'aic': 123.5, 'params': [0.5, -0.25, 1.0], 'converged': True}
+    cache.put('a', record)
+    assert cache.get('a') == record
+    assert cache.get('b') is None
+
+
+def test_key_depends_on_data_order_and_options():
+    data = np.arange(24, dtype=float)
+    key = fit_key(data, (1, 1, 1), (0, 1, 1, 12), {'maxiter': 50})
+    assert key == fit_key(list(data), (1, 1, 1), (0, 1, 1, 12), {'maxiter': 50})
+    assert key != fit_key(data + 1e-9, (1, 1, 1), (0, 1, 1, 12), {'maxiter': 50})
+    assert key != fit_key(data, (1, 1, 0), (0, 1, 1, 12), {'maxiter': 50})
+    assert key != fit_key(data, (1, 1, 1), (0, 1, 1, 12), {'maxiter': 100})
+
+
+def test_reads_do_not_extend_max_age(tmp_path):
+    cache = FitCache(str(tmp_path), max_age=100)
+    cache.put('a', {'x': 1})
+    _age(cache, 'a', 90)
+    assert cache.get('a') == {'x': 1}
+    assert cache.get('a') == {'x': 1}
+    _age(cache, 'a', 101)
+    assert cache.get('a') is None
+    assert not os.path.exists(os.path.join(cache.path, 'a.json'))
+
+
+def test_prune_drops_expired_then_least_recently_used(tmp_path):
+    cache = FitCache(str(tmp_path), max_age=1000)
+    for key in 'abcd':
+        cache.put(key, {'values': list(range(100))})
+    size = os.path.getsize(os.path.join(cache.path, 'a.json'))
+    _age(cache, 'a', 2000)
+    # b was written first but read last, so c goes before it
+    _age(cache, 'b', 30, read_seconds_ago=1)
+    _age(cache, 'c', 20, read_seconds_ago=20)
+    _age(cache, 'd', 10, read_seconds_ago=10)
+    cache.max_bytes = 2 * size
+    cache.prune()
+    assert sorted(os.listdir(cache.path)) == ['b.json', 'd.json']
+
+
+def test_cached_fit_matches_fresh_fit(tmp_path):
+    rng = np.random.default_rng(0)
+    t = np.arange(96)
+    data = 100 + 0.2 * t + 5 * np.sin(2 * np.pi * t / 12) + rng.normal(0, 1, len(t))
+    cache = FitCache(str(tmp_path))
+    fresh = fit_sarima_model(data, (1, 1, 0), (0, 1, 1, 12), cache)
+    cached = fit_sarima_model(data, (1, 1, 0), (0, 1, 1, 12), cache)
+    assert len(os.listdir(cache.path)) == 1
+    np.testing.assert_allclose(cached.params, fresh.params)
+    np.testing.assert_allclose(cached.forecast(12), fresh.forecast(12), rtol=1e-8)
@@ -0,0 +1,75 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from fit_queue import MAX_ATTEMPTS, FitQueue, _run_batch, search_sarima_orders_queued
+
+FILE = 'Table_4.3.xlsx'
+
+
+def _datasets():
+    rng = np.random.default_rng(0)
+    t = np.arange(72)[:, None]
+    values = 100 + 0.2 * t + 5 * np.sin(2 * np.pi * t / 12 + np.arange(2)) + rng.normal(0, 1, (72, 2))
+    return {FILE: pd.DataFrame(values, columns=['a', 'b'], index=pd.date_range('2000-01-01', periods=72, freq='MS'))}
+
+
+def _attempts(queue, batch):
+    with queue._connect() as conn:
+        return [row[0] for row in conn.execute('SELECT attempts FROM jobs WHERE batch = ? ORDER BY id', (batch,))]
+
+
+def test_expired_lease_is_claimed_again_then_fails(tmp_path):
+    queue = FitQueue(str(tmp_path / 'queue.sqlite'), lease=0.2, max_attempts=2)
+    batch = queue.submit({('f', 'a'): np.arange(5.0)}, [(('f', 'a'), {'kind': 'fit'})], {})
+    first = queue.claim('lost')
+    assert queue.claim('other') is None
+
+    # The first worker stops sending heartbeats; once its lease runs out the job goes to the next one
+    time.sleep(0.3)
+    second = queue.claim('other')
+    assert (second.id, second.attempts) == (first.id, 2)
+    assert not queue.heartbeat(first, 'lost')
+    assert queue.heartbeat(second, 'other')
+
+    # The last attempt expires as well: waiting marks the job failed instead of hanging
+    time.sleep(0.3)
+    assert queue.wait(batch, poll=0.05, timeout=5) == {'failed': 1}
+    assert 'lease expired' in queue.results(batch)[0][4]
+
+
+def test_failing_job_is_retried_then_recorded(tmp_path):
+    queue = FitQueue(str(tmp_path / 'queue.sqlite'))
+    series = {(FILE, 'a'): _datasets()[FILE]['a']}
+    jobs = [((FILE, 'a'), {'kind': 'unknown'}),
+            ((FILE, 'a'), {'kind': 'fit', 'order': [1, 1, 0], 'seasonal_order': [0, 1, 1, 12]})]
+    batch = queue.submit(series, jobs, {'time_limit': 60, 'max_iter': 50, 'warm_start': False, 'cache_dir': None})
+    assert _run_batch(queue, batch, local_workers=1, poll=0.05, timeout=60) == {'done': 1, 'failed': 1}
+
+    (_, _, status, result, error), (_, _, fit_status, fit_result, _) = queue.results(batch)
+    assert status == 'failed' and result is None and 'Unknown fit job kind' in error
+    assert fit_status == 'done' and np.isfinite(fit_result['aic'])
+    assert _attempts(queue, batch) == [MAX_ATTEMPTS, 1]
+
+
+def test_queued_search_matches_the_series(tmp_path):
+    queue = FitQueue(str(tmp_path / 'queue.sqlite'))
+    results = search_sarima_orders_queued(_datasets(), {FILE: ['a', 'b']}, queue, method='stepwise', max_fits=2,
+                                          local_workers=1, poll=0.05, timeout=120)
+    for column in ('a', 'b'):
+        assert results[FILE][column]['order'] is not None
+        assert results[FILE][column]['n_fits'] == 2 and results[FILE][column]['n_failed'] == 0
+    assert queue.counts() == {}
+
+
+def test_failed_stepwise_walk_is_counted_and_warned(tmp_path):
+    queue = FitQueue(str(tmp_path / 'queue.sqlite'))
+    # A fit budget the walk cannot compare against, so every stepwise job raises in the worker
+    with pytest.warns(RuntimeWarning, match='succeeded in the fit queue: TypeError'):
+        results = search_sarima_orders_queued(_datasets(), {FILE: ['a']}, queue, method='stepwise', max_fits=None,
+                                              local_workers=1, poll=0.05, timeout=120)
+    result = results[FILE]['a']
+    assert result['order'] is None and result['seasonal_order'] is None
+    assert result['n_fits'] == 1 and result['n_failed'] == 1
@@ -0,0 +1,57 @@
+import numpy as np
+from sklearn.ensemble import GradientBoostingRegressor
+
+from features import FeatureSpec, future_months
+from forecasting import CompiledEnsemble, recursive_gb_forecast
+
+FEATURE_SPEC = FeatureSpec(lags=(1, 2, 12), windows=(3,), calendar=True)
+
+
+def _series(n_months, n_series, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_months)[:, None]
+    return 50 + 0.1 * t + 5 * np.sin(2 * np.pi * t / 12 + np.arange(n_series)) + rng.normal(0, 1, (n_months, n_series))
+
+
+# One model per series, with different tree counts and depths so the compiled arrays are padded
+def _models(values, months):
+    X, y = FEATURE_SPEC.build(values, months)
+    models = []
+    for i in range(values.shape[1]):
+        model = GradientBoostingRegressor(n_estimators=20 + 15 * i, max_depth=2 + i, loss=['squared_error', 'huber', 'absolute_error'][i % 3], random_state=42)
+        models.append(model.fit(X[:, i], y[:, i]))
+    return models, X
+
+
+def test_compiled_ensemble_matches_sklearn_predict():
+    values = _series(120, 3)
+    months = np.arange(120) % 12 + 1
+    models, X = _models(values, months)
+    compiled = CompiledEnsemble.from_models(models, len(FEATURE_SPEC.names))
+
+    rows = X.transpose(1, 0, 2)
+    expected = np.array([model.predict(rows[i]) for i, model in enumerate(models)])
+    np.testing.assert_allclose(compiled.predict_rows(rows), expected, rtol=1e-12, atol=1e-9)
+    np.testing.assert_allclose(compiled.predict(rows[:, 5]), expected[:, 5], rtol=1e-12, atol=1e-9)
+
+    # Unseen rows, including values outside the training range
+    unseen = np.random.default_rng(1).normal(50, 30, rows.shape)
+    expected = np.array([model.predict(unseen[i]) for i, model in enumerate(models)])
+    np.testing.assert_allclose(compiled.predict_rows(unseen), expected, rtol=1e-12, atol=1e-9)
+
+
+def test_recursive_forecast_matches_per_model_loop():
+    values = _series(120, 3)
+    months = np.arange(120) % 12 + 1
+    models, _ = _models(values, months)
+    steps = 18
+    future = future_months(months[-1], steps)
+
+    # Reference: one sklearn predict call per series and step
+    buffer = values.copy()
+    for step in range(steps):
+        row = FEATURE_SPEC.next_row(buffer[-FEATURE_SPEC.history:], future[step])
+        buffer = np.vstack([buffer, [model.predict(row[i:i + 1])[0] for i, model in enumerate(models)]])
+
+    forecast = recursive_gb_forecast(models, values, FEATURE_SPEC, future, steps)
+    np.testing.assert_allclose(forecast, buffer[-steps:], rtol=1e-12, atol=1e-9)
@@ -0,0 +1,92 @@
+import os
+from datetime import datetime
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from ingest import interpolate_gaps, load_table, parse_table
+
+COLUMNS = ['Residential', 'Industrial']
+
+
+def _with_gaps(n_rows, n_columns, seed=0):
+    rng = np.random.default_rng(seed)
+    values = rng.normal(100, 10, (n_rows, n_columns))
+    values[rng.random(values.shape) < 0.3] = np.nan
+    # Leading, trailing and multi-month interior gaps, and a column with no observations
+    values[:3, 0] = np.nan
+    values[-4:, 1] = np.nan
+    values[10:15, 2] = np.nan
+    values[:, 3] = np.nan
+    return values
+
+
+def test_interpolate_gaps_matches_pandas():
+    values = _with_gaps(60, 5)
+    expected = pd.DataFrame(values).interpolate(method='linear').to_numpy()
+    np.testing.assert_allclose(interpolate_gaps(values), expected, rtol=1e-12)
+    np.testing.assert_allclose(interpolate_gaps(values[:, 2]), expected[:, 2], rtol=1e-12)
+    # Observed values are left untouched and the input is not modified
+    observed = ~np.isnan(values)
+    np.testing.assert_array_equal(interpolate_gaps(values)[observed], values[observed])
+    assert np.isnan(values[:3, 0]).all()
+
+
+def test_interpolate_gaps_keeps_dtype():
+    values = _with_gaps(40, 5).astype(np.float32)
+    filled = interpolate_gaps(values)
+    assert filled.dtype == np.float32
+    expected = pd.DataFrame(values.astype(np.float64)).interpolate(method='linear').to_numpy()
+    np.testing.assert_allclose(filled, expected, rtol=1e-6)
+
+
+# A sheet laid out like the EIA tables: header row, units row, then one row per month, with
+# columns that are not requested on either side of the wanted ones
+def _write_table(file, n_months=30):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(['Month', 'Other', 'Residential', 'Commercial', 'Industrial', 'Notes'])
+    sheet.append([None, '(units)', '(Trillion Btu)', '(Trillion Btu)', '(Trillion Btu)', None])
+    rng = np.random.default_rng(1)
+    for i in range(n_months):
+        row = [datetime(2000 + i // 12, i % 12 + 1, 1), 'x', *rng.normal(100, 10, 3).round(3), None]
+        if i in (0, 7, 8, 20):
+            row[2] = 'Not Available'
+        if i in (12, n_months - 1):
+            row[4] = 'Not Available'
+        sheet.append(row)
+    workbook.save(file)
+
+
+# The original pandas loader the parser replaced
+def _read_excel(file, columns):
+    df = pd.read_excel(file)
+    df = df.drop(df.index[0])
+    for column in columns:
+        df[column] = df[column].replace('Not Available', np.nan).astype(float).interpolate(method='linear')
+    return df[['Month'] + columns].set_index('Month')
+
+
+def test_parse_table_matches_read_excel(tmp_path):
+    file = str(tmp_path / 'Table_4.3.xlsx')
+    _write_table(file)
+    parsed = parse_table(file, COLUMNS)
+    expected = _read_excel(file, COLUMNS)
+    np.testing.assert_allclose(parsed.to_numpy(), expected.to_numpy(), rtol=1e-12)
+    np.testing.assert_array_equal(parsed.index, pd.DatetimeIndex(expected.index))
+    assert list(parsed.columns) == COLUMNS
+
+
+def test_load_table_cache(tmp_path):
+    file = str(tmp_path / 'Table_4.3.xlsx')
+    cache_dir = str(tmp_path / 'cache')
+    _write_table(file)
+    parsed = load_table(file, COLUMNS, cache_dir)
+    cached = load_table(file, COLUMNS[:1], cache_dir)
+    pd.testing.assert_frame_equal(cached, parsed[COLUMNS[:1]], check_freq=False)
+
+    # A changed workbook is parsed again
+    _write_table(file, n_months=31)
+    os.utime(file, ns=(0, os.stat(file).st_mtime_ns + 1))
+    assert len(load_table(file, COLUMNS, cache_dir)) == 31
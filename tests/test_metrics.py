@@ -0,0 +1,62 @@
+import numpy as np
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+
+from metrics import metric_arrays, metrics_table, mape, rmse
+
+KEYS = [('Table_3.7a.xlsx', 'a'), ('Table_3.7a.xlsx', 'b'), ('Table_4.3.xlsx', 'c')]
+
+
+def _reference(actual, prediction):
+    return {
+        'RMSE': np.sqrt(mean_squared_error(actual, prediction)),
+        'MAPE': np.mean(np.abs((actual - prediction) / actual)) * 100,
+        'MAE': mean_absolute_error(actual, prediction),
+        'R2': r2_score(actual, prediction),
+    }
+
+
+def test_metrics_match_sklearn():
+    rng = np.random.default_rng(0)
+    actuals = rng.normal(100, 10, (len(KEYS), 24))
+    predictions = {'SARIMA': actuals + rng.normal(0, 3, actuals.shape), 'GB': actuals + rng.normal(1, 5, actuals.shape)}
+    table = metrics_table(actuals, predictions, KEYS)
+    assert len(table) == len(predictions) * len(KEYS)
+    for row in table.itertuples():
+        i = KEYS.index((row.file, row.column))
+        expected = _reference(actuals[i], predictions[row.model][i])
+        for name, value in expected.items():
+            np.testing.assert_allclose(getattr(row, name), value, rtol=1e-10)
+    np.testing.assert_allclose(rmse(actuals[0], predictions['GB'][0]), _reference(actuals[0], predictions['GB'][0])['RMSE'])
+    np.testing.assert_allclose(mape(actuals[0], predictions['GB'][0]), _reference(actuals[0], predictions['GB'][0])['MAPE'])
+
+
+def test_fold_axis():
+    rng = np.random.default_rng(1)
+    actuals = rng.normal(100, 10, (4, len(KEYS), 12))
+    predictions = {'Stacked': actuals + rng.normal(0, 2, actuals.shape)}
+    table = metrics_table(actuals, predictions, KEYS)
+    assert list(table['fold']) == [fold for fold in range(4) for _ in KEYS]
+    row = table.iloc[5]
+    expected = _reference(actuals[row.fold, 2], predictions['Stacked'][row.fold, 2])
+    np.testing.assert_allclose(row[['RMSE', 'MAPE', 'MAE', 'R2']].to_numpy(dtype=float), list(expected.values()), rtol=1e-10)
+
+
+def test_missing_and_zero_actuals_are_masked():
+    rng = np.random.default_rng(2)
+    actual = rng.normal(100, 10, 24)
+    prediction = actual + rng.normal(0, 3, 24)
+    actual[[3, 10]] = np.nan
+    prediction[5] = np.nan
+    actual[7] = 0.0
+    scores = metric_arrays(actual, prediction)
+
+    valid = np.isfinite(actual) & np.isfinite(prediction)
+    np.testing.assert_allclose(scores['RMSE'], np.sqrt(mean_squared_error(actual[valid], prediction[valid])), rtol=1e-10)
+    np.testing.assert_allclose(scores['MAE'], mean_absolute_error(actual[valid], prediction[valid]), rtol=1e-10)
+    np.testing.assert_allclose(scores['R2'], r2_score(actual[valid], prediction[valid]), rtol=1e-10)
+    nonzero = valid & (actual != 0)
+    np.testing.assert_allclose(scores['MAPE'], _reference(actual[nonzero], prediction[nonzero])['MAPE'], rtol=1e-10)
+
+    # No usable months: NaN rather than a warning or infinity
+    empty = metric_arrays(np.full(5, np.nan), np.ones(5))
+    assert all(np.isnan(empty[name]) for name in ('RMSE', 'MAPE', 'MAE', 'R2'))
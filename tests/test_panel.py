@@ -0,0 +1,53 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from panel import Panel
+
+FILES_AND_COLUMNS = {'Table_3.7a.xlsx': ['a1', 'a2'], 'Table_4.3.xlsx': ['b']}
+
+
+def _table(columns, start, periods, offset=0.0):
+    index = pd.date_range(start, periods=periods, freq='MS', name='Month')
+    return pd.DataFrame({column: np.arange(periods, dtype=np.float64) + offset + i for i, column in enumerate(columns)}, index=index)
+
+
+def test_aligned_tables_split_like_each_table_on_its_own():
+    datasets = {'Table_3.7a.xlsx': _table(['a1', 'a2'], '2000-01-01', 50), 'Table_4.3.xlsx': _table(['b'], '2000-01-01', 50, 100)}
+    train, test = Panel.from_datasets(datasets, FILES_AND_COLUMNS).split(test_size=0.2)
+    for file, frame in datasets.items():
+        cut = int(len(frame) * 0.8)
+        pd.testing.assert_frame_equal(train.to_datasets()[file], frame.iloc[:cut], check_freq=False)
+        pd.testing.assert_frame_equal(test.to_datasets()[file], frame.iloc[cut:], check_freq=False)
+
+
+def test_ragged_tables_are_cut_to_common_months():
+    datasets = {'Table_3.7a.xlsx': _table(['a1', 'a2'], '2000-01-01', 50),
+                'Table_4.3.xlsx': _table(['b'], '1999-12-01', 52, 100)}
+    with pytest.warns(UserWarning, match='dropping 2 month'):
+        panel = Panel.from_datasets(datasets, FILES_AND_COLUMNS)
+    assert len(panel) == 50
+    assert panel.index[0] == pd.Timestamp('2000-01-01') and panel.index[-1] == pd.Timestamp('2004-02-01')
+    train, test = panel.split(test_size=0.2)
+    # No series is left with missing test months, so the stackers can be fitted on them
+    assert not np.isnan(test.values).any()
+    assert not np.isnan(train.values).any()
+    np.testing.assert_array_equal(panel.series('Table_4.3.xlsx', 'b').to_numpy(), np.arange(1, 51) + 100.0)
+
+
+def test_ragged_tables_can_be_rejected():
+    datasets = {'Table_3.7a.xlsx': _table(['a1', 'a2'], '2000-01-01', 50), 'Table_4.3.xlsx': _table(['b'], '2000-01-01', 51)}
+    with pytest.raises(ValueError, match='different months'):
+        Panel.from_datasets(datasets, FILES_AND_COLUMNS, ragged='raise')
+
+
+def test_frames_and_splits_are_views():
+    datasets = {'Table_3.7a.xlsx': _table(['a1', 'a2'], '2000-01-01', 20), 'Table_4.3.xlsx': _table(['b'], '2000-01-01', 20)}
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        panel = Panel.from_datasets(datasets, FILES_AND_COLUMNS)
+    train, _ = panel.split()
+    assert np.shares_memory(train.values, panel.values)
+    assert np.shares_memory(panel.frame('Table_3.7a.xlsx').to_numpy(), panel.values)
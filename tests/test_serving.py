@@ -0,0 +1,67 @@
+import asyncio
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import GradientBoostingRegressor
+from sklearn.linear_model import LinearRegression
+from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+from artifacts import save_artifacts
+from features import FeatureSpec
+from serving import ForecastService
+
+FEATURE_SPEC = FeatureSpec(lags=(1, 2, 12), windows=(3,), calendar=True)
+KEYS = [('Table_4.3.xlsx', 'a'), ('Table_4.3.xlsx', 'b')]
+
+
+def _service(tmp_path):
+    rng = np.random.default_rng(0)
+    index = pd.date_range('2005-01-01', periods=96, freq='MS')
+    t = np.arange(len(index))[:, None]
+    values = 50 + 0.1 * t + 5 * np.sin(2 * np.pi * t / 12 + np.arange(len(KEYS))) + rng.normal(0, 1, (len(index), len(KEYS)))
+    X, y = FEATURE_SPEC.build(values, index.month.to_numpy())
+    sarima_models, gb_models, stackers, residuals = {}, {}, {}, []
+    for i, (file, column) in enumerate(KEYS):
+        model_fit = SARIMAX(values[:, i], order=(1, 1, 0), seasonal_order=(0, 1, 1, 12)).fit(disp=False)
+        gb = GradientBoostingRegressor(n_estimators=20, random_state=42).fit(X[:, i], y[:, i])
+        stacker = LinearRegression().fit(np.column_stack([model_fit.fittedvalues[FEATURE_SPEC.history:], gb.predict(X[:, i])]), y[:, i])
+        sarima_models.setdefault(file, {})[column] = model_fit
+        gb_models.setdefault(file, {})[column] = gb
+        stackers.setdefault(file, {})[column] = stacker
+        residuals.append(y[-24:, i] - gb.predict(X[-24:, i]))
+    save_artifacts(KEYS, sarima_models, gb_models, stackers, values, index[-1], FEATURE_SPEC, residuals, path=str(tmp_path))
+    return ForecastService(str(tmp_path))
+
+
+def test_cancelled_first_request_does_not_cancel_coalesced_requests(tmp_path):
+    service = _service(tmp_path)
+    started = threading.Event()
+    release = threading.Event()
+    compute = service._compute
+
+    # Hold the computation until both requests are waiting for it
+    def held(*args):
+        started.set()
+        release.wait(10)
+        return compute(*args)
+    service._compute = held
+
+    async def scenario():
+        first = asyncio.create_task(service.forecast(KEYS[0], 12, 0.8))
+        while not started.is_set():
+            await asyncio.sleep(0.01)
+        second = asyncio.create_task(service.forecast(KEYS[1], 12, 0.8))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    result = asyncio.run(scenario())
+    assert result['column'] == 'b' and len(result['forecast']) == 12
+    assert service.computations == 1 and service._inflight == {}
+    # The results reached the cache although the request that started the computation was gone
+    assert len(service.cache) == len(KEYS)
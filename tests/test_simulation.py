@@ -0,0 +1,60 @@
+import numpy as np
+from sklearn.ensemble import GradientBoostingRegressor
+from sklearn.linear_model import LinearRegression
+from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+from artifacts import state_space_arrays
+from features import FeatureSpec, future_months
+from forecasting import generate_forecasts, row_predictor
+from simulation import stacked_intervals
+
+FEATURE_SPEC = FeatureSpec(lags=(1, 2, 12), windows=(3,), calendar=True)
+STEPS = 24
+
+
+def _models():
+    rng = np.random.default_rng(0)
+    t = np.arange(120)[:, None]
+    values = 50 + 0.1 * t + 5 * np.sin(2 * np.pi * t / 12 + np.arange(3)) + rng.normal(0, 1, (120, 3))
+    months = t[:, 0] % 12 + 1
+    X, y = FEATURE_SPEC.build(values, months)
+    sarima, gb, stackers, residuals = [], [], [], []
+    for i in range(values.shape[1]):
+        model_fit = SARIMAX(values[:, i], order=(1, 1, 1), seasonal_order=(0, 1, 1, 12)).fit(disp=False)
+        model = GradientBoostingRegressor(n_estimators=40, max_depth=3, random_state=42).fit(X[:, i], y[:, i])
+        sarima.append(model_fit)
+        gb.append(model)
+        stackers.append(LinearRegression().fit(np.column_stack([model_fit.fittedvalues[FEATURE_SPEC.history:], model.predict(X[:, i])]), y[:, i]))
+        residuals.append(rng.normal(0, 3, 24))
+    return sarima, gb, stackers, residuals, values, future_months(months[-1], STEPS)
+
+
+def _intervals(sarima, gb, stackers, residuals, values, months, **kwargs):
+    return stacked_intervals(state_space_arrays(sarima), row_predictor(gb, len(FEATURE_SPEC.names)), values, FEATURE_SPEC,
+                             months, residuals, [s.coef_ for s in stackers], [s.intercept_ for s in stackers], STEPS,
+                             levels=(0.5, 0.8, 0.95), n_paths=400, gb_paths=100, seed=1, **kwargs)
+
+
+def test_point_forecast_lies_inside_every_band():
+    sarima, gb, stackers, residuals, values, months = _models()
+    forecast = generate_forecasts(sarima, values, gb, stackers, STEPS, FEATURE_SPEC, months)
+    simulation = _intervals(sarima, gb, stackers, residuals, values, months, forecast=forecast)
+    np.testing.assert_array_equal(simulation['forecast'], forecast)
+    previous = (forecast, forecast)
+    for level in (0.5, 0.8, 0.95):
+        lower, upper = simulation['intervals'][level]
+        assert (lower <= forecast).all() and (forecast <= upper).all()
+        # Wider levels nest around narrower ones
+        assert (lower <= previous[0]).all() and (previous[1] <= upper).all()
+        previous = (lower, upper)
+
+
+def test_forecast_defaults_to_the_point_forecast_of_the_inputs():
+    sarima, gb, stackers, residuals, values, months = _models()
+    expected = generate_forecasts(sarima, values, gb, stackers, STEPS, FEATURE_SPEC, months)
+    simulation = _intervals(sarima, gb, stackers, residuals, values, months)
+    np.testing.assert_allclose(simulation['forecast'], expected, rtol=1e-8)
+    given = _intervals(sarima, gb, stackers, residuals, values, months, forecast=expected)
+    for level, (lower, upper) in simulation['intervals'].items():
+        np.testing.assert_allclose(lower, given['intervals'][level][0], rtol=1e-8)
+        np.testing.assert_allclose(upper, given['intervals'][level][1], rtol=1e-8)
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingRegressor
+from sklearn.linear_model import LinearRegression
+
+from features import FeatureSpec
+from sarima_search import fit_sarima_model
+from updating import ModelUpdater
+
+FEATURE_SPEC = FeatureSpec(lags=(1, 2, 12), windows=(3,), calendar=True)
+KEYS = [('Table_4.3.xlsx', 'a'), ('Table_4.3.xlsx', 'b')]
+ORDERS = {'Table_4.3.xlsx': {column: {'order': (1, 1, 0), 'seasonal_order': (0, 1, 1, 12)} for column in ('a', 'b')}}
+N_TRAIN, N_TEST = 96, 24
+
+
+def _values(n_months, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_months)[:, None]
+    return 100 + 0.2 * t + 5 * np.sin(2 * np.pi * t / 12 + np.arange(len(KEYS))) + rng.normal(0, 1, (n_months, len(KEYS)))
+
+
+# Models fitted on the training months and stackers fitted on the test months, as in the script
+def _updater(**options):
+    values = _values(N_TRAIN + N_TEST)
+    index = pd.date_range('2000-01-01', periods=len(values), freq='MS')
+    X, y = FEATURE_SPEC.build(values, index.month)
+    n_rows = N_TRAIN - FEATURE_SPEC.history
+    sarima_models, gb_models, stacked_models = {'Table_4.3.xlsx': {}}, {'Table_4.3.xlsx': {}}, {'Table_4.3.xlsx': {}}
+    stacker_X, stacker_y, stacker_index = {}, {}, {}
+    for j, (file, column) in enumerate(KEYS):
+        model_fit = fit_sarima_model(values[:N_TRAIN, j], (1, 1, 0), (0, 1, 1, 12))
+        gb = GradientBoostingRegressor(n_estimators=30, random_state=42).fit(X[:n_rows, j], y[:n_rows, j])
+        predictions = np.column_stack([model_fit.forecast(N_TEST), gb.predict(X[n_rows:, j])])
+        sarima_models[file][column] = model_fit
+        gb_models[file][column] = gb
+        stacked_models[file][column] = LinearRegression().fit(predictions, values[N_TRAIN:, j])
+        stacker_X[(file, column)], stacker_y[(file, column)] = predictions, values[N_TRAIN:, j]
+        stacker_index[(file, column)] = index[N_TRAIN:]
+    updater = ModelUpdater(KEYS, sarima_models, gb_models, stacked_models, values[:N_TRAIN], index[:N_TRAIN], FEATURE_SPEC,
+                           stacker_X, stacker_y, stacker_index, ORDERS, **options)
+    return updater, values, index
+
+
+def test_update_extends_sarima_and_counts_test_months_once():
+    updater, values, index = _updater(refit_every=1000, drift_threshold=1e9)
+    before = {key: updater.sarima_models[key[0]][key[1]] for key in KEYS}
+    # The stackers' test rows lie after the models' last month, so they do not seed the stats
+    assert all(not stats.xtx.any() for stats in updater.stacker_stats.values())
+
+    assert updater.update(values[N_TRAIN:], index[N_TRAIN:]) == {}
+    for j, (file, column) in enumerate(KEYS):
+        expected = before[(file, column)].extend(values[N_TRAIN:, j])
+        np.testing.assert_allclose(updater.sarima_models[file][column].forecast(12), expected.forecast(12), rtol=1e-10)
+        # The stats hold each test month exactly once: the rows update() saw
+        assert updater.stacker_stats[(file, column)].xtx[0, 0] == N_TEST
+    assert len(updater.history) == N_TRAIN + N_TEST
+
+
+def test_missing_month_does_not_crash():
+    updater, values, index = _updater(refit_every=1000, drift_threshold=1e9)
+    new_values = values[N_TRAIN:N_TRAIN + 6].copy()
+    new_values[2, 0] = np.nan
+    updater.update(new_values[:3], index[N_TRAIN:N_TRAIN + 3])
+    # The next months' lag features now hold the missing value
+    updater.update(new_values[3:], index[N_TRAIN + 3:N_TRAIN + 6])
+    # Only the first two months reach the stacker: the third is missing and the lags or 3-month
+    # mean of the last three months include it
+    assert updater.stacker_stats[KEYS[0]].xtx[0, 0] == 2
+    assert updater.stacker_stats[KEYS[1]].xtx[0, 0] == 6
+    assert all(np.isfinite(updater.stacked_models[file][column].coef_).all() for file, column in KEYS)
+
+
+def test_drift_refits_the_series_and_its_stacker():
+    updater, values, index = _updater(refit_every=1000, drift_threshold=3.0)
+    new_values = values[N_TRAIN:].copy()
+    new_values[:, 1] += 60
+    old_gb = updater.gb_models['Table_4.3.xlsx']['b']
+    old_coef = updater.stacked_models['Table_4.3.xlsx']['b'].coef_.copy()
+
+    refitted = updater.update(new_values, index[N_TRAIN:])
+    assert refitted == {KEYS[1]: 'drift'}
+    assert updater.gb_models['Table_4.3.xlsx']['b'] is not old_gb
+    assert updater.months_since_refit[KEYS[1]] == 0 and updater.months_since_refit[KEYS[0]] == N_TEST
+    # The stacker is rebuilt from the refitted models' held-out predictions
+    stats = updater.stacker_stats[KEYS[1]]
+    assert stats.xtx[0, 0] == updater.stacker_window
+    assert not np.allclose(updater.stacked_models['Table_4.3.xlsx']['b'].coef_, old_coef)
+    np.testing.assert_allclose(updater.sarima_models['Table_4.3.xlsx']['b'].forecast(1),
+                               fit_sarima_model(updater.history[:, 1], (1, 1, 0), (0, 1, 1, 12)).forecast(1), rtol=1e-6)
+
+
+def test_scheduled_refit():
+    updater, values, index = _updater(refit_every=12, drift_threshold=1e9)
+    assert updater.update(values[N_TRAIN:N_TRAIN + 6], index[N_TRAIN:N_TRAIN + 6]) == {}
+    assert updater.update(values[N_TRAIN + 6:N_TRAIN + 12], index[N_TRAIN + 6:N_TRAIN + 12]) == {key: 'schedule' for key in KEYS}
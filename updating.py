@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""Incremental model updates for new months of EIA data
+
+Rolls the fitted models forward one batch of new observations at a time:
+SARIMA results are extended with the new points (existing parameters, the
+state-space filter run forward from the last state), the GB models grow a
+few warm-started trees fitted on a recent window, and the linear stackers
+are updated from their accumulated normal equations. A full refit of a
+series only runs when its one-step errors drift or its refit is due, so the
+cost of a monthly refresh depends on the number of new points rather than
+on the length of the history. A refit also rebuilds the series' stacker
+from out-of-sample predictions of the refitted models on the last months.
+"""
+
+import numpy as np
+from sklearn.ensemble import GradientBoostingRegressor
+
+from sarima_search import fit_sarima_model
+
+# Full refit of a series after this many months of incremental updates
+REFIT_EVERY = 12
+
+# Full refit when the mean absolute standardized one-step SARIMA error on the new points exceeds this
+DRIFT_THRESHOLD = 3.0
+
+# Months of history the warm-started GB trees are fitted on, and trees added per update
+GB_WINDOW = 60
+GB_NEW_ESTIMATORS = 10
+
+# Months held out of a full refit to fit the series' new stacker on
+STACKER_WINDOW = 24
+
+
+# Accumulated normal equations of a linear stacker, so new rows update it without the old ones
+class StackerStats:
+    def __init__(self, X, y):
+        A = self._design(X)
+        self.xtx = A.T @ A
+        self.xty = A.T @ np.asarray(y, dtype=np.float64)
+
+    @staticmethod
+    def _design(X):
+        X = np.asarray(X, dtype=np.float64)
+        return np.column_stack([np.ones(len(X)), X])
+
+    def update(self, X, y):
+        A = self._design(X)
+        self.xtx += A.T @ A
+        self.xty += A.T @ np.asarray(y, dtype=np.float64)
+
+    # Write the least-squares solution into a fitted LinearRegression; until the accumulated
+    # rows determine a solution the stacker keeps its coefficients
+    def apply(self, stacker):
+        if np.linalg.matrix_rank(self.xtx) < len(self.xtx):
+            return stacker
+        solution = np.linalg.lstsq(self.xtx, self.xty, rcond=None)[0]
+        stacker.intercept_ = solution[0]
+        stacker.coef_ = solution[1:]
+        return stacker
+
+
+# Extend a SARIMA results object with new observations, keeping its parameters
+def extend_sarima(model_fit, new_observations):
+    return model_fit.extend(np.asarray(new_observations, dtype=np.float64))
+
+
+# Mean absolute standardized one-step error of an extended model on its new points
+def drift_score(extended):
+    errors = extended.standardized_forecasts_error[0]
+    errors = errors[np.isfinite(errors)]
+    return float(np.mean(np.abs(errors))) if len(errors) else 0.0
+
+
+# Grow a GB model by a few trees fitted on recent rows only (warm start keeps the existing trees)
+def update_gb(gb, X_recent, y_recent, n_new_estimators=GB_NEW_ESTIMATORS):
+    gb.set_params(warm_start=True, n_estimators=gb.n_estimators + n_new_estimators)
+    gb.fit(X_recent, y_recent)
+    return gb
+
+
+class ModelUpdater:
+    # keys are the (file, column) series in the column order of history, which holds the
+    # months the models were fitted on. stacker_X / stacker_y hold, per series, the
+    # (sarima, gb) predictions and targets each stacker was fitted on and stacker_index their
+    # months. Only rows before the end of history seed the stackers' normal equations: later
+    # months are added when update() rolls the models over them, so none is counted twice
+    def __init__(self, keys, sarima_models, gb_models, stacked_models, history, index, feature_spec,
+                 stacker_X, stacker_y, stacker_index, orders, cache=None, refit_every=REFIT_EVERY,
+                 drift_threshold=DRIFT_THRESHOLD, gb_window=GB_WINDOW, gb_new_estimators=GB_NEW_ESTIMATORS,
+                 stacker_window=STACKER_WINDOW):
+        self.keys = list(keys)
+        self.sarima_models = sarima_models
+        self.gb_models = gb_models
+        self.stacked_models = stacked_models
+        self.history = np.asarray(history, dtype=np.float64)
+        self.index = index
+        self.feature_spec = feature_spec
+        self.stacker_stats = {}
+        for key in self.keys:
+            seen = np.asarray(stacker_index[key] <= index[-1])
+            self.stacker_stats[key] = StackerStats(np.asarray(stacker_X[key])[seen], np.asarray(stacker_y[key])[seen])
+        self.orders = orders
+        self.cache = cache
+        self.refit_every = refit_every
+        self.drift_threshold = drift_threshold
+        self.gb_window = gb_window
+        self.gb_new_estimators = gb_new_estimators
+        self.stacker_window = stacker_window
+        self.months_since_refit = {key: 0 for key in self.keys}
+
+    # Roll every model forward over new_values (n_new_months, n_series) observed at new_index.
+    # Returns the series that were fully refitted and why
+    def update(self, new_values, new_index):
+        new_values = np.asarray(new_values, dtype=np.float64)
+        if new_values.ndim == 1:
+            new_values = new_values[None, :]
+        n_old = len(self.history)
+        self.history = np.vstack([self.history, new_values])
+        self.index = self.index.append(new_index)
+        months = np.asarray(self.index.month)
+        n_new = len(new_values)
+
+        # Features for the new months (plus the recent GB window) from the tail of the history only
+        h = self.feature_spec.history
+        start = max(0, n_old - self.gb_window - h)
+        X, y = self.feature_spec.build(self.history[start:], months[start:])
+        X_new = X[-n_new:]
+
+        refitted = {}
+        for j, key in enumerate(self.keys):
+            file, column = key
+            self.months_since_refit[key] += n_new
+            if self.months_since_refit[key] >= self.refit_every:
+                refitted[key] = 'schedule'
+                self._refit(j, key)
+                continue
+            extended = extend_sarima(self.sarima_models[file][column], new_values[:, j])
+            if drift_score(extended) > self.drift_threshold:
+                refitted[key] = 'drift'
+                self._refit(j, key)
+                continue
+
+            # One-step predictions of both base models on the new months feed the stacker; a missing
+            # month leaves no target, and missing lags no GB prediction, so those rows are skipped
+            gb = self.gb_models[file][column]
+            observed = np.isfinite(X_new[:, j]).all(axis=1) & np.isfinite(new_values[:, j])
+            sarima_one_step = np.asarray(extended.fittedvalues)[observed]
+            gb_one_step = gb.predict(X_new[observed, j]) if observed.any() else np.empty(0)
+            self.stacker_stats[key].update(np.column_stack([sarima_one_step, gb_one_step]), new_values[observed, j])
+            self.stacker_stats[key].apply(self.stacked_models[file][column])
+
+            rows = np.isfinite(X[:, j]).all(axis=1) & np.isfinite(y[:, j])
+            update_gb(gb, X[rows, j], y[rows, j], self.gb_new_estimators)
+            self.sarima_models[file][column] = extended
+        return refitted
+
+    # Full refit of one series on its whole history. The stacker is rebuilt first, the way it was
+    # fitted originally: both models are fitted without the last stacker_window months, predict
+    # them (SARIMA as a multi-step forecast, GB from the observed lags) and the stacker is fitted
+    # on those predictions; then both models are refitted on everything
+    def _refit(self, j, key):
+        file, column = key
+        series = self.history[:, j]
+        months = np.asarray(self.index.month)
+        order = self.orders[file][column]
+        X, y = self.feature_spec.build(series, months)
+        X, y = X[:, 0], y[:, 0]
+        rows = np.isfinite(X).all(axis=1) & np.isfinite(y)
+
+        window = self.stacker_window
+        cut = len(y) - window
+        sarima = fit_sarima_model(series[:-window], order['order'], order['seasonal_order'], self.cache)
+        gb = GradientBoostingRegressor(random_state=42).fit(X[:cut][rows[:cut]], y[:cut][rows[:cut]])
+        held_out = rows[cut:]
+        predictions = np.column_stack([np.asarray(sarima.forecast(window))[held_out], gb.predict(X[cut:][held_out])])
+        self.stacker_stats[key] = StackerStats(predictions, y[cut:][held_out])
+        self.stacker_stats[key].apply(self.stacked_models[file][column])
+
+        # Warm-started from the previous fit of this series when the cache has it
+        self.sarima_models[file][column] = fit_sarima_model(series, order['order'], order['seasonal_order'], self.cache,
+                                                            f'{file}|{column}', warm_start=True)
+        self.gb_models[file][column] = GradientBoostingRegressor(random_state=42).fit(X[rows], y[rows])
+        self.months_since_refit[key] = 0